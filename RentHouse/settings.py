@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'users.instrumentation.RequestInstrumentationMiddleware', # First, so that it times everything below
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -142,4 +143,91 @@ AUTH_USER_MODEL = 'users.CustomUser' # IMPORTANT: Tells Django to use your custo
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 LOGIN_URL = '/login/'
-LOGIN_REDIRECT_URL = '/'
\ No newline at end of file
+LOGIN_REDIRECT_URL = '/'
+
+# Real-time chat (users/realtime.py): websockets are served by RentHouse/asgi.py, so run
+# the site under an ASGI server (e.g. `uvicorn RentHouse.asgi:application`) to enable them.
+# The in-process broadcast only reaches clients connected to the same process.
+CHAT_BROADCAST_BACKEND = 'users.realtime.InMemoryBroadcast'
+
+
+# Caching (users/caching.py): property cards on the home page are cached per listing version,
+# and anonymous home page hits are served entirely from the cache.
+# Local memory by default; point RENTHOUSE_CACHE_BACKEND/RENTHOUSE_CACHE_LOCATION at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache, redis://127.0.0.1:6379) when
+# running several processes, so that invalidations reach all of them.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('RENTHOUSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('RENTHOUSE_CACHE_LOCATION', 'renthouse'),
+    }
+}
+LISTING_CACHE_ALIAS = 'default'
+LISTING_PAGE_CACHE_TIMEOUT = 60 * 5 # Seconds an anonymous listing page is cached
+LISTING_CARD_CACHE_TIMEOUT = 60 * 60 * 24 # Seconds a property card fragment is cached
+LISTING_COUNT_CAP = 1000 # Result counts above this are shown as "1000+" (see users/pagination.py)
+ADMIN_EXACT_COUNT_LIMIT = 10000 # Admin changelists show MySQL's row estimate above this many rows
+
+
+# Background workers (users/tasks.py): thread pool of each web process for slow jobs.
+BACKGROUND_TASK_WORKERS = 2
+BACKGROUND_TASKS_EAGER = False # Run jobs inline instead (tests)
+
+# PDF receipts (users/receipts.py): rendered by the background workers and kept on disk.
+# Bump RECEIPT_TEMPLATE_VERSION after changing the receipt layout so that receipts are re-rendered.
+RECEIPT_CACHE_DIR = BASE_DIR / 'receipt_cache' # Not served publicly: receipts hold personal data
+RECEIPT_TEMPLATE_VERSION = '1'
+RECEIPT_PDF_RENDERER = 'auto' # 'wkhtmltopdf' (needs pdfkit + wkhtmltopdf), 'python', or 'auto'
+RECEIPT_PDF_WAIT_SECONDS = 1 # How long a download waits for a receipt that is still rendering (holds a web worker)
+RECEIPT_EXPORT_WAIT_SECONDS = 30 # How long a bulk export waits in all for receipts it has to render first
+
+# Geocoding (users/geocoding.py): property addresses are geocoded once on the server and cached.
+# GEOCODING_PROVIDER is the dotted path of a users.geocoding.GeocodingProvider; use
+# 'users.geocoding.StaticProvider' (answers from GEOCODING_STATIC_RESULTS) to work offline.
+GEOCODING_PROVIDER = os.environ.get('RENTHOUSE_GEOCODING_PROVIDER', 'users.geocoding.NominatimProvider')
+GEOCODING_USER_AGENT = 'RentUrHouse/1.0' # Nominatim requires an identifying User-Agent
+GEOCODING_TIMEOUT = 5 # Seconds
+GEOCODING_SEARCH_TIMEOUT = 2 # Seconds, for places typed in the listing search (looked up during the request)
+GEOCODING_MIN_INTERVAL = 1.0 # Seconds between two Nominatim requests (their usage policy)
+GEOCODING_STATIC_RESULTS = {}
+
+# Request instrumentation (users/instrumentation.py): every request is timed and logged on
+# "renthouse.requests"; a sample also records its SQL queries and template rendering.
+# Per-view statistics of this process are at /api/stats/requests/ (staff only).
+REQUEST_SAMPLE_RATE = float(os.environ.get('RENTHOUSE_REQUEST_SAMPLE_RATE', '0.1')) # Share of requests instrumented
+SLOW_REQUEST_MS = 1000 # Requests slower than this are logged as warnings
+SLOW_QUERY_MS = 200 # Queries slower than this are logged on "renthouse.slow_queries"
+DUPLICATE_QUERY_THRESHOLD = 5 # The same query this many times in one request is reported (likely N+1)
+REQUEST_STATS_WINDOW = 500 # Latest requests per view kept for the statistics
+
+# Metrics (users/metrics.py), in the Prometheus text format at /metrics.
+# Under a preforking server (several worker processes) set RENTHOUSE_METRICS_DIR to a directory
+# shared by the workers, and empty it when the server starts; every worker keeps its counters
+# in a file there and /metrics adds them up.
+METRICS_DIR = os.environ.get('RENTHOUSE_METRICS_DIR') or None
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1'] # Scrapers allowed without logging in (staff always are)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timestamped': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'timestamped'},
+    },
+    'loggers': {
+        'renthouse': {
+            'handlers': ['console'],
+            'level': os.environ.get('RENTHOUSE_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        # One line per request at INFO; slow requests are logged at WARNING.
+        # Set RENTHOUSE_REQUEST_LOG_LEVEL=INFO to log every request.
+        'renthouse.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('RENTHOUSE_REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
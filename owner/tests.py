@@ -1,3 +1,385 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from users import receipts
+from users.models import Booking, ChatMessage, Conversation, CustomUser, MaintenanceRequest, PaymentRecord, Property, PropertyImage, StatusChange
+from users.tests import OFFLINE_GEOCODER, make_jpeg, metric_value
+
+
+class OwnerDashboardQueryBudgetTests(TestCase):
+    """
+    The owner dashboard must run the same number of queries whatever the size of the portfolio.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner', full_name='Owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student', full_name='Tenant')
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def add_properties(self, count):
+        """
+        Creates `count` properties, each with a pending and a confirmed booking,
+        a maintenance request, a payment and a conversation with the tenant.
+        """
+        start = Property.objects.count()
+        properties = Property.objects.bulk_create([
+            Property(
+                house_type='House', title=f'Property {start + i}', rent=500, address=f'{start + i} Jalan Test',
+                owner=self.owner, main_image='property_images/test.jpg',
+            )
+            for i in range(count)
+        ])
+        bookings = Booking.objects.bulk_create([
+            Booking(property=property_obj, tenant=self.tenant, start_date=date.today() + timedelta(days=i), status=status)
+            for i, property_obj in enumerate(properties)
+            for status in ('pending', 'confirmed')
+        ])
+        MaintenanceRequest.objects.bulk_create([
+            MaintenanceRequest(property=property_obj, submitted_by=self.tenant, issue_title='Leak', issue_description='Leaky tap')
+            for property_obj in properties
+        ])
+        PaymentRecord.objects.bulk_create([
+            PaymentRecord(
+                user=self.tenant, booking=booking, receiver_of_payment=self.owner,
+                full_name='Tenant', email='tenant@example.com', amount=500,
+            )
+            for booking in bookings[1::2]
+        ])
+        chat_messages = ChatMessage.objects.bulk_create([
+            ChatMessage(sender=self.tenant, receiver=self.owner, property=property_obj, message='Hello')
+            for property_obj in properties
+        ])
+        participant_a, participant_b = sorted([self.owner, self.tenant], key=lambda user: user.pk)
+        Conversation.objects.bulk_create([
+            Conversation(
+                property_id=msg.property_id, participant_a=participant_a, participant_b=participant_b,
+                last_message=msg, last_message_at=msg.timestamp,
+            )
+            for msg in chat_messages
+        ])
+
+    def count_dashboard_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('owner:owner_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_is_constant_as_portfolio_grows(self):
+        self.add_properties(1)
+        baseline = self.count_dashboard_queries()
+
+        self.add_properties(499)
+        self.assertEqual(Property.objects.filter(owner=self.owner).count(), 500)
+        self.assertEqual(self.count_dashboard_queries(), baseline)
+
+    def test_pending_bookings_are_derived_from_all_bookings(self):
+        self.add_properties(3)
+        response = self.client.get(reverse('owner:owner_dashboard'))
+
+        pending = response.context['pending_bookings']
+        self.assertEqual(len(pending), 3)
+        self.assertTrue(all(booking.status == 'pending' for booking in pending))
+        self.assertEqual([b.start_date for b in pending], sorted(b.start_date for b in pending))
+        self.assertEqual(len(response.context['all_owner_bookings']), 6)
+
+
+class BulkStatusActionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.other_owner = CustomUser.objects.create_user('other', 'other@example.com', 'pw', role='owner')
+        cls.admin = CustomUser.objects.create_superuser('root', 'root@example.com', 'pw')
+        tenants = [
+            CustomUser.objects.create_user(f'tenant{i}', f'tenant{i}@example.com', 'pw', role='student') for i in range(4)
+        ]
+        cls.properties = Property.objects.bulk_create([
+            Property(house_type='House', title=f'Property {i}', rent=500, address=f'{i} Jalan Test', owner=owner, main_image='property_images/test.jpg')
+            for i, owner in enumerate([cls.owner, cls.owner, cls.other_owner])
+        ])
+        # Booking.save() keeps the property counters: two pending and a confirmed booking on the first property
+        cls.bookings = [
+            Booking.objects.create(property=property_obj, tenant=tenant, start_date=date.today(), status=status, number_of_occupants=2)
+            for property_obj, tenant, status in [
+                (cls.properties[0], tenants[0], 'pending'), (cls.properties[0], tenants[1], 'pending'),
+                (cls.properties[0], tenants[2], 'confirmed'), (cls.properties[2], tenants[3], 'pending'),
+            ]
+        ]
+        cls.maintenance = MaintenanceRequest.objects.bulk_create([
+            MaintenanceRequest(property=property_obj, submitted_by=tenants[0], issue_title='Leak', issue_description='Leaky tap', status=status)
+            for property_obj, status in [(cls.properties[0], 'pending'), (cls.properties[1], 'in_progress'), (cls.properties[1], 'done')]
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def post(self, url_name, data):
+        response = self.client.post(reverse(url_name), data)
+        self.assertRedirects(response, reverse('owner:owner_dashboard'), fetch_redirect_response=False)
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_dashboard_has_bulk_forms(self):
+        response = self.client.get(reverse('owner:owner_dashboard'))
+        self.assertContains(response, f'value="{self.bookings[0].pk}" form="bulk-booking-form"')
+        self.assertContains(response, reverse('owner:bulk_booking_action'))
+        self.assertContains(response, reverse('owner:bulk_maintenance_status'))
+
+    def test_confirm_selected_bookings(self):
+        confirmed = metric_value('renthouse_bookings_total', event='confirmed')
+        pending, _, already_confirmed, other_owners = self.bookings
+        with self.captureOnCommitCallbacks(execute=True):
+            messages = self.post('owner:bulk_booking_action', {
+                'action': 'confirm', 'booking_ids': [pending.pk, already_confirmed.pk, other_owners.pk],
+            })
+        self.assertEqual(messages, [
+            '1 booking(s) confirmed.', '1 booking(s) skipped: only pending bookings can be confirmed.',
+        ])
+
+        statuses = dict(Booking.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[pending.pk], 'confirmed')
+        self.assertEqual(statuses[other_owners.pk], 'pending') # Not the owner's booking
+        property_obj = Property.objects.get(pk=self.properties[0].pk)
+        self.assertEqual((property_obj.pending_bookings_count, property_obj.confirmed_bookings_count, property_obj.active_occupants), (1, 2, 6))
+        self.assertEqual(Property.objects.recompute_booking_counters(dry_run=True), [])
+
+        change = StatusChange.objects.get()
+        self.assertEqual(
+            (change.kind, change.object_id, change.from_status, change.to_status, change.changed_by, change.source),
+            ('booking', pending.pk, 'pending', 'confirmed', self.owner, 'dashboard'),
+        )
+        self.assertEqual(metric_value('renthouse_bookings_total', event='confirmed'), confirmed + 1)
+
+    def test_reject_runs_a_fixed_number_of_queries(self):
+        extra_tenant = CustomUser.objects.create_user('tenant9', 'tenant9@example.com', 'pw', role='student')
+        many = Booking.objects.bulk_create([
+            Booking(property=self.properties[1], tenant=extra_tenant, start_date=date.today(), status='pending') for _ in range(30)
+        ])
+        Property.objects.recompute_booking_counters()
+        ids = [self.bookings[0].pk] + [booking.pk for booking in many]
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(reverse('owner:bulk_booking_action'), {'action': 'reject', 'booking_ids': ids[:2]})
+        Booking.objects.filter(pk__in=ids[:2]).update(status='pending')
+        Property.objects.recompute_booking_counters()
+        with CaptureQueriesContext(connection) as all_of_them:
+            self.client.post(reverse('owner:bulk_booking_action'), {'action': 'reject', 'booking_ids': ids})
+        self.assertEqual(len(all_of_them), len(few))
+        self.assertFalse(Booking.objects.filter(pk__in=ids).exclude(status='rejected').exists())
+        self.assertTrue(Property.objects.get(pk=self.properties[1].pk).is_available)
+
+    def test_unknown_action_changes_nothing(self):
+        messages = self.post('owner:bulk_booking_action', {'action': 'delete', 'booking_ids': [self.bookings[0].pk]})
+        self.assertEqual(messages, ['Unknown booking action: delete.'])
+        self.assertEqual(Booking.objects.get(pk=self.bookings[0].pk).status, 'pending')
+        self.assertFalse(StatusChange.objects.exists())
+
+    def test_move_maintenance_requests(self):
+        pending, in_progress, done = self.maintenance
+        messages = self.post('owner:bulk_maintenance_status', {
+            'status': 'done', 'request_ids': [pending.pk, in_progress.pk, done.pk],
+        })
+        self.assertEqual(messages, [
+            '2 maintenance request(s) moved to Done.',
+            '1 maintenance request(s) skipped: they cannot move to Done from their current status.',
+        ])
+        for request in MaintenanceRequest.objects.filter(pk__in=[pending.pk, in_progress.pk]):
+            self.assertEqual(request.status, 'done')
+            self.assertIsNotNone(request.resolved_date)
+        self.assertEqual(
+            sorted(StatusChange.objects.filter(kind='maintenance').values_list('object_id', 'from_status')),
+            [(pending.pk, 'pending'), (in_progress.pk, 'in_progress')],
+        )
+
+    def test_admin_actions(self):
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:users_booking_changelist'), {
+            'action': 'confirm_bookings', '_selected_action': [self.bookings[0].pk, self.bookings[3].pk],
+        })
+        self.assertEqual(Booking.objects.filter(status='confirmed').count(), 3)
+        self.client.post(reverse('admin:users_booking_changelist'), {
+            'action': 'complete_bookings', '_selected_action': [self.bookings[2].pk],
+        })
+        self.assertEqual(Booking.objects.get(pk=self.bookings[2].pk).status, 'completed')
+        self.assertEqual(Property.objects.recompute_booking_counters(dry_run=True), [])
+        self.assertEqual(set(StatusChange.objects.values_list('source', flat=True)), {'admin'})
+
+        self.client.post(reverse('admin:users_maintenancerequest_changelist'), {
+            'action': 'mark_in_progress', '_selected_action': [request.pk for request in self.maintenance],
+        })
+        self.assertEqual(MaintenanceRequest.objects.filter(status='in_progress').count(), 2)
+
+
+class ExportReceiptsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner', full_name='Owner')
+        cls.other_owner = CustomUser.objects.create_user('other', 'other@example.com', 'pw', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+
+        def paid_on(day, receiver):
+            return PaymentRecord(
+                user=cls.tenant, receiver_of_payment=receiver, full_name='Tenant', email='tenant@example.com',
+                amount=500, payment_date=timezone.make_aware(datetime(2025, 1, day, 12)),
+            )
+
+        cls.payments = PaymentRecord.objects.bulk_create(
+            [paid_on(day, cls.owner) for day in range(1, 11)] + [paid_on(5, cls.other_owner)]
+        )
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        settings_override = override_settings(RECEIPT_CACHE_DIR=cache_dir, RECEIPT_PDF_RENDERER='python')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.owner)
+
+    def export(self, **params):
+        return self.client.get(reverse('owner:export_receipts'), params)
+
+    def export_zip(self, **params):
+        response = self.export(**params)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_zip_export_streams_the_owners_receipts_in_range(self):
+        for payment in self.payments:
+            receipts.wait_for_receipt(payment, timeout=10)
+        archive = self.export_zip(start='2025-01-03', end='2025-01-07')
+        expected = [f'receipt_{payment.pk}.pdf' for payment in self.payments[2:7]]
+        self.assertEqual(archive.namelist(), expected)
+
+        # The stored receipts are the ones single downloads send
+        with open(receipts.cached_receipt_path(self.payments[2].pk), 'rb') as stored:
+            self.assertEqual(archive.read(expected[0]), stored.read())
+
+    def test_first_export_renders_the_missing_receipts(self):
+        archive = self.export_zip(start='2025-01-01', end='2025-01-03')
+        expected = [f'receipt_{payment.pk}.pdf' for payment in self.payments[:3]]
+        self.assertEqual(archive.namelist(), expected)
+        with open(receipts.cached_receipt_path(self.payments[0].pk), 'rb') as stored:
+            self.assertEqual(archive.read(expected[0]), stored.read())
+
+    def test_receipts_not_rendered_in_time_are_listed_as_pending(self):
+        receipts.wait_for_receipt(self.payments[0], timeout=10)
+        never_done = Future()
+        with mock.patch.object(receipts.tasks, 'submit', return_value=never_done) as submit, \
+                mock.patch.object(receipts, '_render_and_store') as render, \
+                override_settings(RECEIPT_EXPORT_WAIT_SECONDS=0.2):
+            started = time.monotonic()
+            archive = self.export_zip(start='2025-01-01', end='2025-01-03')
+        self.assertLess(time.monotonic() - started, 5) # One bounded wait, not one per receipt
+        render.assert_not_called()
+        self.assertEqual(submit.call_count, 2)
+        self.assertEqual(archive.namelist(), [f'receipt_{self.payments[0].pk}.pdf', receipts.PENDING_RECEIPTS_NAME])
+        pending = archive.read(receipts.PENDING_RECEIPTS_NAME).decode()
+        self.assertIn(f'receipt_{self.payments[1].pk}.pdf\nreceipt_{self.payments[2].pk}.pdf\n', pending)
+        for payment in self.payments[1:3]:
+            receipts._discard_job(payment.pk, never_done)
+
+        # Once rendered, the next export includes them
+        for payment in self.payments[1:3]:
+            receipts.wait_for_receipt(payment, timeout=10)
+        archive = self.export_zip(start='2025-01-01', end='2025-01-03')
+        self.assertEqual(archive.namelist(), [f'receipt_{payment.pk}.pdf' for payment in self.payments[:3]])
+
+    def test_merged_pdf_has_a_page_per_receipt(self):
+        response = self.export(start='2025-01-01', end='2025-01-10', format='pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        pdf = b''.join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertIn(b'/Count 10', pdf)
+
+    def test_payments_are_fetched_in_batches(self):
+        queryset = PaymentRecord.objects.filter(receiver_of_payment=self.owner)
+        with self.assertNumQueries(4): # 3 + 3 + 3 + 1 rows
+            payments = list(receipts.iter_payments(queryset, batch_size=3))
+        self.assertEqual(payments, self.payments[:10])
+
+    def test_invalid_range_is_rejected(self):
+        response = self.export(start='2025-01-07', end='2025-01-03')
+        self.assertRedirects(response, reverse('owner:owner_dashboard'), fetch_redirect_response=False)
+
+    def test_students_cannot_export(self):
+        self.client.force_login(self.tenant)
+        response = self.export(start='2025-01-01', end='2025-01-10')
+        self.assertRedirects(response, reverse('users:home'), fetch_redirect_response=False)
+
+
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER)
+class PropertyGalleryUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, BACKGROUND_TASKS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.owner)
+
+    def form_data(self, gallery_count, **extra):
+        data = {
+            'title': 'Gallery House', 'house_type': 'House', 'rent': '500', 'address': '1 Jalan Test',
+            'bedrooms': 2, 'total_room': 4, 'total_toilets': 1, 'max_tenants': 2, 'gender_preferred': 'male',
+            'gallery_images': [SimpleUploadedFile(f'room{i}.jpg', make_jpeg(40 + i, 30)) for i in range(gallery_count)],
+        }
+        data.update(extra)
+        return data
+
+    def test_add_property_saves_every_gallery_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('owner:add_property'), self.form_data(
+                3, main_image=SimpleUploadedFile('main.jpg', make_jpeg(80, 60)),
+            ))
+        property_obj = Property.objects.get(title='Gallery House')
+        self.assertRedirects(response, reverse('users:property_detail', args=[property_obj.pk]))
+        self.assertEqual(list(property_obj.images.values_list('position', flat=True)), [0, 1, 2])
+
+    def test_edit_property_adds_and_removes_gallery_images(self):
+        property_obj = Property.objects.create(
+            house_type='House', title='Gallery House', rent=500, address='1 Jalan Test', owner=self.owner,
+            main_image=SimpleUploadedFile('main.jpg', make_jpeg(80, 60)),
+        )
+        kept, removed = PropertyImage.objects.add_images(property_obj, [
+            SimpleUploadedFile('a.jpg', make_jpeg(50, 30)), SimpleUploadedFile('b.jpg', make_jpeg(60, 30)),
+        ])
+        other_property = Property.objects.create(
+            house_type='House', title='Other', rent=500, address='2 Jalan Test', owner=self.owner,
+        )
+        other, = PropertyImage.objects.add_images(other_property, [SimpleUploadedFile('c.jpg', make_jpeg(70, 30))])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('owner:edit_property', args=[property_obj.pk]),
+                self.form_data(1, remove_images=[removed.pk, other.pk]),
+            )
+        self.assertRedirects(response, reverse('owner:owner_dashboard'))
+        images = list(property_obj.images.all())
+        self.assertEqual(images[0], kept)
+        self.assertEqual(len(images), 2)
+        self.assertEqual(images[1].position, 1) # Appended after the remaining image
+        self.assertTrue(PropertyImage.objects.filter(pk=other.pk).exists())
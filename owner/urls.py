@@ -14,8 +14,11 @@ urlpatterns = [
     path('bookings/<int:booking_pk>/details/', views.view_booking_details, name='view_booking_details'),
     path('bookings/<int:booking_pk>/confirm/', views.confirm_booking, name='confirm_booking'),
     path('bookings/<int:booking_pk>/reject/', views.reject_booking, name='reject_booking'),
+    path('bookings/bulk/', views.bulk_booking_action, name='bulk_booking_action'),
     path('maintenance-request/update-status/<int:id>/', views.update_status, name='update_status'),
     path('resolve-note/<int:req_id>/', views.resolve_note_view, name='resolve_note'),
+    path('maintenance-request/bulk-status/', views.bulk_maintenance_status, name='bulk_maintenance_status'),
         path('receipt/<int:pk>/pdf/', views.receipt_view_owner, name='receipt_pdf'),
+    path('receipts/export/', views.export_receipts, name='export_receipts'),
     # Add URLs for booking actions (confirm/reject) and maintenance actions later
 ]
\ No newline at end of file
@@ -1,16 +1,18 @@
 import json
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import ListView, DetailView
 from django.contrib import messages
-import pdfkit
-from users.models import PaymentRecord, Property, Booking, MaintenanceRequest, ChatMessage, CustomUser, PropertyForm # Import all necessary models
+from users.bulk_actions import BOOKING_ACTIONS, BulkActionError, change_booking_status, change_maintenance_status
+from users.receipts import iter_payments, iter_receipts_pdf, iter_receipts_zip
+from users.models import PaymentRecord, Property, PropertyImage, Booking, MaintenanceRequest, ChatMessage, Conversation, CustomUser, PropertyForm # Import all necessary models
 from django.db.models import Q # Q object for complex queries
 from django.urls import reverse # To dynamically get URL patterns
 from django.utils import timezone
-from datetime import date,datetime # For current date comparisons
+from django.utils.dateparse import parse_date
+from datetime import date,datetime,time,timedelta # For current date comparisons
 from django.template.loader import render_to_string # Import render_to_string
 
 @login_required
@@ -25,69 +27,51 @@ def owner_dashboard(request):
         messages.error(request, "Access Denied. You must be a owner to view this dashboard.")
         return redirect('users:home') # Redirect to general home page
 
+    # The whole dashboard is served by a fixed number of queries, however many properties,
+    # bookings or payments the owner has: every row's related objects are joined in up front.
+
     # --- My Properties ---
     # Retrieve all properties owned by the current owner
-    owner_properties = Property.objects.filter(owner=request.user).order_by('-created_at')
+    owner_properties = list(Property.objects.filter(owner=request.user).order_by('-created_at'))
 
     # --- Booking Management ---
-    # Retrieve all pending booking requests for THIS owner's properties
-    pending_bookings = Booking.objects.filter(
-        property__owner=request.user, # Filter bookings related to current owner's properties
-        status='pending' # Only show pending bookings
-    ).order_by('start_date') # Order by oldest booking date first
-
     # Retrieve ALL bookings (pending, confirmed, rejected, cancelled, completed) for this owner's properties
-    all_owner_bookings = Booking.objects.filter(
+    all_owner_bookings = list(Booking.objects.filter(
         property__owner=request.user
-    ).order_by('-start_date') # Order by most recent booking date first
+    ).select_related('property', 'tenant').order_by('-start_date')) # Order by most recent booking date first
 
+    # Pending booking requests are taken from the bookings already loaded above,
+    # ordered by oldest booking date first
+    pending_bookings = sorted(
+        (booking for booking in all_owner_bookings if booking.status == 'pending'),
+        key=lambda booking: booking.start_date,
+    )
 
     # --- Maintenance Requests ---
     # Retrieve all maintenance requests submitted for THIS owner's properties
     owner_maintenance_requests = MaintenanceRequest.objects.filter(
         property__owner=request.user # Filter requests related to current owner's properties
-    ).order_by('-submitted_date') # Order by most recent submission
+    ).select_related('property', 'submitted_by').order_by('-submitted_date') # Order by most recent submission
 
      # --- Received Payments (NEW) ---
     my_received_payments = PaymentRecord.objects.filter(
         receiver_of_payment=request.user
-    ).order_by('-payment_date').select_related('user', 'booking') # Select related user and booking
+    ).order_by('-payment_date').select_related('user', 'booking__property') # Select related user and booking (with its property)
     
     # --- Recent Chats ---
     # Similar logic as in users.views.recent_chats_api_view to get unique conversations
     recent_chats_data = []
-    # Get all messages where the current owner is either sender or receiver, ordered by timestamp descending
-    all_owner_messages = ChatMessage.objects.filter(
-        Q(sender=request.user) | Q(receiver=request.user)
-    ).order_by('-timestamp').select_related('property', 'sender', 'receiver') # Optimize with select_related
-
-    processed_conversations = set() # To prevent showing the same conversation multiple times
-
-    for msg in all_owner_messages:
-        # Determine the 'other' participant in the conversation
-        other_participant = msg.sender if msg.receiver == request.user else msg.receiver
-
-        # Skip if the 'other user' is the current user themselves (self-chat)
-        if other_participant == request.user:
-            continue
-
-        # Create a canonical key for the conversation pair (property_id, other_user_id)
-        # Handle cases where property might be None if a general chat was initiated without a property context
-        conversation_key = (msg.property.pk if msg.property else None, other_participant.pk)
-
-        if conversation_key in processed_conversations:
-            continue # If this conversation is already processed, skip
-
-        processed_conversations.add(conversation_key) # Mark this conversation as processed
-
-        # Append chat details to the list
+    # Conversation keeps one summary row per (property, participant pair), so this is a
+    # single indexed query instead of a scan over every message the user ever exchanged
+    for conversation in Conversation.objects.for_user(request.user):
+        other_participant = conversation.other_participant(request.user)
         recent_chats_data.append({
-            'property': msg.property, # Related Property object
-            'other_user': other_participant, # The other CustomUser object
-            'last_message_text': msg.message, # Last message content
-            'last_message_timestamp': msg.timestamp, # Timestamp of the last message
-            # Generate the URL for the chat page dynamically
-            'link': reverse('users:chat_with_user', args=[msg.property.pk if msg.property else 0, other_participant.pk])
+            'property': conversation.property,
+            'other_user': other_participant,
+            'last_message_text': conversation.last_message.message if conversation.last_message else '',
+            'last_message_timestamp': conversation.last_message_at,
+            'unread_count': conversation.unread_count_for(request.user),
+            'link': reverse('users:chat_with_user', args=[conversation.property_id, other_participant.pk])
         })
 
     # Prepare context dictionary to pass data to the template
@@ -98,6 +82,7 @@ def owner_dashboard(request):
         'owner_maintenance_requests': owner_maintenance_requests,
         'my_received_payments': my_received_payments, # Add received payments to context
         'recent_chats_data': recent_chats_data,
+        'maintenance_status_choices': MaintenanceRequest.STATUS_CHOICES, # Bulk status form
         'logo_text_color': '#7fc29b',
         'header_button_color': '#e91e63',
         'current_date': date.today(), # Useful for date comparisons in templates
@@ -142,6 +127,9 @@ def add_property(request):
             # This must be done after the instance is saved to the database
             form.save_m2m() # Saves the amenities (Many-to-Many field)
 
+            # --- NEW: Gallery images (appended after the main image) ---
+            PropertyImage.objects.add_images(property_instance, form.cleaned_data['gallery_images'])
+
             messages.success(request, 'Your property has been successfully added!')
             return redirect('users:property_detail', pk=property_instance.pk) # Redirect to the new property's detail page
         else:
@@ -242,6 +230,55 @@ def reject_booking(request, booking_pk):
 
     return redirect('owner:owner_dashboard') # Redirect back to owner dashboard
 
+
+def _selected_ids(request, name):
+    # Checkbox values of the dashboard's bulk forms; anything that is not an id is ignored
+    return [int(value) for value in request.POST.getlist(name) if value.isdigit()]
+
+
+def _bulk_result_messages(request, result, done_message, skipped_message):
+    if result.changed:
+        messages.success(request, done_message.format(count=len(result.changed)))
+    if result.skipped:
+        messages.error(request, skipped_message.format(count=len(result.skipped)))
+    if not result.changed and not result.skipped:
+        messages.error(request, "Nothing was selected.")
+
+
+@login_required
+def bulk_booking_action(request):
+    """
+    Confirms, rejects or completes the selected bookings of the owner's properties at once
+    (one transaction, see users/bulk_actions.py). Bookings whose status does not allow the
+    action (e.g. confirming a rejected booking) are left unchanged and reported.
+    """
+    if not (request.user.role == 'owner' or request.user.is_superuser):
+        messages.error(request, "Access Denied. You are not authorized to perform this action.")
+        return redirect('users:home')
+    if request.method != 'POST':
+        messages.warning(request, "Invalid request method.") # Should only be accessed via POST
+        return redirect('owner:owner_dashboard')
+
+    bookings = Booking.objects.filter(pk__in=_selected_ids(request, 'booking_ids'))
+    if not request.user.is_superuser:
+        bookings = bookings.filter(property__owner=request.user) # Other owners' bookings are not selectable
+
+    action = request.POST.get('action')
+    try:
+        result = change_booking_status(bookings, action, actor=request.user)
+    except BulkActionError as e:
+        messages.error(request, str(e))
+        return redirect('owner:owner_dashboard')
+
+    new_status, allowed_from = BOOKING_ACTIONS[action]
+    _bulk_result_messages(
+        request, result,
+        f"{{count}} booking(s) {new_status}.",
+        f"{{count}} booking(s) skipped: only {' or '.join(allowed_from)} bookings can be {new_status}.",
+    )
+    return redirect('owner:owner_dashboard')
+
+
 def update_status(request, id):
     # Fetch the maintenance request by ID
     maintenance_request = get_object_or_404(MaintenanceRequest, id=id)
@@ -284,6 +321,40 @@ def resolve_note_view(request, req_id):
         return redirect('owner:owner_dashboard')  # Adjust the name of the view if necessary
 
     return JsonResponse({"success": False, "message": "Invalid request."})
+
+
+@login_required
+def bulk_maintenance_status(request):
+    """
+    Moves the selected maintenance requests of the owner's properties to one status at once
+    (one transaction, see users/bulk_actions.py). Requests that cannot move to that status
+    (closed ones, or already in it) are left unchanged and reported.
+    """
+    if not (request.user.role == 'owner' or request.user.is_superuser):
+        messages.error(request, "Access Denied. You are not authorized to perform this action.")
+        return redirect('users:home')
+    if request.method != 'POST':
+        messages.warning(request, "Invalid request method.") # Should only be accessed via POST
+        return redirect('owner:owner_dashboard')
+
+    maintenance_requests = MaintenanceRequest.objects.filter(pk__in=_selected_ids(request, 'request_ids'))
+    if not request.user.is_superuser:
+        maintenance_requests = maintenance_requests.filter(property__owner=request.user)
+
+    new_status = request.POST.get('status')
+    try:
+        result = change_maintenance_status(maintenance_requests, new_status, actor=request.user)
+    except BulkActionError as e:
+        messages.error(request, str(e))
+        return redirect('owner:owner_dashboard')
+
+    label = dict(MaintenanceRequest.STATUS_CHOICES)[new_status]
+    _bulk_result_messages(
+        request, result,
+        f"{{count}} maintenance request(s) moved to {label}.",
+        f"{{count}} maintenance request(s) skipped: they cannot move to {label} from their current status.",
+    )
+    return redirect('owner:owner_dashboard')
 @login_required
 def edit_property(request, pk):
     """
@@ -295,15 +366,24 @@ def edit_property(request, pk):
     # Authorization check
     if not (request.user == property_instance.owner or request.user.is_superuser):
         messages.error(request, "Access Denied. You are not authorized to edit this property.")
-        return redirect('landlord:landlord_dashboard') # Redirect to landlord dashboard or home
+        return redirect('owner:owner_dashboard') # Redirect to owner dashboard
+
+    gallery_images = property_instance.images.all()
 
     if request.method == 'POST':
         # Pass request.FILES for image uploads
         form = PropertyForm(request.POST, request.FILES, instance=property_instance)
         if form.is_valid():
             form.save()
+
+            # --- NEW: Gallery images ---
+            # Removed one by one (not a queryset delete) so each file's reference count is released
+            for gallery_image in gallery_images.filter(pk__in=request.POST.getlist('remove_images')):
+                gallery_image.delete()
+            PropertyImage.objects.add_images(property_instance, form.cleaned_data['gallery_images'])
+
             messages.success(request, f"Property '{property_instance.title}' updated successfully!")
-            return redirect('landlord:landlord_dashboard') # Redirect back to landlord dashboard
+            return redirect('owner:owner_dashboard') # Redirect back to owner dashboard
         else:
             messages.error(request, "Please correct the errors in the form.")
     else: # GET request
@@ -312,6 +392,7 @@ def edit_property(request, pk):
     context = {
         'form': form,
         'property': property_instance,
+        'gallery_images': gallery_images,
         'logo_text_color': '#7fc29b',
         'header_button_color': '#e91e63',
     }
@@ -329,3 +410,41 @@ def receipt_view_owner(request, pk):
         'header_button_color': '#e91e63',
     }
     return render(request, 'receipt.html', context)
+
+
+@login_required
+def export_receipts(request):
+    """
+    Streams the receipts of every payment the owner received in a date range,
+    as a ZIP of PDF receipts (format=zip, the default) or as one merged PDF (format=pdf).
+    Missing receipts are rendered while the ZIP streams; those not done within
+    settings.RECEIPT_EXPORT_WAIT_SECONDS are listed as pending.
+    Query parameters: start and end (YYYY-MM-DD, both inclusive).
+    """
+    if not (request.user.role == 'owner' or request.user.is_superuser):
+        messages.error(request, "Access Denied. You must be a owner to export receipts.")
+        return redirect('users:home')
+
+    start = parse_date(request.GET.get('start') or '')
+    end = parse_date(request.GET.get('end') or '')
+    export_format = request.GET.get('format', 'zip')
+    if start is None or end is None or start > end or export_format not in ('zip', 'pdf'):
+        messages.error(request, "Please choose a valid date range to export receipts.")
+        return redirect('owner:owner_dashboard')
+
+    # Whole days in the current time zone, as a range on payment_date so the index can be used
+    payments = iter_payments(
+        PaymentRecord.objects.filter(
+            receiver_of_payment=request.user,
+            payment_date__gte=timezone.make_aware(datetime.combine(start, time.min)),
+            payment_date__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+        ).select_related('user', 'booking__property', 'receiver_of_payment')
+    )
+
+    filename = f"receipts_{start:%Y%m%d}_{end:%Y%m%d}.{export_format}"
+    if export_format == 'pdf':
+        response = StreamingHttpResponse(iter_receipts_pdf(payments), content_type='application/pdf')
+    else:
+        response = StreamingHttpResponse(iter_receipts_zip(payments), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -1,3 +1,69 @@
+from datetime import date, timedelta
+
 from django.test import TestCase
+from django.urls import reverse
+
+from users.models import Booking, ChatMessage, CustomUser, MaintenanceRequest, PaymentRecord, Property
+
+# session + user, bookings, maintenance requests, conversations, payments
+TENANT_DASHBOARD_QUERIES = 6
+
+
+class TenantDashboardQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+
+    def setUp(self):
+        self.client.force_login(self.tenant)
+
+    def add_history(self, count):
+        """
+        Gives the tenant `count` properties' worth of bookings in every status,
+        maintenance requests, chats and payments.
+        """
+        for i in range(count):
+            property_obj = Property.objects.create(
+                house_type='House', title=f'Property {i}', rent=500, address=f'{i} Jalan Test', owner=self.owner,
+            )
+            for offset, status in enumerate(['confirmed', 'pending', 'rejected', 'completed', 'cancelled']):
+                booking = Booking.objects.create(
+                    property=property_obj, tenant=self.tenant, status=status,
+                    start_date=date.today() - timedelta(days=30 * i + offset),
+                )
+            MaintenanceRequest.objects.create(
+                property=property_obj, submitted_by=self.tenant, issue_title='Leak', issue_description='Leaky tap',
+            )
+            ChatMessage.objects.create(sender=self.tenant, receiver=self.owner, property=property_obj, message='Hi')
+            PaymentRecord.objects.create(
+                user=self.tenant, booking=booking, receiver_of_payment=self.owner,
+                full_name='Tenant', email='tenant@example.com', amount=500,
+            )
+
+    def test_query_count_is_pinned(self):
+        self.add_history(1)
+        with self.assertNumQueries(TENANT_DASHBOARD_QUERIES):
+            response = self.client.get(reverse('tenant:tenant_home'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.add_history(20)
+        with self.assertNumQueries(TENANT_DASHBOARD_QUERIES):
+            response = self.client.get(reverse('tenant:tenant_home'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_booking_partitions(self):
+        self.add_history(2)
+        response = self.client.get(reverse('tenant:tenant_home'))
 
-# Create your tests here.
+        current_rental = response.context['current_rental']
+        self.assertEqual(current_rental.status, 'confirmed')
+        self.assertEqual(current_rental.property.title, 'Property 0')  # most recent start date
+        self.assertEqual(
+            {booking.status for booking in response.context['all_bookings']},
+            {'confirmed', 'pending', 'rejected'},
+        )
+        self.assertEqual(len(response.context['all_bookings']), 6)
+        self.assertEqual([booking.status for booking in response.context['past_bookings']], ['completed', 'completed'])
@@ -1,12 +1,14 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from users.models import Booking, MaintenanceRequest, PaymentRecord, Property, ChatMessage
-from django.db.models import Q
+from users.models import Booking, MaintenanceRequest, PaymentRecord, Property, ChatMessage, Conversation
 from .forms import MaintenanceRequestForm
 from django.urls import reverse
 from django.utils import timezone
 import datetime
+import logging
+
+logger = logging.getLogger('renthouse.views')
 
 @login_required
 def tenant_dashboard(request):
@@ -20,11 +22,16 @@ def tenant_dashboard(request):
         messages.error(request, "Access Denied. You must be a student to view this dashboard.")
         return redirect('users:home')
 
+    # Each data family (bookings, maintenance requests, chats, payments) is fetched exactly once;
+    # the booking partitions below are computed from the same result set.
+
+    # --- All of this tenant's bookings, newest first ---
+    tenant_bookings = list(Booking.objects.filter(
+        tenant=request.user
+    ).select_related('property__owner').order_by('-start_date'))
+
     # --- Current Rental ---
-    current_rental = Booking.objects.filter(
-        tenant=request.user,
-        status='confirmed',
-    ).order_by('-start_date').first()
+    current_rental = next((booking for booking in tenant_bookings if booking.status == 'confirmed'), None)
 
 
     # --- Maintenance Request Form Handling ---
@@ -42,6 +49,9 @@ def tenant_dashboard(request):
                 return redirect('tenant:tenant_home')
             
         if form.is_valid():
+            if current_rental is None:
+                messages.error(request, "You need a confirmed rental before submitting a maintenance request.")
+                return redirect('tenant:tenant_home')
             # Save the maintenance request with the current property
             maintenance_request = form.save(commit=False)
             maintenance_request.submitted_by = request.user  # Assign the current user
@@ -52,34 +62,21 @@ def tenant_dashboard(request):
             messages.success(request, "Maintenance request submitted successfully.")
             return redirect('tenant:tenant_home')
         else:
-            print("Form is not valid")
-            print(form.errors)  # This will print any errors from form validation
+            logger.debug("Maintenance request form is not valid: %s", form.errors.as_json())
     else:
         form = MaintenanceRequestForm()
 
-        # Fetch all maintenance requests for the current user
-    my_maintenance_requests = MaintenanceRequest.objects.filter(submitted_by=request.user).order_by('-submitted_date')
+    # --- All Bookings (Current, Upcoming, Rejected) ---
+    all_bookings = [
+        booking for booking in tenant_bookings
+        if booking.status in ('confirmed', 'pending', 'rejected')
+    ]
 
-    context = {
-        'current_rental': current_rental,
-        'form': form,
-        'logo_text_color': '#7fc29b',
-        'header_button_color': '#e91e63',
-    }
-
-    # --- Upcoming Bookings ---
-    # --- All Bookings (Current, Upcoming, Past) ---
-
-    all_bookings = Booking.objects.filter(
-        tenant=request.user
-    ).order_by('-start_date').filter(
-        Q(status='confirmed') | Q(status='pending') | Q(status='rejected'))
-
-    # --- Past Bookings (FIXED: Using Q objects for all filter conditions) ---
-    past_bookings = Booking.objects.filter(
-        Q(tenant=request.user) &
-        Q(status='completed')
-    ).exclude(id=current_rental.id if current_rental else None).order_by('-start_date')
+    # --- Past Bookings ---
+    past_bookings = [
+        booking for booking in tenant_bookings
+        if booking.status == 'completed' and booking != current_rental
+    ]
 
 
     # --- My Maintenance Requests ---
@@ -90,37 +87,23 @@ def tenant_dashboard(request):
 
     # --- Recent Chats ---
     recent_chats_data = []
-    all_tenant_messages = ChatMessage.objects.filter(
-        Q(sender=request.user) | Q(receiver=request.user)
-    ).order_by('-timestamp').select_related('property', 'sender', 'receiver')
-
-    processed_conversations = set()
-
-    for msg in all_tenant_messages:
-        other_participant = msg.sender if msg.receiver == request.user else msg.receiver
-
-        if other_participant == request.user:
-            continue
-
-        conversation_key = (msg.property.pk if msg.property else None, other_participant.pk)
-
-        if conversation_key in processed_conversations:
-            continue
-
-        processed_conversations.add(conversation_key)
-
+    # Conversation keeps one summary row per (property, participant pair), so this is a
+    # single indexed query instead of a scan over every message the user ever exchanged
+    for conversation in Conversation.objects.for_user(request.user):
+        other_participant = conversation.other_participant(request.user)
         recent_chats_data.append({
-            'property': msg.property,
+            'property': conversation.property,
             'other_user': other_participant,
-            'last_message_text': msg.message,
-            'last_message_timestamp': msg.timestamp,
-            'link': reverse('users:chat_with_user', args=[msg.property.pk if msg.property else 0, other_participant.pk])
+            'last_message_text': conversation.last_message.message if conversation.last_message else '',
+            'last_message_timestamp': conversation.last_message_at,
+            'unread_count': conversation.unread_count_for(request.user),
+            'link': reverse('users:chat_with_user', args=[conversation.property_id, other_participant.pk])
         })
 
     # --- My Payment History (NEW) ---
     my_payments = PaymentRecord.objects.filter(
         user=request.user # Payments made by the current user
-    ).order_by('-payment_date').select_related('booking', 'receiver_of_payment')
+    ).order_by('-payment_date').select_related('booking__property', 'receiver_of_payment')
 
 
     context = {
@@ -130,6 +113,7 @@ def tenant_dashboard(request):
         'my_maintenance_requests': my_maintenance_requests,
         'recent_chats_data': recent_chats_data,
         'my_payments': my_payments, # Add payment history to context
+        'form': form,
         'logo_text_color': '#7fc29b',
         'header_button_color': '#e91e63',
     }
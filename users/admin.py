@@ -1,7 +1,116 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
-from .models import AdditionalOccupant, CustomUser, PaymentRecord, Property, Amenity,Booking, ChatMessage, MaintenanceRequest 
+from django.utils.translation import gettext_lazy as _
+from .bulk_actions import BOOKING_ACTIONS, change_booking_status, change_maintenance_status
+from .models import AdditionalOccupant, CustomUser, PaymentRecord, Property, Amenity,Booking, ChatMessage, Conversation, MaintenanceRequest, MediaBlob, PropertyImage, GeocodeCache, StatusChange
+from .pagination import EstimatedCountPaginator
+
+
+# --- NEW: Changelists that stay fast as the tables grow ---
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    Foreign key filter that finds the related object through the admin autocomplete (the search_fields
+    of the related admin) instead of listing every user, property or booking in the sidebar.
+    Usage: list_filter = (('owner', AutocompleteFilter),)
+    """
+    template = 'admin/users/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.admin_site = model_admin.admin_site
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        return [] # Only the selected object is loaded, as the widget's value
+
+    def has_output(self):
+        return True
+
+    @property
+    def selected_value(self):
+        value = self.lookup_val
+        if isinstance(value, list): # Django 5 passes every value of a parameter
+            value = value[-1] if value else None
+        return value
+
+    def choices(self, changelist):
+        self.clear_query_string = changelist.get_query_string(remove=[self.lookup_kwarg, self.lookup_kwarg_isnull])
+        yield {
+            'selected': self.selected_value is None and not self.lookup_val_isnull,
+            'query_string': self.clear_query_string,
+            'display': _('All'),
+        }
+        if self.include_empty_choice:
+            yield {
+                'selected': bool(self.lookup_val_isnull),
+                'query_string': changelist.get_query_string({self.lookup_kwarg_isnull: 'True'}, [self.lookup_kwarg]),
+                'display': self.empty_value_display,
+            }
+
+    def widget(self):
+        remote_model = self.field.remote_field.model
+        form_field = forms.ModelChoiceField(
+            remote_model._default_manager.all(), required=False,
+            widget=AutocompleteSelect(self.field, self.admin_site, attrs={'data-width': '100%'}),
+        )
+        return form_field.widget.render(self.lookup_kwarg, self.selected_value)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base admin of the tables that grow with use (properties, bookings, messages, payments...):
+    - the total is estimated on large tables (EstimatedCountPaginator) and the unfiltered table
+      is not counted a second time for "N results (M total)";
+    - foreign keys are filtered with AutocompleteFilter, whose scripts are added here.
+    Subclasses also join the foreign keys of list_display (list_select_related).
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        # The autocomplete media does not depend on the field, any will do
+        autocomplete = AutocompleteSelect(self.model._meta.pk, self.admin_site).media
+        return super().media + autocomplete + forms.Media(js=['js/admin_autocomplete_filter.js'])
+
+    def report_bulk_result(self, request, result, done_message, skipped_message):
+        # Outcome of a users/bulk_actions.py change made by an admin action
+        if result.changed:
+            self.message_user(request, done_message.format(count=len(result.changed)), messages.SUCCESS)
+        if result.skipped:
+            self.message_user(request, skipped_message.format(count=len(result.skipped)), messages.WARNING)
+
+
+# --- NEW: Admin actions that change the status of every selected row in one UPDATE ---
+def booking_action(action):
+    new_status, allowed_from = BOOKING_ACTIONS[action]
+
+    @admin.action(description=f"Mark selected bookings as {new_status}", permissions=['change'])
+    def apply(modeladmin, request, queryset):
+        result = change_booking_status(queryset, action, actor=request.user, source='admin')
+        modeladmin.report_bulk_result(
+            request, result, f"{{count}} booking(s) {new_status}.",
+            f"{{count}} booking(s) skipped: only {' or '.join(allowed_from)} bookings can be {new_status}.",
+        )
+    apply.__name__ = f'{action}_bookings'
+    return apply
+
+
+def maintenance_action(new_status):
+    label = dict(MaintenanceRequest.STATUS_CHOICES)[new_status]
+
+    @admin.action(description=f"Move selected requests to {label}", permissions=['change'])
+    def apply(modeladmin, request, queryset):
+        result = change_maintenance_status(queryset, new_status, actor=request.user, source='admin')
+        modeladmin.report_bulk_result(
+            request, result, f"{{count}} maintenance request(s) moved to {label}.",
+            f"{{count}} maintenance request(s) skipped: they cannot move to {label} from their current status.",
+        )
+    apply.__name__ = f'mark_{new_status}'
+    return apply
+
 
 class CustomUserCreationForm(UserCreationForm):
     class Meta:
@@ -34,27 +143,40 @@ class CustomUserAdmin(BaseUserAdmin):
     search_fields = ('username', 'email', 'full_name')
     ordering = ('username',)
 
+# --- NEW: Gallery images, edited on the property's admin page ---
+class PropertyImageInline(admin.TabularInline):
+    model = PropertyImage
+    extra = 0
+    fields = ('image', 'caption', 'position')
+
 @admin.register(Property)
-class PropertyAdmin(admin.ModelAdmin):
+class PropertyAdmin(LargeTableAdmin):
     list_display = (
         'title', 'house_type', 'rent', 'address', 'owner',
-        'bedrooms', 'total_room', 'total_toilets','max_tenants', 'gender_preferred', 'is_available'
-        # 'amenities_list' is a method on this admin class, not directly on the model
-        # So we add it in list_display but define it below as a method.
+        'bedrooms', 'total_room', 'total_toilets','max_tenants', 'gender_preferred', 'is_available',
+        'amenities_list', # A method on this admin class, not a model field (defined below)
     )
-    list_filter = ('house_type', 'is_available', 'owner', 'bedrooms', 'total_room','total_toilets', 'max_tenants', 'gender_preferred')
+    list_filter = ('house_type', 'is_available', ('owner', AutocompleteFilter), 'bedrooms', 'total_room','total_toilets', 'max_tenants', 'gender_preferred')
+    list_select_related = ('owner',)
     search_fields = ('title', 'address', 'description', 'owner__username')
-    raw_id_fields = ('owner',)
+    autocomplete_fields = ('owner',)
     filter_horizontal = ('amenities',) # Use filter_horizontal for ManyToMany field in admin
     fieldsets = (
         (None, {'fields': ('title', 'house_type', 'description', 'main_image')}),
         ('Location & Rent', {'fields': ('address', 'university_nearby', 'rent')}),
-        ('Capacity & Availability', {'fields': ('bedrooms', 'total_room','total_toilets', 'max_tenants', 'gender_preferred', 'is_available')}),
+        ('Capacity & Availability', {'fields': ('bedrooms', 'total_room','total_toilets', 'max_tenants', 'gender_preferred', 'is_listed', 'is_available')}),
+        ('Booking Counters', {'fields': ('pending_bookings_count', 'confirmed_bookings_count', 'active_occupants')}), # Maintained automatically
         ('Amenities', {'fields': ('amenities',)}), # NEW: Added amenities fieldset
+        ('Location', {'fields': ('latitude', 'longitude')}), # NEW: Geocoded from the address
         ('Owner', {'fields': ('owner',)}),
         ('Details', {'fields': ('square_footage', 'created_at')}),
     )
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'is_available', 'pending_bookings_count', 'confirmed_bookings_count', 'active_occupants')
+    inlines = [PropertyImageInline]
+
+    def get_queryset(self, request):
+        # One query for the amenities of the whole page (amenities_list)
+        return super().get_queryset(request).prefetch_related('amenities')
 
     # Helper method to display amenities in the list_display
     def amenities_list(self, obj):
@@ -64,7 +186,8 @@ class PropertyAdmin(admin.ModelAdmin):
 
 @admin.register(Amenity)
 class AmenityAdmin(admin.ModelAdmin):
-    list_display = ('name',)
+    list_display = ('name', 'bit')
+    readonly_fields = ('bit',) # Assigned on creation: position in Property.amenity_mask
     search_fields = ('name',)
 
 # This class defines how AdditionalOccupant forms appear when embedded in another admin page
@@ -74,15 +197,15 @@ class AdditionalOccupantInline(admin.TabularInline): # Or admin.StackedInline fo
     can_delete = True # Allow deleting additional occupants directly from the booking admin
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(LargeTableAdmin):
     list_display = (
         'property', 'tenant', 'start_date', 'number_of_occupants',
         'full_name_on_form', 'gender_on_form', 'email_on_form', 'expected_duration_of_stay',
         'status',
     )
-    list_filter = ('status', 'property__house_type', 'tenant__role', 'property__owner', 'gender_on_form')
+    list_filter = ('status', 'property__house_type', 'tenant__role', ('property__owner', AutocompleteFilter), 'gender_on_form')
     search_fields = ('property__title', 'tenant__username', 'property__address', 'full_name_on_form', 'email_on_form', 'student_id_number', 'university_name_on_form')
-    raw_id_fields = ('property', 'tenant')
+    autocomplete_fields = ('property', 'tenant')
     date_hierarchy = 'start_date'
     fieldsets = (
         (None, {'fields': ('property', 'tenant', 'status')}),
@@ -97,35 +220,48 @@ class BookingAdmin(admin.ModelAdmin):
     
     # IMPORTANT: Add the inline to display related AdditionalOccupant objects
     inlines = [AdditionalOccupantInline]
+    actions = [booking_action('confirm'), booking_action('reject'), booking_action('complete')]
+
+    def get_queryset(self, request):
+        # Instead of list_select_related, which the changelist skips when the queryset already
+        # joins: str(booking) shows the property title, e.g. in the booking autocomplete of payments
+        return super().get_queryset(request).select_related('property', 'tenant')
 
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(LargeTableAdmin):
     list_display = ('sender', 'receiver', 'property', 'timestamp', 'is_read')
-    list_filter = ('is_read', 'timestamp', 'sender', 'receiver', 'property')
+    list_filter = ('is_read', 'timestamp', ('sender', AutocompleteFilter), ('receiver', AutocompleteFilter), ('property', AutocompleteFilter))
+    list_select_related = ('sender', 'receiver', 'property')
     search_fields = ('sender__username', 'receiver__username', 'message', 'property__title')
-    raw_id_fields = ('sender', 'receiver', 'property')
-    date_hierarchy = 'timestamp'
+    autocomplete_fields = ('sender', 'receiver', 'property')
+    # No date_hierarchy: it reads the dates of the whole table on every load (the timestamp filter stays)
 
 
 @admin.register(MaintenanceRequest)
-class MaintenanceRequestAdmin(admin.ModelAdmin):
+class MaintenanceRequestAdmin(LargeTableAdmin):
     list_display = ('property', 'submitted_by', 'issue_title', 'status', 'priority', 'submitted_date', 'resolved_date')
-    list_filter = ('status', 'priority', 'submitted_date', 'property', 'submitted_by')
+    list_filter = ('status', 'priority', 'submitted_date', ('property', AutocompleteFilter), ('submitted_by', AutocompleteFilter))
+    list_select_related = ('property', 'submitted_by')
     search_fields = ('issue_title', 'issue_description', 'property__title', 'submitted_by__username')
-    raw_id_fields = ('property', 'submitted_by')
+    autocomplete_fields = ('property', 'submitted_by')
+    actions = [maintenance_action('in_progress'), maintenance_action('done'), maintenance_action('rejected')]
     date_hierarchy = 'submitted_date'
     
     # --- NEW: PaymentRecord Admin ---
 @admin.register(PaymentRecord)
-class PaymentRecordAdmin(admin.ModelAdmin):
+class PaymentRecordAdmin(LargeTableAdmin):
     # Added 'receiver_of_payment' to list_display
     list_display = ('full_name', 'email', 'amount', 'payment_date', 'user', 'booking', 'receiver_of_payment', 'transaction_id', 'payment_method')
-    list_filter = ('payment_date', 'payment_method', 'user', 'booking', 'receiver_of_payment') # Added receiver to filter
+    list_filter = (
+        'payment_date', 'payment_method',
+        ('user', AutocompleteFilter), ('booking', AutocompleteFilter), ('receiver_of_payment', AutocompleteFilter), # Added receiver to filter
+    )
+    list_select_related = ('user', 'booking__property', 'receiver_of_payment')
     search_fields = ('full_name', 'email', 'transaction_id', 'user__username', 'booking__property__title', 'receiver_of_payment__username') # Added receiver to search
-    # Added receiver_of_payment to raw_id_fields
-    raw_id_fields = ('user', 'booking', 'receiver_of_payment')
-    date_hierarchy = 'payment_date'
+    autocomplete_fields = ('user', 'booking')
+    raw_id_fields = ('receiver_of_payment',) # Read-only, set from the booking
+    # No date_hierarchy: it reads the dates of the whole table on every load (the payment_date filter stays)
     readonly_fields = ('payment_date', 'transaction_id', 'receiver_of_payment') # transaction_id is generated
     fieldsets = (
         (None, {'fields': ('full_name', 'email', 'phone_number', 'amount', 'payment_method')}),
@@ -133,3 +269,44 @@ class PaymentRecordAdmin(admin.ModelAdmin):
         ('Related Records', {'fields': ('user', 'booking', 'receiver_of_payment', 'transaction_id')}),
         ('Timestamp', {'fields': ('payment_date',)}),
     )
+
+@admin.register(Conversation)
+class ConversationAdmin(LargeTableAdmin):
+    list_display = ('property', 'participant_a', 'participant_b', 'last_message_at', 'unread_a', 'unread_b')
+    list_select_related = ('property', 'participant_a', 'participant_b')
+    search_fields = ('property__title', 'participant_a__username', 'participant_b__username')
+    raw_id_fields = ('property', 'participant_a', 'participant_b', 'last_message')
+    date_hierarchy = 'last_message_at'
+
+@admin.register(StatusChange)
+class StatusChangeAdmin(LargeTableAdmin):
+    list_display = ('kind', 'object_id', 'property', 'from_status', 'to_status', 'changed_by', 'source', 'changed_at')
+    list_filter = ('kind', 'to_status', 'source', 'changed_at', ('property', AutocompleteFilter), ('changed_by', AutocompleteFilter))
+    list_select_related = ('property', 'changed_by')
+    search_fields = ('=object_id',)
+
+    # Written by users/bulk_actions.py only: the audit trail is read-only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'ref_count', 'created_at')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'ref_count', 'created_at') # Maintained by signals and `manage.py dedupe_media`
+
+@admin.register(GeocodeCache)
+class GeocodeCacheAdmin(admin.ModelAdmin):
+    list_display = ('address', 'latitude', 'longitude', 'provider', 'created_at')
+    list_filter = ('provider',)
+    search_fields = ('address',)
+    readonly_fields = ('address_key', 'created_at')
+
+    def has_add_permission(self, request): # Entries are made by lookups (keyed by address_key)
+        return False
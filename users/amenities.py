@@ -0,0 +1,55 @@
+# users/amenities.py
+#
+# Filtering properties by amenity through Property.amenity_mask.
+# Every Amenity owns one bit (Amenity.bit) and a property's mask has the bits of all its
+# amenities set, so "WiFi AND aircon AND parking" is the single predicate
+#   amenity_mask & (wifi | aircon | parking) = (wifi | aircon | parking)
+# and "WiFi OR parking" is  amenity_mask & (wifi | parking) > 0,
+# evaluated against the narrow (is_available, amenity_mask) index instead of joining the
+# ManyToMany table once per amenity. Masks are kept in step by the m2m_changed handler in
+# users/signals.py; `manage.py benchmark_amenity_filter` compares both strategies.
+# Amenities beyond the 63 bits of the mask (Amenity.bit is None) fall back to the join.
+
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.lookups import Exact, GreaterThan
+
+from .models import Amenity, Property
+
+
+def mask_of(bits):
+    mask = 0
+    for bit in bits:
+        mask |= 1 << bit
+    return mask
+
+
+def has_amenity_condition(amenity_id):
+    """
+    Q of the properties offering one amenity through the ManyToMany table (the fallback).
+    """
+    return Q(Exists(Property.amenities.through.objects.filter(property_id=OuterRef('pk'), amenity_id=amenity_id)))
+
+
+def amenities_condition(amenity_ids, match_all=True, bits=None):
+    """
+    Q of the properties offering all (match_all) or any of the given amenities.
+    `bits` ({amenity id: bit or None}) saves a query when the caller already knows them.
+    """
+    amenity_ids = list(amenity_ids)
+    if not amenity_ids:
+        return Q()
+    if bits is None:
+        bits = dict(Amenity.objects.filter(pk__in=amenity_ids).values_list('pk', 'bit'))
+    mask = mask_of(bits[pk] for pk in amenity_ids if bits.get(pk) is not None)
+    unmasked = [has_amenity_condition(pk) for pk in amenity_ids if bits.get(pk) is None]
+
+    conditions = []
+    if mask:
+        masked = F('amenity_mask').bitand(mask)
+        conditions.append(Q(Exact(masked, mask)) if match_all else Q(GreaterThan(masked, 0)))
+    conditions += unmasked
+
+    combined = conditions[0]
+    for condition in conditions[1:]:
+        combined = (combined & condition) if match_all else (combined | condition)
+    return combined
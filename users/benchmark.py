@@ -0,0 +1,180 @@
+# users/benchmark.py
+#
+# Load benchmark of the main pages (`manage.py benchmark_site`).
+# Every scenario is requested through Django's test client, in-process and without a web
+# server, so the numbers are the time spent in Django and the database: middleware, view,
+# queries and template rendering. Each one is run `repeat` times after `warmup` untimed runs
+# (which also fill the caches, as in production), recording the latency (p50/p95) and the
+# number of SQL queries.
+#
+# The report is plain JSON: keep the report of each release and compare_reports() the next
+# one against it. Generate a realistic dataset first with `manage.py seed_bench`.
+
+import logging
+import math
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Booking, ChatMessage, Conversation, CustomUser, MaintenanceRequest, PaymentRecord, Property
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Scenario:
+    def __init__(self, name, url, user=None, params=None):
+        self.name = name
+        self.url = url
+        self.user = user # Logged in as this user, anonymous if None
+        self.params = params or {}
+
+
+def get_scenarios():
+    """
+    The scenarios, with the users and objects they need picked from the database: the busiest
+    owner, student, conversation and the latest payment. Scenarios whose objects do not exist are left out.
+    """
+    owner = CustomUser.objects.filter(role='owner').annotate(listings=Count('owned_properties')).order_by('-listings', 'pk').first()
+    student = CustomUser.objects.filter(role='student').annotate(
+        activity=Count('my_bookings', distinct=True) + Count('submitted_maintenance_requests', distinct=True)
+    ).order_by('-activity', 'pk').first()
+
+    # Anonymous listing pages come from the page cache after the first request; logged-in
+    # visitors always reach the database
+    scenarios = [
+        Scenario('home (anonymous)', reverse('users:home')),
+        Scenario('home', reverse('users:home'), user=student),
+        Scenario('home search', reverse('users:home'), user=student, params={'q': 'house'}),
+        Scenario('home near a place', reverse('users:home'), user=student, params={'lat': '3.2514', 'lng': '101.7357', 'radius': '5'}),
+        Scenario('home faceted', reverse('users:home'), user=student, params={'house_type': 'House', 'bedrooms': '3', 'rent_band': '500-800'}),
+        Scenario('listing api', reverse('users:property_list_api')),
+    ]
+
+    property_obj = Property.objects.order_by('-confirmed_bookings_count', '-pk').first()
+    if property_obj:
+        scenarios.append(Scenario('property detail', reverse('users:property_detail', kwargs={'pk': property_obj.pk})))
+    if owner:
+        scenarios.append(Scenario('owner dashboard', reverse('owner:owner_dashboard'), user=owner))
+    if student:
+        scenarios.append(Scenario('tenant dashboard', reverse('tenant:tenant_home'), user=student))
+
+    conversation = Conversation.objects.select_related('property', 'participant_a', 'participant_b').filter(
+        Q(participant_a__role='student') | Q(participant_b__role='student')
+    ).order_by('-last_message_at').first()
+    if conversation:
+        owner_of_chat = conversation.property.owner
+        other = conversation.other_participant(owner_of_chat)
+        chat_kwargs = {'property_pk': conversation.property_id, 'other_user_pk': other.pk}
+        scenarios += [
+            Scenario('chat page', reverse('users:chat_with_user', kwargs=chat_kwargs), user=owner_of_chat),
+            Scenario('chat history api', reverse('users:chat_history_api', kwargs=chat_kwargs), user=owner_of_chat),
+            Scenario('recent chats api', reverse('users:recent_chats_api'), user=owner_of_chat),
+        ]
+
+    payment = PaymentRecord.objects.filter(user__isnull=False).order_by('-payment_date').first()
+    if payment:
+        scenarios += [
+            Scenario('receipt page', reverse('users:receipt', kwargs={'pk': payment.pk}), user=payment.user),
+            Scenario('receipt pdf', reverse('users:receipt_pdf', kwargs={'pk': payment.pk}), user=payment.user),
+        ]
+    return scenarios
+
+
+def run_scenario(scenario, repeat=20, warmup=2):
+    client = Client()
+    if scenario.user is not None:
+        client.force_login(scenario.user)
+
+    timings, query_counts, status = [], [], None
+    for run in range(warmup + repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(scenario.url, scenario.params)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content) # File responses are only read when sent
+            elapsed = (time.perf_counter() - start) * 1000
+        status = response.status_code
+        if run >= warmup:
+            timings.append(elapsed)
+            query_counts.append(len(queries))
+
+    return {
+        'url': scenario.url,
+        'params': scenario.params,
+        'user': scenario.user.role if scenario.user else 'anonymous',
+        'status': status,
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'queries_p50': statistics.median(query_counts),
+        'queries_max': max(query_counts),
+    }
+
+
+def dataset_size():
+    return {
+        model._meta.model_name: model.objects.count()
+        for model in (CustomUser, Property, Booking, ChatMessage, Conversation, MaintenanceRequest, PaymentRecord)
+    }
+
+
+def run_benchmark(repeat=20, warmup=2, only=None, progress=None):
+    """
+    Runs every scenario (or the ones named in `only`) and returns the report.
+    """
+    results = {}
+    # One log line per request would bury the results (see users/instrumentation.py)
+    request_logger = logging.getLogger('renthouse.requests')
+    level = request_logger.level
+    request_logger.setLevel(logging.WARNING)
+    try:
+        # The test client talks to "testserver", which production settings do not allow
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for scenario in get_scenarios():
+                if only and scenario.name not in only:
+                    continue
+                results[scenario.name] = run_scenario(scenario, repeat=repeat, warmup=warmup)
+                if progress:
+                    progress(scenario.name, results[scenario.name])
+    finally:
+        request_logger.setLevel(level)
+    return {
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'repeat': repeat,
+        'warmup': warmup,
+        'dataset': dataset_size(),
+        'results': results,
+    }
+
+
+def compare_reports(previous, current):
+    """
+    Per scenario present in both reports: (name, p50 before, p50 after, p50 change in %,
+    p95 before, p95 after, queries before, queries after).
+    """
+    rows = []
+    for name, after in current['results'].items():
+        before = previous['results'].get(name)
+        if before is None:
+            continue
+        change = (after['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0.0
+        rows.append((
+            name, before['p50_ms'], after['p50_ms'], round(change, 1),
+            before['p95_ms'], after['p95_ms'], before['queries_max'], after['queries_max'],
+        ))
+    return rows
@@ -0,0 +1,79 @@
+# users/bookings.py
+#
+# Booking engine used by book_property.
+# The whole booking runs in one transaction that locks the tenant and the Property rows
+# (SELECT ... FOR UPDATE), so the "one active booking per tenant" and "property still
+# available" checks cannot race with a concurrent booking. Each booking form carries an
+# idempotency key: submitting the same form twice returns the booking created the first time.
+
+from django.db import IntegrityError, transaction
+
+from .models import AdditionalOccupant, Booking, CustomUser, Property
+
+
+class BookingError(Exception):
+    """
+    The booking was refused; the message is meant to be shown to the tenant.
+    """
+
+
+def _existing_booking(tenant, idempotency_key):
+    if not idempotency_key:
+        return None
+    return Booking.objects.filter(tenant=tenant, idempotency_key=idempotency_key).first()
+
+
+def create_booking(property_id, tenant, booking_form, occupant_forms=(), idempotency_key=None):
+    """
+    Books a property for `tenant` from a valid BookingForm and the valid, non-deleted
+    AdditionalOccupantForms. Returns (booking, created); `created` is False when the
+    idempotency key matches a booking this tenant already made.
+    Raises BookingError when the booking is not allowed.
+    """
+    idempotency_key = idempotency_key or None
+    occupant_forms = list(occupant_forms)
+
+    try:
+        with transaction.atomic():
+            # Serializes concurrent submissions of the same tenant (double clicks, two tabs)
+            CustomUser.objects.select_for_update().filter(pk=tenant.pk).first()
+
+            booking = _existing_booking(tenant, idempotency_key)
+            if booking is not None:
+                return booking, False
+
+            if Booking.objects.filter(tenant=tenant, status__in=Property.objects.ACTIVE_BOOKING_STATUSES).exists():
+                raise BookingError("You already have a pending or confirmed booking. You can only have one active booking at a time.")
+
+            # Serializes concurrent bookings of the same property
+            property_obj = Property.objects.select_for_update().filter(pk=property_id).first()
+            if property_obj is None:
+                raise BookingError("This property no longer exists.")
+            if not property_obj.is_available:
+                raise BookingError("Sorry, this property has just been booked by someone else.")
+
+            total_occupants = 1 + len(occupant_forms) # Primary booker + additional occupants
+            if total_occupants > property_obj.max_tenants:
+                raise BookingError(f"This property can accommodate a maximum of {property_obj.max_tenants} tenant(s). You have {total_occupants} total occupants in your booking.")
+
+            booking = booking_form.save(commit=False)
+            booking.property = property_obj
+            booking.tenant = tenant
+            booking.number_of_occupants = total_occupants
+            booking.idempotency_key = idempotency_key
+            booking.save() # Also updates the property's booking counters (and availability)
+
+            occupants = []
+            for occupant_form in occupant_forms:
+                occupant = occupant_form.save(commit=False)
+                occupant.booking = booking
+                occupants.append(occupant)
+            AdditionalOccupant.objects.bulk_create(occupants)
+    except IntegrityError:
+        # A concurrent request of this tenant with the same key won the race on the unique constraint
+        booking = _existing_booking(tenant, idempotency_key)
+        if booking is None:
+            raise
+        return booking, False
+
+    return booking, True
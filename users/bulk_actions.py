@@ -0,0 +1,112 @@
+# users/bulk_actions.py
+#
+# Status changes of many bookings or maintenance requests at once (owner dashboard and admin
+# actions). Each change runs in one transaction:
+# - the selected rows are locked (SELECT ... FOR UPDATE) and split into the ones the transition
+#   allows and the ones it skips (e.g. only pending bookings can be confirmed);
+# - the allowed rows are changed by a single UPDATE ... WHERE id IN (...) AND status IN (...);
+# - one StatusChange audit row per changed object is written with a single bulk_create.
+# QuerySet.update() bypasses Booking.save(), so the booking counters of the affected properties
+# are recomputed afterwards (with the property rows locked) and the metrics are counted here.
+
+from functools import partial
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import Property, StatusChange
+
+
+class BulkActionError(Exception):
+    """
+    The action or status is not known; the message is meant to be shown to the user.
+    """
+
+
+# action: (new status, statuses it can be applied to)
+BOOKING_ACTIONS = {
+    'confirm': ('confirmed', ('pending',)),
+    'reject': ('rejected', ('pending',)),
+    'complete': ('completed', ('confirmed',)),
+}
+
+# new status: statuses it can be reached from (done and rejected requests are closed)
+MAINTENANCE_TRANSITIONS = {
+    'pending': ('in_progress',),
+    'in_progress': ('pending',),
+    'done': ('pending', 'in_progress'),
+    'rejected': ('pending', 'in_progress'),
+}
+MAINTENANCE_CLOSED_STATUSES = ('done', 'rejected')
+
+
+class BulkResult:
+    def __init__(self, changed, skipped):
+        self.changed = changed # ids of the changed rows
+        self.skipped = skipped # ids of the selected rows the transition does not apply to
+
+
+def _transition(queryset, kind, new_status, allowed_from, actor, source, **extra_fields):
+    """
+    Changes the rows of `queryset` whose status is in `allowed_from`. Must run in a transaction.
+    Returns (BulkResult, ids of the properties of the changed rows).
+    """
+    model = queryset.model
+    # The selection may join other tables (e.g. the owner's properties): only the rows themselves are locked
+    selected = list(queryset.values_list('pk', flat=True))
+    rows = list(model.objects.select_for_update().filter(pk__in=selected).order_by('pk').values_list('pk', 'status', 'property_id'))
+    eligible = [row for row in rows if row[1] in allowed_from]
+    skipped = [pk for pk, status, property_id in rows if status not in allowed_from]
+    if not eligible:
+        return BulkResult([], skipped), set()
+
+    ids = [pk for pk, status, property_id in eligible]
+    model.objects.filter(pk__in=ids, status__in=allowed_from).update(status=new_status, **extra_fields)
+
+    now = timezone.now()
+    StatusChange.objects.bulk_create([
+        StatusChange(
+            kind=kind, object_id=pk, property_id=property_id, from_status=status, to_status=new_status,
+            changed_by=actor, source=source, changed_at=now,
+        )
+        for pk, status, property_id in eligible
+    ])
+    return BulkResult(ids, skipped), {property_id for pk, status, property_id in eligible}
+
+
+def change_booking_status(queryset, action, actor=None, source='dashboard'):
+    """
+    Applies a BOOKING_ACTIONS action ('confirm', 'reject', 'complete') to the bookings of
+    `queryset` that allow it. Returns a BulkResult. Raises BulkActionError for an unknown action.
+    """
+    if action not in BOOKING_ACTIONS:
+        raise BulkActionError(f"Unknown booking action: {action}.")
+    new_status, allowed_from = BOOKING_ACTIONS[action]
+
+    with transaction.atomic():
+        result, property_ids = _transition(queryset, 'booking', new_status, allowed_from, actor, source)
+        if result.changed:
+            # Same lock order as Booking.save(): the bookings, then their properties (locked by the recompute)
+            properties = Property.objects.filter(pk__in=property_ids)
+            Property.objects.recompute_booking_counters(queryset=properties) # Also bumps the listing version
+            transaction.on_commit(partial(metrics.bookings.inc, len(result.changed), event=new_status))
+    return result
+
+
+def change_maintenance_status(queryset, new_status, actor=None, source='dashboard'):
+    """
+    Moves the maintenance requests of `queryset` that allow it to `new_status`; closing a request
+    (done, rejected) sets its resolved date. Returns a BulkResult.
+    Raises BulkActionError for an unknown status.
+    """
+    if new_status not in MAINTENANCE_TRANSITIONS:
+        raise BulkActionError(f"Unknown maintenance status: {new_status}.")
+    resolved_date = timezone.now() if new_status in MAINTENANCE_CLOSED_STATUSES else None
+
+    with transaction.atomic():
+        result, property_ids = _transition(
+            queryset, 'maintenance', new_status, MAINTENANCE_TRANSITIONS[new_status], actor, source,
+            resolved_date=resolved_date,
+        )
+    return result
@@ -0,0 +1,75 @@
+# users/caching.py
+#
+# Caching for the home page listing grid.
+# - Every property card is a template fragment cached under (property id, updated_at),
+#   so a card is re-rendered only after its Property row changes.
+# - Whole pages served to anonymous visitors are cached under a listing "version" that
+#   signal handlers bump whenever any Property (or its amenities) changes, which makes
+#   every cached page stale at once without having to know their keys. The key of a page is
+#   taken before it is rendered, so a page rendered while the version is bumped is stored under
+#   the old version, never the new one.
+
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+LISTING_VERSION_KEY = 'listing:version'
+
+
+def get_listing_cache():
+    return caches[getattr(settings, 'LISTING_CACHE_ALIAS', 'default')]
+
+
+def _new_version():
+    # A missing version (never set, or evicted) restarts from the clock rather than from a fixed
+    # number, so that it cannot come back to a version whose pages may still be cached
+    return time.time_ns() // 1000
+
+
+def get_listing_version():
+    cache = get_listing_cache()
+    version = cache.get(LISTING_VERSION_KEY)
+    if version is None:
+        cache.add(LISTING_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(LISTING_VERSION_KEY)
+    return version
+
+
+def bump_listing_version():
+    """
+    Invalidates every cached listing page.
+    """
+    cache = get_listing_cache()
+    try:
+        cache.incr(LISTING_VERSION_KEY)
+    except ValueError: # Key missing (never set, or evicted)
+        cache.set(LISTING_VERSION_KEY, _new_version(), timeout=None)
+
+
+def listing_page_key(request):
+    """
+    Cache key of a listing page: the current listing version plus the query string with its
+    parameters sorted (values stay encoded, so "&" or "=" inside a value cannot collide).
+    """
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    digest = hashlib.md5(query.encode('utf-8'), usedforsecurity=False).hexdigest()
+    return f'listing:page:{get_listing_version()}:{digest}'
+
+
+def get_cached_listing_page(key):
+    content = get_listing_cache().get(key)
+    metrics.count_cache_lookup('listing_page', content is not None)
+    return content
+
+
+def cache_listing_page(key, content):
+    """
+    Stores a rendered page under the key taken (listing_page_key) before it was rendered.
+    """
+    timeout = getattr(settings, 'LISTING_PAGE_CACHE_TIMEOUT', 300)
+    get_listing_cache().set(key, content, timeout=timeout)
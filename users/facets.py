@@ -0,0 +1,169 @@
+# users/facets.py
+#
+# Faceted filtering of the home listing (house type, gender preference, bedrooms, toilets,
+# rent band, max tenants, amenities), with a count next to every option.
+# - Options of one facet are alternatives (OR): "House or Apartment". Amenities are requirements
+#   (AND): "WiFi and Parking". Different facets are combined with AND.
+# - The count of an option is the number of listings the page would show if that option were
+#   added to the current selection, i.e. with the filters of every *other* facet applied
+#   (and, for amenities, the amenities already selected).
+# - All counts come from ONE query: a conditional COUNT per option (COUNT(*) FILTER (WHERE ...),
+#   or SUM(CASE ...) on MySQL) over the listings matching the non-facet filters (search, location,
+#   rent range), so the cost does not grow with the number of options or selected filters.
+
+from django.db.models import Count, Q
+
+from .amenities import amenities_condition
+from .models import Amenity, Property
+
+
+class Facet:
+    """
+    A filter with a fixed set of options: (value, label, Q) triples.
+    """
+
+    def __init__(self, name, label, options, match_all=False):
+        self.name = name # GET parameter
+        self.label = label
+        self._options = options
+        self.match_all = match_all # AND the selected options together instead of OR
+
+    def options(self):
+        return self._options
+
+    def selected(self, params):
+        values = {option[0] for option in self.options()}
+        return [value for value in params.getlist(self.name) if value in values]
+
+    def condition(self, selected):
+        """
+        Q of the selected options (None if nothing is selected).
+        """
+        conditions = [q for value, label, q in self.options() if value in selected]
+        if not conditions:
+            return None
+        combined = conditions[0]
+        for q in conditions[1:]:
+            combined = (combined & q) if self.match_all else (combined | q)
+        return combined
+
+
+class AmenityFacet(Facet):
+    """
+    One option per Amenity; a listing matches an option when it offers that amenity.
+    Matched with Property.amenity_mask (see users/amenities.py).
+    """
+
+    def __init__(self):
+        super().__init__('amenities', 'Amenities', None, match_all=True)
+        self._cached_options = None
+        self._bits = {}
+
+    def options(self):
+        if self._cached_options is None:
+            self._bits = {}
+            self._cached_options = []
+            for pk, name, bit in Amenity.objects.values_list('pk', 'name', 'bit'):
+                self._bits[pk] = bit
+                self._cached_options.append((str(pk), name, amenities_condition([pk], bits={pk: bit})))
+        return self._cached_options
+
+    def condition(self, selected):
+        # All the selected amenities as one bitwise test
+        if not selected:
+            return None
+        self.options()
+        return amenities_condition([int(value) for value in selected], match_all=True, bits=self._bits)
+
+
+def choice_options(choices, field_name):
+    return [(value, label, Q(**{field_name: value})) for value, label in choices]
+
+
+def get_facets():
+    """
+    The facets of the home listing, in display order.
+    """
+    return [
+        Facet('house_type', 'Property Type', choice_options(Property.HOUSE_TYPE_CHOICES, 'house_type')),
+        Facet('gender_preference', 'Gender Preference', choice_options(Property.GENDER_PREFERENCE_CHOICES, 'gender_preferred')),
+        Facet('bedrooms', 'Bedrooms', [
+            ('1', '1 or fewer', Q(bedrooms__lte=1)),
+            ('2', '2', Q(bedrooms=2)),
+            ('3', '3', Q(bedrooms=3)),
+            ('4+', '4 or more', Q(bedrooms__gte=4)),
+        ]),
+        Facet('toilets', 'Toilets', [
+            ('1', '1 or fewer', Q(total_toilets__lte=1)),
+            ('2', '2', Q(total_toilets=2)),
+            ('3+', '3 or more', Q(total_toilets__gte=3)),
+        ]),
+        Facet('rent_band', 'Monthly Rent', [
+            ('0-500', 'Below RM 500', Q(rent__lt=500)),
+            ('500-800', 'RM 500 - 799', Q(rent__gte=500, rent__lt=800)),
+            ('800-1200', 'RM 800 - 1199', Q(rent__gte=800, rent__lt=1200)),
+            ('1200+', 'RM 1200 and above', Q(rent__gte=1200)),
+        ]),
+        Facet('max_tenants', 'Max Tenants', [
+            ('1', '1', Q(max_tenants__lte=1)),
+            ('2', '2', Q(max_tenants=2)),
+            ('3-4', '3 - 4', Q(max_tenants__gte=3, max_tenants__lte=4)),
+            ('5+', '5 or more', Q(max_tenants__gte=5)),
+        ]),
+        AmenityFacet(),
+    ]
+
+
+def _combine(conditions):
+    combined = Q()
+    for condition in conditions:
+        combined &= condition
+    return combined
+
+
+def apply_facets(queryset, params, facets=None):
+    """
+    Narrows a Property queryset to the listings matching every selected facet option in `params` (a QueryDict).
+    """
+    facets = facets if facets is not None else get_facets()
+    conditions = [facet.condition(facet.selected(params)) for facet in facets]
+    return queryset.filter(_combine(condition for condition in conditions if condition is not None))
+
+
+def facet_counts(queryset, params, facets=None):
+    """
+    Counts of every facet option over `queryset` (the listings matching the non-facet filters),
+    computed in a single query. Returns, in display order:
+    [{'name', 'label', 'options': [{'value', 'label', 'count', 'selected'}]}].
+    """
+    facets = facets if facets is not None else get_facets()
+    selected = {facet.name: facet.selected(params) for facet in facets}
+    conditions = {facet.name: facet.condition(selected[facet.name]) for facet in facets}
+
+    aggregates = {}
+    for index, facet in enumerate(facets):
+        # Adding an OR option widens the facet's own selection, adding an AND option narrows it
+        others = _combine(
+            q for name, q in conditions.items()
+            if q is not None and (name != facet.name or facet.match_all)
+        )
+        for option_index, (value, label, q) in enumerate(facet.options()):
+            aggregates[f'f{index}_{option_index}'] = Count('pk', filter=others & q)
+    counts = queryset.order_by().aggregate(**aggregates) if aggregates else {}
+
+    return [
+        {
+            'name': facet.name,
+            'label': facet.label,
+            'options': [
+                {
+                    'value': value,
+                    'label': label,
+                    'count': counts[f'f{index}_{option_index}'],
+                    'selected': value in selected[facet.name],
+                }
+                for option_index, (value, label, q) in enumerate(facet.options())
+            ],
+        }
+        for index, facet in enumerate(facets)
+    ]
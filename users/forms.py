@@ -59,6 +59,13 @@ class BookingForm(forms.ModelForm):
         help_text="The desired check-in date."
     )
 
+    # Generated when the form is first shown; resubmitting the same form returns the same booking.
+    # Not a model field of the form on purpose: a repeated key must not fail unique validation.
+    idempotency_key = forms.CharField(
+        widget=forms.HiddenInput,
+        required=False,
+        max_length=64,
+    )
 
     class Meta:
         model = Booking
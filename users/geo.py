@@ -0,0 +1,100 @@
+# users/geo.py
+#
+# Proximity search over Property.latitude/longitude ("within 2 km of UniKL MIIT", "the 10 nearest").
+# A query never computes a distance for every row of the table:
+# 1. a bounding box around the point is turned into range conditions on the indexed
+#    (latitude, longitude) columns (index property_location_idx), which the database answers
+#    from the index;
+# 2. the exact great-circle (haversine) distance is computed in SQL only for the rows inside
+#    the box, then used to drop the box's corners and to sort by distance.
+# Nearest-N searches start with a small box and widen it until it holds enough candidates.
+
+import math
+
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LATITUDE = math.pi * EARTH_RADIUS_KM / 180
+
+DEFAULT_RADIUS_KM = 2
+MAX_RADIUS_KM = 50
+NEAREST_START_RADIUS_KM = 2
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great-circle distance between two points, in kilometres.
+    """
+    phi1, phi2 = math.radians(float(latitude1)), math.radians(float(latitude2))
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(float(longitude2) - float(longitude1))
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    (min_lat, max_lat, min_lng, max_lng) of a box holding every point within radius_km of the
+    point. The longitude bounds are None when the box reaches a pole or crosses the antimeridian.
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    d_lat = radius_km / KM_PER_DEGREE_LATITUDE
+    min_lat, max_lat = latitude - d_lat, latitude + d_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), None, None
+    d_lng = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(latitude))))
+    min_lng, max_lng = longitude - d_lng, longitude + d_lng
+    if min_lng < -180 or max_lng > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def bounding_box_filter(latitude, longitude, radius_km):
+    """
+    Q of the range conditions of the bounding box, answered from the (latitude, longitude) index.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+    condition = Q(latitude__gte=min_lat, latitude__lte=max_lat)
+    if min_lng is not None:
+        condition &= Q(longitude__gte=min_lng, longitude__lte=max_lng)
+    return condition
+
+
+def distance_expression(latitude, longitude):
+    """
+    SQL expression of the haversine distance (km) between each row and the point.
+    """
+    phi = math.radians(float(latitude))
+    a = (
+        Power(Sin((Radians(F('latitude')) - phi) / 2), 2)
+        + math.cos(phi) * Cos(Radians(F('latitude'))) * Power(Sin((Radians(F('longitude')) - math.radians(float(longitude))) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(a), output_field=FloatField())
+
+
+def within_radius(queryset, latitude, longitude, radius_km=DEFAULT_RADIUS_KM):
+    """
+    Narrows a Property queryset to the listings within radius_km of the point,
+    annotated with `distance_km` and ordered nearest first.
+    """
+    return (
+        queryset.filter(bounding_box_filter(latitude, longitude, radius_km))
+        .annotate(distance_km=distance_expression(latitude, longitude))
+        .filter(distance_km__lte=radius_km)
+        .order_by('distance_km', '-created_at')
+    )
+
+
+def nearest(queryset, latitude, longitude, count, max_radius_km=MAX_RADIUS_KM):
+    """
+    The `count` listings nearest to the point (at most max_radius_km away), annotated with
+    `distance_km`. The search box starts small and is doubled until it holds enough listings.
+    """
+    radius_km = min(NEAREST_START_RADIUS_KM, max_radius_km)
+    while True:
+        found = list(within_radius(queryset, latitude, longitude, radius_km)[:count])
+        # Everything within radius_km has been seen, so the nearest `count` are among them
+        if len(found) >= count or radius_km >= max_radius_km:
+            return found
+        radius_km = min(radius_km * 2, max_radius_km)
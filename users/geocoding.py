@@ -0,0 +1,235 @@
+# users/geocoding.py
+#
+# Server-side geocoding of property addresses.
+# - Property.latitude/longitude are set once, when a property is created or its address changes
+#   (users/signals.py), by a background job (users/tasks.py). Maps are drawn from them directly.
+# - Every lookup is cached in GeocodeCache under the normalized address, so an address is sent to
+#   the provider only once, whichever property uses it. Addresses the provider cannot find are
+#   cached as well (without coordinates); `manage.py geocode_properties --retry-missing` retries them.
+# - The provider is pluggable: settings.GEOCODING_PROVIDER is the dotted path of a GeocodingProvider
+#   subclass. NominatimProvider (OpenStreetMap) is the default; StaticProvider answers from
+#   settings.GEOCODING_STATIC_RESULTS without any network access (tests, offline development).
+# - Places typed in the listing search (geocode_search) are looked up inside the request: with a
+#   short timeout, never waiting for the provider's rate limit, and only cached when found.
+
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+COORDINATE_PLACES = Decimal('0.000001') # Property.latitude/longitude have 6 decimal places
+SEARCH_QUERY_MAX_LENGTH = 200 # Longer search places are not looked up
+
+
+class GeocodingError(Exception):
+    """
+    The provider could not be asked (network error, bad response). Not cached: the lookup is retried later.
+    """
+
+
+def normalize_address(address):
+    """
+    Lowercased address with runs of whitespace and the spacing around commas made uniform.
+    """
+    address = re.sub(r'\s+', ' ', address or '').strip().lower()
+    address = re.sub(r'\s*,\s*', ', ', address)
+    return address.strip(' ,.')
+
+
+def address_key(address):
+    return hashlib.sha256(normalize_address(address).encode()).hexdigest()
+
+
+def candidate_addresses(address):
+    """
+    Queries tried in turn: the full address, then its last two parts (e.g. town and state)
+    when the full address is not found.
+    """
+    candidates = [address]
+    parts = [part.strip() for part in address.split(',') if part.strip()]
+    if len(parts) > 2:
+        candidates.append(', '.join(parts[-2:]))
+    return candidates
+
+
+def to_coordinates(latitude, longitude):
+    """
+    (latitude, longitude) as Decimals rounded to what Property stores, or None if they are not valid.
+    """
+    try:
+        latitude = Decimal(str(latitude)).quantize(COORDINATE_PLACES)
+        longitude = Decimal(str(longitude)).quantize(COORDINATE_PLACES)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+class GeocodingProvider:
+    """
+    Base class of geocoding providers.
+    """
+    name = ''
+
+    def geocode(self, address, timeout=None, wait=True):
+        """
+        (latitude, longitude) of an address, or None if the address was not found.
+        `timeout` (seconds) overrides settings.GEOCODING_TIMEOUT; with wait=False a provider that
+        is rate limited refuses the lookup instead of waiting for its turn.
+        Raises GeocodingError if the lookup could not be made.
+        """
+        raise NotImplementedError
+
+
+class NominatimProvider(GeocodingProvider):
+    """
+    OpenStreetMap's Nominatim search API. Its usage policy asks for an identifying User-Agent
+    and at most one request per second, which is enforced across the threads of a process.
+    """
+    name = 'nominatim'
+    _lock = threading.Lock()
+    _last_request = 0.0
+
+    def geocode(self, address, timeout=None, wait=True):
+        url = getattr(settings, 'GEOCODING_NOMINATIM_URL', 'https://nominatim.openstreetmap.org/search')
+        query = urllib.parse.urlencode({'format': 'json', 'limit': 1, 'q': address})
+        request = urllib.request.Request(f'{url}?{query}', headers={
+            'User-Agent': getattr(settings, 'GEOCODING_USER_AGENT', 'RentUrHouse'),
+            'Accept': 'application/json',
+        })
+        timeout = timeout or getattr(settings, 'GEOCODING_TIMEOUT', 5)
+        if not NominatimProvider._lock.acquire(blocking=wait):
+            raise GeocodingError("Nominatim is busy with another lookup.")
+        try:
+            delay = NominatimProvider._last_request + getattr(settings, 'GEOCODING_MIN_INTERVAL', 1.0) - time.monotonic()
+            if delay > 0:
+                if not wait:
+                    raise GeocodingError("Nominatim rate limit reached.")
+                time.sleep(delay)
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    results = json.load(response)
+            except (OSError, ValueError) as e: # URLError/timeouts are OSErrors; ValueError is bad JSON
+                raise GeocodingError(f"Nominatim lookup failed: {e}") from e
+            finally:
+                NominatimProvider._last_request = time.monotonic()
+        finally:
+            NominatimProvider._lock.release()
+
+        if not results:
+            return None
+        return to_coordinates(results[0].get('lat'), results[0].get('lon'))
+
+
+class StaticProvider(GeocodingProvider):
+    """
+    Answers from settings.GEOCODING_STATIC_RESULTS ({address: (latitude, longitude)}), matching
+    normalized addresses. Never touches the network.
+    """
+    name = 'static'
+
+    def __init__(self):
+        self.results = {
+            normalize_address(address): coordinates
+            for address, coordinates in getattr(settings, 'GEOCODING_STATIC_RESULTS', {}).items()
+        }
+
+    def geocode(self, address, timeout=None, wait=True):
+        coordinates = self.results.get(normalize_address(address))
+        return to_coordinates(*coordinates) if coordinates else None
+
+
+def get_provider():
+    return import_string(getattr(settings, 'GEOCODING_PROVIDER', 'users.geocoding.NominatimProvider'))()
+
+
+def cached_lookup(address):
+    """
+    The GeocodeCache entry of an address, or None if it has never been looked up.
+    """
+    from .models import GeocodeCache
+
+    return GeocodeCache.objects.filter(address_key=address_key(address)).first()
+
+
+def geocode_address(address):
+    """
+    (latitude, longitude) of an address, or None if it cannot be found. Only addresses that
+    are not cached yet are sent to the provider.
+    """
+    from .models import GeocodeCache
+
+    entry = cached_lookup(address)
+    metrics.count_cache_lookup('geocoding', entry is not None)
+    if entry is None:
+        provider = get_provider()
+        coordinates = None
+        for candidate in candidate_addresses(address):
+            coordinates = provider.geocode(candidate)
+            if coordinates is not None:
+                break
+        latitude, longitude = coordinates or (None, None)
+        entry, _ = GeocodeCache.objects.get_or_create(address_key=address_key(address), defaults={
+            'address': normalize_address(address), 'latitude': latitude, 'longitude': longitude, 'provider': provider.name,
+        })
+    return entry.coordinates
+
+
+def geocode_search(query):
+    """
+    (latitude, longitude) of a place typed in the listing search, or None if it cannot be found.
+    Runs inside the request, so unlike geocode_address(): cache misses are sent to the provider
+    with settings.GEOCODING_SEARCH_TIMEOUT and without waiting for its rate limit (GeocodingError
+    when it is busy), and only places that were found are cached, under their normalized form.
+    """
+    from .models import GeocodeCache
+
+    address = normalize_address(query)
+    if not re.search(r'\w', address) or len(address) > SEARCH_QUERY_MAX_LENGTH:
+        return None
+    entry = cached_lookup(address)
+    metrics.count_cache_lookup('geocoding', entry is not None)
+    if entry is not None:
+        return entry.coordinates
+
+    provider = get_provider()
+    coordinates = provider.geocode(address, timeout=getattr(settings, 'GEOCODING_SEARCH_TIMEOUT', 2), wait=False)
+    if coordinates is not None:
+        GeocodeCache.objects.get_or_create(address_key=address_key(address), defaults={
+            'address': address, 'latitude': coordinates[0], 'longitude': coordinates[1], 'provider': provider.name,
+        })
+    return coordinates
+
+
+def geocode_property(property_pk):
+    """
+    Background job: stores the coordinates of a Property's address on it.
+    """
+    from .caching import bump_listing_version
+    from .models import Property
+
+    property_obj = Property.objects.filter(pk=property_pk).only('pk', 'address').first()
+    if property_obj is None or not property_obj.address.strip():
+        return None
+    coordinates = geocode_address(property_obj.address)
+    if coordinates is None:
+        return None
+    # Only record them if the address was not changed in the meantime
+    updated = Property.objects.filter(pk=property_pk, address=property_obj.address).update(
+        latitude=coordinates[0], longitude=coordinates[1], updated_at=timezone.now(),
+    )
+    if updated:
+        bump_listing_version()
+    return coordinates
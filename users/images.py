@@ -0,0 +1,158 @@
+# users/images.py
+#
+# Resized, compressed derivatives of uploaded property images.
+# Every image is resized to each of DERIVATIVE_WIDTHS and saved as JPEG and WebP by the
+# background workers (users/tasks.py) once the upload is committed. Derivatives are stored under
+# <upload dir>/derivatives/<hash of the original's bytes>/, so identical uploads share them.
+# The result is recorded on the model (Property/PropertyImage.image_derivatives) and rendered as a
+# <picture> with srcsets by the {% property_image %} and {% gallery_image %} tags
+# (users/templatetags/property_images.py).
+
+import hashlib
+import io
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+# Name -> width in pixels, smallest first
+DERIVATIVE_WIDTHS = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 1200,
+}
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+
+
+def is_external(field_file):
+    # Some listings store the URL of an image hosted elsewhere instead of an upload
+    return bool(field_file) and field_file.name.startswith(('http://', 'https://'))
+
+
+def source_url(field_file):
+    """
+    URL of the original image.
+    """
+    return field_file.name if is_external(field_file) else field_file.url
+
+
+def _content_hash(field_file):
+    digest = hashlib.sha256()
+    with field_file.open('rb') as f:
+        for chunk in f.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_rgb(image):
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _save(storage, name, image, image_format, **options):
+    if not storage.exists(name):
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, **options)
+        storage.save(name, ContentFile(buffer.getvalue()))
+    return name
+
+
+def derivatives_directory(name, digest=None):
+    """
+    Directory holding the derivatives of an image, from the SHA-256 of its bytes
+    (content-addressed names, see users/storage.py, are that digest).
+    """
+    if digest is None:
+        digest = posixpath.splitext(posixpath.basename(name))[0]
+    return posixpath.join(posixpath.dirname(name), 'derivatives', digest[:32])
+
+
+def build_derivatives(field_file, storage=default_storage):
+    """
+    Creates the derivatives of an uploaded image and returns their description:
+    {'source': <name of the original>, 'sizes': {<size>: {'jpeg', 'webp', 'width', 'height'}}}.
+    """
+    directory = derivatives_directory(field_file.name, _content_hash(field_file))
+    with field_file.open('rb') as f:
+        original = _to_rgb(ImageOps.exif_transpose(Image.open(f)))
+
+    sizes = {}
+    for size, width in DERIVATIVE_WIDTHS.items():
+        image = original
+        if original.width > width:
+            height = max(round(original.height * width / original.width), 1)
+            image = original.resize((width, height), Image.LANCZOS)
+        sizes[size] = {
+            'jpeg': _save(storage, f'{directory}/{size}.jpg', image, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True),
+            'webp': _save(storage, f'{directory}/{size}.webp', image, 'WEBP', quality=WEBP_QUALITY, method=4),
+            'width': image.width,
+            'height': image.height,
+        }
+    return {'source': field_file.name, 'sizes': sizes}
+
+
+def needs_derivatives(field_file, derivatives):
+    return bool(field_file) and not is_external(field_file) and (derivatives or {}).get('source') != field_file.name
+
+
+def generate_property_derivatives(property_pk):
+    """
+    Background job: builds the derivatives of a Property's main_image and records them.
+    """
+    from .caching import bump_listing_version
+    from .models import Property
+
+    property_obj = Property.objects.filter(pk=property_pk).only('pk', 'main_image', 'image_derivatives').first()
+    if property_obj is None or not needs_derivatives(property_obj.main_image, property_obj.image_derivatives):
+        return
+    derivatives = build_derivatives(property_obj.main_image)
+    # Only record them if the image was not replaced in the meantime
+    updated = Property.objects.filter(pk=property_pk, main_image=property_obj.main_image.name).update(
+        image_derivatives=derivatives, updated_at=timezone.now(),
+    )
+    if updated:
+        bump_listing_version()
+
+
+def generate_gallery_derivatives(image_pk):
+    """
+    Background job: builds the derivatives of a PropertyImage and records them.
+    """
+    from .models import PropertyImage
+
+    gallery_image = PropertyImage.objects.filter(pk=image_pk).only('pk', 'image', 'image_derivatives').first()
+    if gallery_image is None or not needs_derivatives(gallery_image.image, gallery_image.image_derivatives):
+        return
+    derivatives = build_derivatives(gallery_image.image)
+    PropertyImage.objects.filter(pk=image_pk, image=gallery_image.image.name).update(image_derivatives=derivatives)
+
+
+def responsive_image(field_file, derivatives, size):
+    """
+    src/srcset attributes for an image at `size` (see DERIVATIVE_WIDTHS). Falls back to the
+    original image while its derivatives are missing or describe a previous upload.
+    """
+    derivatives = derivatives or {}
+    if not field_file or derivatives.get('source') != field_file.name:
+        return {'src': source_url(field_file), 'external': is_external(field_file)}
+
+    chosen = derivatives['sizes'][size]
+    # Small originals are not upscaled, so several sizes can share a width
+    variants = []
+    for variant in derivatives['sizes'].values():
+        if not variants or variant['width'] != variants[-1]['width']:
+            variants.append(variant)
+    return {
+        'src': default_storage.url(chosen['jpeg']),
+        'srcset': ', '.join(f"{default_storage.url(v['jpeg'])} {v['width']}w" for v in variants),
+        'webp_srcset': ', '.join(f"{default_storage.url(v['webp'])} {v['width']}w" for v in variants),
+        'width': chosen['width'],
+        'height': chosen['height'],
+    }
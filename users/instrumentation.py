@@ -0,0 +1,244 @@
+# users/instrumentation.py
+#
+# Per-request timing and SQL instrumentation (RequestInstrumentationMiddleware).
+# - Every request is timed and logged as one JSON line on the "renthouse.requests" logger
+#   (WARNING above settings.SLOW_REQUEST_MS, INFO otherwise; that logger is at WARNING unless
+#   RENTHOUSE_REQUEST_LOG_LEVEL says otherwise, so by default only slow requests are written).
+# - A sample of the requests (settings.REQUEST_SAMPLE_RATE) is instrumented further: number and
+#   total time of SQL queries, template render time, and repeated queries. Queries are grouped
+#   by fingerprint (the SQL with its parameters left out and IN lists collapsed), so a
+#   fingerprint run settings.DUPLICATE_QUERY_THRESHOLD times or more in one request is
+#   reported as a likely N+1. Queries slower than settings.SLOW_QUERY_MS are logged on
+#   "renthouse.slow_queries" (fingerprint only: parameters can hold personal data).
+# - A rolling aggregate per view (the last settings.REQUEST_STATS_WINDOW requests of each)
+#   is kept in memory, per process, and served to staff by request_stats_view.
+# - The same timings feed the /metrics histograms (users/metrics.py).
+# Unsampled requests only cost two clock reads (and the log line, when it is written).
+
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends import django as django_backend
+
+from . import metrics
+
+request_logger = logging.getLogger('renthouse.requests')
+slow_query_logger = logging.getLogger('renthouse.slow_queries')
+
+_current_record = ContextVar('request_record', default=None)
+
+_IN_LIST_RE = re.compile(r'\bIN \((?:%s|\?)(?:, ?(?:%s|\?))*\)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    The SQL of a query with IN (...) lists of any length made alike, to group repeated queries.
+    """
+    return _IN_LIST_RE.sub('IN (...)', _WHITESPACE_RE.sub(' ', sql).strip())
+
+
+class RequestRecord:
+    """
+    Queries and template rendering of one instrumented request. Installed with capture().
+    """
+
+    def __init__(self):
+        self.query_count = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper (connection.execute_wrapper)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.query_count += 1
+            self.sql_ms += elapsed
+            query = fingerprint(sql)
+            self.fingerprints[query] += 1
+            if elapsed >= getattr(settings, 'SLOW_QUERY_MS', 200):
+                slow_query_logger.warning(json.dumps({
+                    'duration_ms': round(elapsed, 2),
+                    'database': context['connection'].alias,
+                    'sql': query,
+                }))
+
+    def duplicates(self, threshold=None):
+        """
+        [(fingerprint, count)] of the queries run at least `threshold` times, most repeated first.
+        """
+        threshold = threshold or getattr(settings, 'DUPLICATE_QUERY_THRESHOLD', 5)
+        return [(query, count) for query, count in self.fingerprints.most_common() if count >= threshold]
+
+
+@contextmanager
+def capture():
+    """
+    Records the queries of every database connection and the template rendering in the block.
+    """
+    record = RequestRecord()
+    token = _current_record.set(record)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record))
+            yield record
+    finally:
+        _current_record.reset(token)
+
+
+def _instrument_templates():
+    # Times the top-level render of Django templates (render() and TemplateResponse both go
+    # through the backend Template); included templates are part of their parent's time.
+    original = django_backend.Template.render
+    if getattr(original, 'instrumented', False):
+        return
+
+    def render(self, context=None, request=None):
+        record = _current_record.get()
+        if record is None:
+            return original(self, context, request)
+        start = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            record.template_ms += (time.perf_counter() - start) * 1000
+
+    render.instrumented = True
+    django_backend.Template.render = render
+
+
+def _percentile(ordered, fraction):
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class RequestStats:
+    """
+    Rolling per-view aggregate of the latest requests (thread safe, per process).
+    """
+
+    def __init__(self, window=None):
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def add(self, view, duration_ms, status, record=None):
+        window = self.window or getattr(settings, 'REQUEST_STATS_WINDOW', 500)
+        with self._lock:
+            view_stats = self._views.get(view)
+            if view_stats is None:
+                view_stats = self._views[view] = {
+                    'requests': 0,
+                    'errors': 0,
+                    'durations': deque(maxlen=window),
+                    'samples': deque(maxlen=window), # (queries, sql_ms, template_ms, duplicate fingerprints)
+                    'duplicates': Counter(),
+                }
+            view_stats['requests'] += 1
+            view_stats['errors'] += status >= 500
+            view_stats['durations'].append(duration_ms)
+            if record is not None:
+                duplicates = record.duplicates()
+                view_stats['samples'].append((record.query_count, record.sql_ms, record.template_ms, len(duplicates)))
+                for query, count in duplicates:
+                    view_stats['duplicates'][query] += 1
+
+    def summary(self):
+        """
+        {view: {...}}, slowest (p95) first.
+        """
+        with self._lock:
+            views = {
+                view: (stats['requests'], stats['errors'], sorted(stats['durations']), list(stats['samples']),
+                       stats['duplicates'].most_common(3))
+                for view, stats in self._views.items()
+            }
+        summary = {}
+        for view, (requests, errors, durations, samples, duplicates) in views.items():
+            summary[view] = {
+                'requests': requests,
+                'errors': errors,
+                'p50_ms': round(_percentile(durations, 0.5), 2),
+                'p95_ms': round(_percentile(durations, 0.95), 2),
+                'max_ms': round(durations[-1], 2),
+                'sampled': len(samples),
+                'avg_queries': round(sum(s[0] for s in samples) / len(samples), 1) if samples else None,
+                'max_queries': max(s[0] for s in samples) if samples else None,
+                'avg_sql_ms': round(sum(s[1] for s in samples) / len(samples), 2) if samples else None,
+                'avg_template_ms': round(sum(s[2] for s in samples) / len(samples), 2) if samples else None,
+                'samples_with_duplicates': sum(1 for s in samples if s[3]),
+                'top_duplicates': [{'sql': query, 'requests': count} for query, count in duplicates],
+            }
+        return dict(sorted(summary.items(), key=lambda item: item[1]['p95_ms'], reverse=True))
+
+
+stats = RequestStats()
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Times every request; instruments a sample of them (see the top of this module).
+    Listed first in settings.MIDDLEWARE so that the other middleware is timed too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _instrument_templates()
+
+    def __call__(self, request):
+        sampled = random.random() < getattr(settings, 'REQUEST_SAMPLE_RATE', 0.1)
+        start = time.perf_counter()
+        if sampled:
+            with capture() as record:
+                response = self.get_response(request)
+        else:
+            record = None
+            response = self.get_response(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        stats.add(view, duration_ms, response.status_code, record)
+        metrics.observe_request(match, request.method, response.status_code, duration_ms, record.query_count if record else None)
+        self.log(request, response, view, duration_ms, record)
+        return response
+
+    def log(self, request, response, view, duration_ms, record):
+        slow = duration_ms >= getattr(settings, 'SLOW_REQUEST_MS', 1000)
+        level = logging.WARNING if slow else logging.INFO
+        if not request_logger.isEnabledFor(level): # Only slow requests are logged by default
+            return
+        line = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+        }
+        if record is not None:
+            duplicates = record.duplicates()
+            line.update({
+                'queries': record.query_count,
+                'sql_ms': round(record.sql_ms, 2),
+                'template_ms': round(record.template_ms, 2),
+                'duplicate_queries': [{'sql': query, 'count': count} for query, count in duplicates],
+            })
+        request_logger.log(level, json.dumps(line))
@@ -0,0 +1,95 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+
+from users.amenities import amenities_condition, mask_of
+from users.models import Amenity, CustomUser, Property
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares filtering properties on several amenities through the ManyToMany table (GROUP BY/HAVING, "
+        "and one join per amenity) with the Property.amenity_mask bitwise test, on generated listings. "
+        "Everything is created inside a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000], help="Numbers of listings to measure at.")
+        parser.add_argument('--amenities', type=int, default=12, help="Number of amenities to generate.")
+        parser.add_argument('--filter-size', type=int, default=3, help="Number of amenities every listing must have.")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs of each query; the median is reported.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['filter_size'] > options['amenities']:
+            raise CommandError("--filter-size cannot be larger than --amenities.")
+        self.random = random.Random(options['seed'])
+
+        with transaction.atomic():
+            owner = CustomUser.objects.create_user('benchmark-owner', 'benchmark-owner@example.com', None, role='owner')
+            amenities = [Amenity.objects.create(name=f'Benchmark amenity {i}') for i in range(options['amenities'])]
+            if any(amenity.bit is None for amenity in amenities):
+                self.stdout.write(self.style.WARNING("Not enough free amenity bits: some amenities use the join fallback."))
+            wanted = amenities[:options['filter_size']]
+            ids = [amenity.pk for amenity in wanted]
+
+            strategies = {
+                'group by / having': lambda: Property.objects.filter(is_available=True, amenities__in=ids).annotate(
+                    matched=Count('amenities', filter=Q(amenities__in=ids))
+                ).filter(matched=len(ids)).count(),
+                'join per amenity': lambda: self._join_per_amenity(ids).count(),
+                'amenity_mask': lambda: Property.objects.filter(is_available=True).filter(amenities_condition(ids)).count(),
+            }
+
+            created = 0
+            for size in sorted(options['sizes']):
+                self._create_listings(owner, amenities, size - created)
+                created = size
+                self.stdout.write(f"\n{size} listings, filtering on {len(ids)} of {len(amenities)} amenities:")
+                results = {}
+                for name, query in strategies.items():
+                    timings = []
+                    for _ in range(options['repeat']):
+                        start = time.perf_counter()
+                        results[name] = query()
+                        timings.append((time.perf_counter() - start) * 1000)
+                    self.stdout.write(f"  {name:<20} {statistics.median(timings):9.2f} ms  ({results[name]} matches)")
+                if len(set(results.values())) != 1:
+                    self.stdout.write(self.style.ERROR("  Strategies disagree on the number of matches!"))
+
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS("\nDone; the generated data was rolled back."))
+
+    def _join_per_amenity(self, ids):
+        queryset = Property.objects.filter(is_available=True)
+        for pk in ids:
+            queryset = queryset.filter(amenities=pk) # Separate filter() calls: one join each
+        return queryset
+
+    def _create_listings(self, owner, amenities, count, batch_size=2000):
+        through = Property.amenities.through
+        for start in range(0, count, batch_size):
+            chosen = [
+                self.random.sample(amenities, self.random.randint(0, len(amenities)))
+                for _ in range(min(batch_size, count - start))
+            ]
+            properties = Property.objects.bulk_create([
+                Property(
+                    house_type='House', title='Benchmark listing', rent=500, address='Benchmark', owner=owner,
+                    amenity_mask=mask_of(amenity.bit for amenity in listing_amenities if amenity.bit is not None),
+                )
+                for listing_amenities in chosen
+            ], batch_size=batch_size)
+            if connection.features.can_return_rows_from_bulk_insert:
+                pks = [property_obj.pk for property_obj in properties]
+            else: # MySQL: the rows just inserted are the owner's latest
+                pks = list(Property.objects.filter(owner=owner).order_by('-pk').values_list('pk', flat=True)[:len(properties)])[::-1]
+            through.objects.bulk_create([
+                through(property_id=pk, amenity_id=amenity.pk)
+                for pk, listing_amenities in zip(pks, chosen)
+                for amenity in listing_amenities
+            ], batch_size=batch_size * 4)
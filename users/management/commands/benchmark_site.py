@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.benchmark import compare_reports, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the home listing, dashboards, chat and receipt pages through the Django test "
+        "client: p50/p95 latency and SQL query counts, written to a JSON report that can be "
+        "compared with the report of a previous release (see users/benchmark.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help="Timed requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=2, help="Untimed requests per scenario first (fill the caches).")
+        parser.add_argument('--only', nargs='+', help="Names of the scenarios to run.")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--compare', help="A previous JSON report to compare the results with.")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}") from e
+
+        self.stdout.write(f"{'scenario':<20} {'status':>6} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8}")
+        report = run_benchmark(
+            repeat=options['repeat'], warmup=options['warmup'], only=options['only'], progress=self._progress,
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
+
+        if previous:
+            self.stdout.write(f"\nCompared with {options['compare']} ({previous.get('created_at', '?')}):")
+            for name, p50_before, p50_after, change, p95_before, p95_after, queries_before, queries_after in compare_reports(previous, report):
+                line = (
+                    f"  {name:<20} p50 {p50_before:8.2f} -> {p50_after:8.2f} ms ({change:+.1f}%)  "
+                    f"p95 {p95_before:8.2f} -> {p95_after:8.2f} ms  queries {queries_before} -> {queries_after}"
+                )
+                worse = change > 10 or queries_after > queries_before
+                self.stdout.write(self.style.WARNING(line) if worse else line)
+
+    def _progress(self, name, result):
+        line = f"{name:<20} {result['status']:>6} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['queries_max']:>8}"
+        self.stdout.write(line if result['status'] == 200 else self.style.ERROR(line))
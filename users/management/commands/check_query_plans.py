@@ -0,0 +1,152 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from users.models import Booking, ChatMessage, Conversation, CustomUser, MaintenanceRequest, PaymentRecord, Property
+
+# Any SCAN walks the whole table, also "SCAN t USING INDEX i" (the whole index, in its order);
+# only SEARCH lines narrow the rows down
+SQLITE_FULL_SCAN_RE = re.compile(r'\bSCAN (?!CONSTANT ROW)(\w+)')
+POSTGRES_FULL_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+
+
+def hot_queries(owner_id, tenant_id, property_id):
+    """
+    The queries behind the home page and the owner/tenant dashboards, as (label, queryset) pairs.
+    Keep this list in step with the views when their filters change.
+    """
+    return [
+        ('home: available listings', Property.objects.available().order_by('-created_at', '-pk')[:12]),
+        ('owner: my properties', Property.objects.filter(owner_id=owner_id).order_by('-created_at')),
+        ('owner: pending bookings', Booking.objects.filter(property__owner_id=owner_id, status='pending').order_by('start_date')),
+        ('owner: all bookings', Booking.objects.filter(property__owner_id=owner_id).order_by('-start_date')),
+        ('owner: maintenance requests', MaintenanceRequest.objects.filter(property__owner_id=owner_id).order_by('-submitted_date')),
+        ('owner: received payments', PaymentRecord.objects.filter(receiver_of_payment_id=owner_id).order_by('-payment_date')),
+        ('tenant: current rental', Booking.objects.filter(tenant_id=tenant_id, status='confirmed').order_by('-start_date')[:1]),
+        ('tenant: bookings', Booking.objects.filter(tenant_id=tenant_id).order_by('-start_date')),
+        ('tenant: active booking check', Booking.objects.filter(tenant_id=tenant_id, status__in=['pending', 'confirmed'])),
+        ('tenant: maintenance requests', MaintenanceRequest.objects.filter(submitted_by_id=tenant_id).order_by('-submitted_date')),
+        ('tenant: payments', PaymentRecord.objects.filter(user_id=tenant_id).order_by('-payment_date')),
+        ('chat: recent conversations', Conversation.objects.filter(participant_a_id=owner_id).order_by('-last_message_at')),
+        ('chat: recent conversations (b side)', Conversation.objects.filter(participant_b_id=owner_id).order_by('-last_message_at')),
+        ('chat: history', ChatMessage.objects.filter(
+            Q(sender_id=owner_id, receiver_id=tenant_id, property_id=property_id) |
+            Q(sender_id=tenant_id, receiver_id=owner_id, property_id=property_id)
+        ).order_by('timestamp')),
+    ]
+
+
+def _mysql_full_scans(queryset, min_rows):
+    plan = json.loads(queryset.explain(format='json'))
+    scans = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            table = node.get('table')
+            if isinstance(table, dict) and table.get('access_type') == 'ALL':
+                if int(table.get('rows_examined_per_scan', 0)) >= min_rows:
+                    scans.append(table.get('table_name'))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(plan)
+    return scans, json.dumps(plan, indent=2)
+
+
+def _sqlite_full_scans(queryset, min_rows):
+    plan = queryset.explain()
+    scans = []
+    for line in plan.splitlines():
+        match = SQLITE_FULL_SCAN_RE.search(line.strip())
+        if match:
+            scans.append(match.group(1))
+    return scans, plan
+
+
+def _postgresql_full_scans(queryset, min_rows):
+    plan = queryset.explain()
+    return POSTGRES_FULL_SCAN_RE.findall(plan), plan
+
+
+PLAN_CHECKERS = {
+    'mysql': _mysql_full_scans,
+    'sqlite': _sqlite_full_scans,
+    'postgresql': _postgresql_full_scans,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs EXPLAIN on every hot dashboard/listing query and fails if any of them "
+        "falls back to a full table scan. Run it against a database with realistic data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner-id', type=int, help="Owner whose dashboard queries are explained (default: owner of the latest booking).")
+        parser.add_argument('--tenant-id', type=int, help="Tenant whose dashboard queries are explained (default: tenant of the latest booking).")
+        parser.add_argument('--property-id', type=int, help="Property whose chat history is explained (default: property of the latest booking).")
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help="MySQL only: ignore full scans the optimizer estimates below this many rows "
+                 "(it prefers scanning tiny tables over using an index).",
+        )
+        parser.add_argument('--show-plans', action='store_true', help="Print the full plan of every query.")
+
+    def handle(self, *args, **options):
+        checker = PLAN_CHECKERS.get(connection.vendor)
+        if checker is None:
+            raise CommandError(f"Query plan checks are not supported on '{connection.vendor}'.")
+
+        owner_id, tenant_id, property_id = self._sample_ids(options)
+        self.stdout.write(f"Explaining with owner {owner_id}, tenant {tenant_id}, property {property_id}.")
+
+        failures = []
+        for label, queryset in hot_queries(owner_id, tenant_id, property_id):
+            scans, plan = checker(queryset, options['min_rows'])
+            if scans:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {label}: {', '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok         {label}"))
+            if options['show_plans'] or scans:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot queries fall back to a full table scan: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("All hot queries use an index."))
+
+    def _sample_ids(self, options):
+        """
+        Ids of real rows to explain the queries with, since plans depend on the values: the
+        parties and property of the latest booking matching the given options.
+        """
+        bookings = Booking.objects.order_by('-pk')
+        if options['owner_id']:
+            bookings = bookings.filter(property__owner_id=options['owner_id'])
+        if options['tenant_id']:
+            bookings = bookings.filter(tenant_id=options['tenant_id'])
+        if options['property_id']:
+            bookings = bookings.filter(property_id=options['property_id'])
+        booking = bookings.values('property__owner_id', 'tenant_id', 'property_id').first() or {}
+
+        owner_id = options['owner_id'] or booking.get('property__owner_id') or self._first_id(
+            CustomUser.objects.filter(role='owner', owned_properties__isnull=False)
+        )
+        tenant_id = options['tenant_id'] or booking.get('tenant_id') or self._first_id(
+            CustomUser.objects.filter(role='student')
+        )
+        property_id = options['property_id'] or booking.get('property_id') or self._first_id(
+            Property.objects.filter(owner_id=owner_id)
+        )
+        if None in (owner_id, tenant_id, property_id):
+            raise CommandError("No owner, tenant or property to explain the queries with: run it against a seeded database.")
+        return owner_id, tenant_id, property_id
+
+    def _first_id(self, queryset):
+        return queryset.order_by('pk').values_list('pk', flat=True).first()
@@ -0,0 +1,112 @@
+import os
+import posixpath
+import shutil
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from users.caching import bump_listing_version
+from users.models import MediaBlob
+from users.storage import content_addressed_fields, file_digest, is_tracked
+
+TEMPORARY_SUFFIXES = ('.upload', '.tmp')
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError: # No hard links on this filesystem
+        shutil.copyfile(source, destination)
+
+
+class Command(BaseCommand):
+    help = (
+        "Scans the upload directories of content-addressed image fields under MEDIA_ROOT, collapses "
+        "files with identical bytes into one content-addressed file, repoints every row at it and "
+        "rebuilds the MediaBlob reference counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report duplicates, change nothing.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        fields = content_addressed_fields()
+
+        directories = {}
+        for model, field in fields:
+            directory = field.upload_to.rstrip('/') if isinstance(field.upload_to, str) else ''
+            directories.setdefault((field.storage.location, directory), field.storage)
+
+        renames = {} # old name -> content-addressed name
+        duplicates = freed = 0
+        for (location, directory), storage in directories.items():
+            groups = defaultdict(list)
+            for filename in sorted(storage.listdir(directory)[1]):
+                if filename.endswith(TEMPORARY_SUFFIXES):
+                    continue
+                name = posixpath.join(directory, filename)
+                with storage.open(name, 'rb') as f:
+                    groups[file_digest(f)].append(name)
+
+            for digest, names in groups.items():
+                target = storage.content_name(names[0], digest)
+                if len(names) > 1:
+                    duplicates += len(names) - 1
+                    freed += storage.size(names[0]) * (len(names) - 1)
+                    self.stdout.write(f"{target}: {len(names)} copies ({', '.join(names)})")
+                for name in names:
+                    if name != target:
+                        renames[name] = (storage, target)
+                if not dry_run and target not in names:
+                    # A new name for the same bytes: the old files stay until the rows are repointed
+                    _link_or_copy(storage.path(names[0]), storage.path(target))
+
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f"{duplicates} duplicate files ({freed} bytes) and {len(renames)} files to rename. Nothing changed (dry run)."
+            ))
+            return
+
+        with transaction.atomic():
+            for model, field in fields:
+                self._repoint(model, field, {old: target for old, (storage, target) in renames.items() if storage is field.storage})
+            self._recount(fields)
+
+        # Only now that the rows point at the content-addressed files (a failure above leaves
+        # the old files in place, and running again reuses the new ones)
+        for old, (storage, target) in renames.items():
+            if storage.exists(old):
+                storage.delete(old)
+        bump_listing_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {duplicates} duplicate files ({freed} bytes); {len(renames)} files renamed to their content address."
+        ))
+
+    def _repoint(self, model, field, renames):
+        field_names = {f.name for f in model._meta.fields}
+        rows = model._default_manager.filter(**{f'{field.attname}__in': list(renames)})
+        for row in rows.iterator():
+            old = getattr(row, field.attname).name
+            changes = {field.attname: renames[old]}
+            derivatives = getattr(row, 'image_derivatives', None)
+            if derivatives and derivatives.get('source') == old:
+                # Derivatives are stored by content hash, so they still match the renamed file
+                changes['image_derivatives'] = {**derivatives, 'source': renames[old]}
+            if 'updated_at' in field_names:
+                changes['updated_at'] = timezone.now()
+            model._default_manager.filter(pk=row.pk).update(**changes)
+
+    def _recount(self, fields):
+        counts = Counter()
+        for model, field in fields:
+            names = model._default_manager.exclude(**{f'{field.attname}__isnull': True}).values_list(field.attname, flat=True)
+            counts.update(name for name in names.iterator() if is_tracked(name))
+        MediaBlob.objects.all().delete()
+        MediaBlob.objects.bulk_create(
+            [MediaBlob(name=name, ref_count=count) for name, count in counts.items()], batch_size=500
+        )
+        self.stdout.write(f"Reference counts rebuilt for {len(counts)} files.")
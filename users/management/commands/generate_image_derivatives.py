@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from users import images
+from users.models import Property, PropertyImage
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the resized JPEG/WebP derivatives of every property and gallery image that does not "
+        "have them yet (e.g. images uploaded before the derivative pipeline existed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild derivatives that already exist.")
+
+    def handle(self, *args, **options):
+        jobs = [
+            # (label, queryset, image field, job)
+            ('properties', Property.objects.exclude(main_image='').exclude(main_image__isnull=True),
+             'main_image', images.generate_property_derivatives),
+            ('gallery images', PropertyImage.objects.all(), 'image', images.generate_gallery_derivatives),
+        ]
+        for label, queryset, field_name, generate in jobs:
+            if options['force']:
+                queryset.update(image_derivatives={})
+
+            generated = failed = 0
+            for obj in queryset.only('pk', field_name, 'image_derivatives').iterator():
+                field_file = getattr(obj, field_name)
+                if not images.needs_derivatives(field_file, obj.image_derivatives):
+                    continue
+                try:
+                    generate(obj.pk)
+                except (OSError, ValueError) as e: # Missing file, or not a readable image
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f"{obj._meta.verbose_name.capitalize()} {obj.pk} ({field_file.name}): {e}"))
+                else:
+                    generated += 1
+
+            self.stdout.write(self.style.SUCCESS(f"Generated derivatives for {generated} {label} ({failed} failed)."))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from users import geocoding
+from users.models import GeocodeCache, Property
+
+
+class Command(BaseCommand):
+    help = (
+        "Geocodes every property that has an address but no coordinates yet "
+        "(e.g. properties created before server-side geocoding existed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retry-missing', action='store_true',
+            help="Forget cached 'not found' lookups first, so those addresses are asked again.",
+        )
+
+    def handle(self, *args, **options):
+        if options['retry_missing']:
+            forgotten, _ = GeocodeCache.objects.filter(latitude__isnull=True).delete()
+            self.stdout.write(f"Forgot {forgotten} cached lookups without a result.")
+
+        queryset = Property.objects.filter(latitude__isnull=True).exclude(address='')
+        geocoded = not_found = failed = 0
+        for pk, address in queryset.values_list('pk', 'address').iterator():
+            try:
+                coordinates = geocoding.geocode_property(pk)
+            except geocoding.GeocodingError as e:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f"Property {pk} ({address}): {e}"))
+                continue
+            if coordinates is None:
+                not_found += 1
+            else:
+                geocoded += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Geocoded {geocoded} properties ({not_found} addresses not found, {failed} failed)."
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the PropertySearchTerm inverted index used by the home page search."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of term rows inserted per query.")
+
+    def handle(self, *args, **options):
+        if search.get_backend() != 'terms':
+            self.stdout.write(self.style.WARNING(
+                "The active search backend is MySQL FULLTEXT; the term index is not used, rebuilding anyway."
+            ))
+        indexed = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} properties."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from users.models import Property
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the booking counters (and is_available) of every property from its bookings "
+        "and repairs the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report drifted properties, do not repair them.")
+
+    def handle(self, *args, **options):
+        repaired = Property.objects.recompute_booking_counters(dry_run=options['dry_run'])
+
+        for property_obj in repaired:
+            self.stdout.write(
+                f"Property {property_obj.pk} ({property_obj.title}): pending={property_obj.pending_bookings_count} "
+                f"confirmed={property_obj.confirmed_bookings_count} occupants={property_obj.active_occupants} "
+                f"available={property_obj.is_available}"
+            )
+
+        verb = "drifted" if options['dry_run'] else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"{len(repaired)} properties {verb}."))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.seeding import DEFAULT_VOLUMES, DatasetBuilder, clear_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a synthetic dataset for load testing: users, properties, amenities, bookings, "
+        "occupants, chat messages, maintenance requests and payments, skewed like real traffic "
+        "(see users/seeding.py). Run `manage.py benchmark_site` on it afterwards."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_VOLUMES.items():
+            parser.add_argument(f'--{name}', type=int, default=default, help=f"Number of {name} to generate (default {default}).")
+        parser.add_argument('--scale', type=float, default=1.0, help="Multiplies every volume but the amenities, e.g. 10 for intake week.")
+        parser.add_argument('--tag', default='bench', help="Prefix of the generated usernames; identifies the dataset.")
+        parser.add_argument('--seed', type=int, default=42, help="Random seed: the same seed generates the same dataset.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows inserted per query.")
+        parser.add_argument('--clear', action='store_true', help="Delete the dataset with this tag first.")
+
+    def handle(self, *args, **options):
+        if options['scale'] <= 0:
+            raise CommandError("--scale must be positive.")
+        if options['clear']:
+            deleted = clear_dataset(options['tag'])
+            self.stdout.write(f"Deleted the {deleted} users of the previous '{options['tag']}' dataset and their data.")
+
+        volumes = {name: int(options[name] * (1 if name == 'amenities' else options['scale'])) for name in DEFAULT_VOLUMES}
+        builder = DatasetBuilder(
+            tag=options['tag'], volumes=volumes, seed=options['seed'], batch_size=options['batch_size'], stdout=self.stdout,
+        )
+        try:
+            counts = builder.build()
+        except Exception as e: # Most likely a dataset with this tag already exists
+            raise CommandError(f"Could not generate the dataset ({e}). Use --clear or another --tag.") from e
+        self.stdout.write(self.style.SUCCESS(
+            "Generated " + ", ".join(f"{count} {name}" for name, count in counts.items()) + "."
+        ))
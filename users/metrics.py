@@ -0,0 +1,315 @@
+# users/metrics.py
+#
+# Operational metrics in the Prometheus text format, served at /metrics (metrics_view).
+# - HTTP: request counts and latency histograms per URL name of the users, owner and tenant
+#   apps (everything else is counted as "other"), and a histogram of SQL queries per request
+#   for the requests sampled by users/instrumentation.py.
+# - Domain counters: bookings created / confirmed / rejected / ..., chat messages sent,
+#   payments recorded, PDF receipts rendered, and hits and misses of the listing page,
+#   geocoding and receipt caches (hit ratio = hits / (hits + misses)).
+#
+# Multi-process: under a preforking server (gunicorn, uWSGI) every worker process counts on
+# its own. With settings.METRICS_DIR set, each process keeps its values in its own
+# memory-mapped file in that directory (metrics-<pid>.db), and /metrics adds up the files of
+# all processes, so any worker can answer the scrape. Files of exited workers keep counting
+# towards the totals; empty the directory when the server (re)starts. Without METRICS_DIR
+# values live in this process's memory only (development server, tests).
+#
+# Only counters and histograms are used: their per-process values can simply be summed.
+
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+INSTRUMENTED_NAMESPACES = ('users', 'owner', 'tenant')
+
+_lock = threading.Lock()
+
+
+# --- Storage ---
+
+class MemoryStore:
+    def __init__(self):
+        self.values = defaultdict(float)
+
+    def add(self, key, amount):
+        self.values[key] += amount
+
+    def items(self):
+        return list(self.values.items())
+
+
+class FileStore:
+    """
+    Values of one process in a memory-mapped file, readable by the other processes.
+    Layout: an 8-byte header holding the number of bytes used, then one entry per key:
+    key length (4 bytes), UTF-8 key padded so that the value is 8-byte aligned, value (double).
+    New entries are written completely before the header is updated, so readers never see
+    half-written entries.
+    """
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < self.INITIAL_SIZE:
+            self._file.truncate(self.INITIAL_SIZE)
+        self._map()
+        self._positions = {key: position for key, position, value in read_entries(self._mmap)}
+
+    def _map(self):
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = struct.unpack_from('q', self._mmap, 0)[0] or 8
+
+    def add(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._append(key)
+        value = struct.unpack_from('d', self._mmap, position)[0]
+        struct.pack_into('d', self._mmap, position, value + amount)
+
+    def _append(self, key):
+        encoded = key.encode('utf-8')
+        padded = len(encoded) + (8 - (4 + len(encoded)) % 8) % 8
+        entry = struct.pack(f'i{padded}sd', len(encoded), encoded, 0.0)
+        while self._used + len(entry) > self._capacity:
+            self._mmap.close()
+            self._file.truncate(self._capacity * 2)
+            self._map()
+        start = self._used
+        self._mmap[start:start + len(entry)] = entry
+        self._used += len(entry)
+        struct.pack_into('q', self._mmap, 0, self._used)
+        self._positions[key] = start + 4 + padded
+        return self._positions[key]
+
+    def items(self):
+        return [(key, value) for key, position, value in read_entries(self._mmap)]
+
+
+def read_entries(buffer):
+    """
+    (key, value position, value) of every entry of a FileStore buffer.
+    """
+    used = struct.unpack_from('q', buffer, 0)[0]
+    position = 8
+    while position < used:
+        length = struct.unpack_from('i', buffer, position)[0]
+        key = bytes(buffer[position + 4:position + 4 + length]).decode('utf-8')
+        position += 4 + length + (8 - (4 + length) % 8) % 8
+        yield key, position, struct.unpack_from('d', buffer, position)[0]
+        position += 8
+
+
+_store = None
+_store_owner = None
+
+
+def get_store():
+    # A forked worker must not write to its parent's file: stores are per process id
+    global _store, _store_owner
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if _store is None or _store_owner != (os.getpid(), directory):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            _store = FileStore(os.path.join(directory, f'metrics-{os.getpid()}.db'))
+        else:
+            _store = MemoryStore()
+        _store_owner = (os.getpid(), directory)
+    return _store
+
+
+def collect():
+    """
+    {key: value} summed over every process.
+    """
+    directory = getattr(settings, 'METRICS_DIR', None)
+    totals = defaultdict(float)
+    if not directory:
+        with _lock:
+            items = get_store().items()
+        for key, value in items:
+            totals[key] += value
+        return totals
+    with _lock:
+        get_store() # This process's file exists even before its first observation
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.db'):
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            for key, position, value in read_entries(f.read()):
+                totals[key] += value
+    return totals
+
+
+# --- Metric types ---
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, sample, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}.")
+        return json.dumps([sample, sorted((name, str(value)) for name, value in labels.items())])
+
+    def _add(self, sample, labels, amount):
+        key = self._key(sample, labels)
+        with _lock:
+            get_store().add(key, amount)
+
+    def samples(self, values):
+        """
+        [(sample name, ((label, value), ...), value)] of this metric in the collected values.
+        """
+        raise NotImplementedError
+
+    def render(self, values):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines += [f'{sample}{_format_labels(labels)} {_format_value(value)}' for sample, labels, value in self.samples(values)]
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._add(self.name, labels, amount)
+
+    def samples(self, values):
+        return sorted(
+            (sample, tuple(tuple(label) for label in labels), value)
+            for sample, labels, value in values
+            if sample == self.name
+        )
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        bucket = next(bound for bound in self.buckets if value <= bound)
+        # Buckets are stored per interval and made cumulative when rendered
+        self._add(f'{self.name}_bucket:{_format_value(bucket)}', labels, 1)
+        self._add(f'{self.name}_sum', labels, value)
+        self._add(f'{self.name}_count', labels, 1)
+
+    def samples(self, values):
+        series = defaultdict(lambda: defaultdict(float))
+        for sample, labels, value in values:
+            if sample.startswith(f'{self.name}_'):
+                series[tuple(tuple(label) for label in labels)][sample] += value
+
+        samples = []
+        for labels in sorted(series):
+            stored = series[labels]
+            cumulative = 0
+            for bound in self.buckets:
+                cumulative += stored.get(f'{self.name}_bucket:{_format_value(bound)}', 0)
+                samples.append((f'{self.name}_bucket', labels + (('le', _format_value(bound)),), cumulative))
+            samples.append((f'{self.name}_sum', labels, stored.get(f'{self.name}_sum', 0)))
+            samples.append((f'{self.name}_count', labels, stored.get(f'{self.name}_count', 0)))
+        return samples
+
+
+def render():
+    """
+    All metrics of all processes in the Prometheus text exposition format.
+    """
+    values = [(*json.loads(key), value) for key, value in collect().items()]
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render(values)
+    return '\n'.join(lines) + '\n'
+
+
+# --- Metrics ---
+
+http_requests = Counter(
+    'renthouse_http_requests_total', "HTTP requests by URL name, method and status code.",
+    ['view', 'method', 'status'],
+)
+http_request_duration = Histogram(
+    'renthouse_http_request_duration_seconds', "Time to answer a request, by URL name.", ['view'],
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+)
+db_queries_per_request = Histogram(
+    'renthouse_db_queries_per_request', "SQL queries per request (sampled requests only), by URL name.", ['view'],
+    buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500],
+)
+bookings = Counter(
+    'renthouse_bookings_total', "Bookings created, and bookings moved to a status (confirmed, rejected, ...).",
+    ['event'],
+)
+chat_messages = Counter('renthouse_chat_messages_total', "Chat messages sent.")
+payments = Counter('renthouse_payments_total', "Payments recorded.")
+receipt_pdfs = Counter('renthouse_receipt_pdfs_rendered_total', "PDF receipts rendered, by result.", ['result'])
+receipt_pdf_duration = Histogram(
+    'renthouse_receipt_pdf_render_seconds', "Time to render a PDF receipt.",
+    buckets=[0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+)
+cache_requests = Counter(
+    'renthouse_cache_requests_total', "Cache lookups by cache (listing_page, geocoding, receipt) and result (hit, miss).",
+    ['cache', 'result'],
+)
+
+
+def view_label(resolver_match):
+    """
+    URL name of a request for the HTTP metrics: names of the users, owner and tenant apps,
+    "other" for the rest (admin, login, ...) so that the number of series stays bounded.
+    """
+    if resolver_match is None:
+        return 'unresolved'
+    if resolver_match.namespace in INSTRUMENTED_NAMESPACES and resolver_match.url_name:
+        return resolver_match.view_name
+    return 'other'
+
+
+def observe_request(resolver_match, method, status, duration_ms, query_count=None):
+    view = view_label(resolver_match)
+    http_requests.inc(view=view, method=method, status=status)
+    http_request_duration.observe(duration_ms / 1000, view=view)
+    if query_count is not None:
+        db_queries_per_request.observe(query_count, view=view)
+
+
+def count_cache_lookup(cache, hit):
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def add_fulltext_index(apps, schema_editor):
+    # MySQL gets a native FULLTEXT index; other databases use the PropertySearchTerm table.
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE `users_property` ADD FULLTEXT INDEX `property_search_ft` '
+        '(`title`, `address`, `university_nearby`, `description`)'
+    )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('ALTER TABLE `users_property` DROP INDEX `property_search_ft`')
+
+
+def index_existing_properties(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        return
+    from users.search import build_terms
+
+    Property = apps.get_model('users', 'Property')
+    PropertySearchTerm = apps.get_model('users', 'PropertySearchTerm')
+    PropertySearchTerm.objects.bulk_create([
+        PropertySearchTerm(property_id=property_obj.pk, term=term, weight=weight)
+        for property_obj in Property.objects.all()
+        for term, weight in build_terms(property_obj).items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_alter_property_gender_preferred'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertySearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(help_text="Normalized token taken from the property's searchable text.", max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1, help_text='Relevance weight of this term for the property.')),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='users.property')),
+            ],
+            options={
+                'verbose_name_plural': 'Property Search Terms',
+                'indexes': [models.Index(fields=['term', 'property'], name='search_term_property_idx')],
+                'unique_together': {('property', 'term')},
+            },
+        ),
+        migrations.RunPython(add_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(index_existing_properties, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_conversations(apps, schema_editor):
+    # Walk the existing chat history once (newest first) and keep one summary row per conversation
+    ChatMessage = apps.get_model('users', 'ChatMessage')
+    Conversation = apps.get_model('users', 'Conversation')
+
+    conversations = {}
+    for msg in ChatMessage.objects.order_by('-timestamp', '-id').iterator():
+        if msg.sender_id == msg.receiver_id:
+            continue
+        participant_a_id, participant_b_id = sorted([msg.sender_id, msg.receiver_id])
+        key = (msg.property_id, participant_a_id, participant_b_id)
+        conversation = conversations.get(key)
+        if conversation is None:
+            conversation = conversations[key] = Conversation(
+                property_id=msg.property_id,
+                participant_a_id=participant_a_id,
+                participant_b_id=participant_b_id,
+                last_message_id=msg.pk,
+                last_message_at=msg.timestamp,
+            )
+        if not msg.is_read:
+            if msg.receiver_id == participant_a_id:
+                conversation.unread_a += 1
+            else:
+                conversation.unread_b += 1
+    Conversation.objects.bulk_create(conversations.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_property_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField()),
+                ('unread_a', models.PositiveIntegerField(default=0, help_text='Messages participant A has not read yet.')),
+                ('unread_b', models.PositiveIntegerField(default=0, help_text='Messages participant B has not read yet.')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='users.chatmessage')),
+                ('participant_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations_as_a', to=settings.AUTH_USER_MODEL)),
+                ('participant_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations_as_b', to=settings.AUTH_USER_MODEL)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='users.property')),
+            ],
+            options={
+                'verbose_name_plural': 'Conversations',
+                'ordering': ['-last_message_at'],
+                'indexes': [models.Index(fields=['participant_a', '-last_message_at'], name='conversation_a_recent_idx'), models.Index(fields=['participant_b', '-last_message_at'], name='conversation_b_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('property', 'participant_a', 'participant_b'), name='unique_conversation')],
+            },
+        ),
+        migrations.RunPython(build_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:23
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def compute_booking_counters(apps, schema_editor):
+    # is_available is left alone here; run reconcile_booking_counters to derive it from the counters
+    Property = apps.get_model('users', 'Property')
+    properties = Property.objects.annotate(
+        pending=Count('bookings', filter=Q(bookings__status='pending')),
+        confirmed=Count('bookings', filter=Q(bookings__status='confirmed')),
+        occupants=Sum('bookings__number_of_occupants', filter=Q(bookings__status__in=['pending', 'confirmed'])),
+    )
+    for property_obj in properties:
+        property_obj.pending_bookings_count = property_obj.pending
+        property_obj.confirmed_bookings_count = property_obj.confirmed
+        property_obj.active_occupants = property_obj.occupants or 0
+    Property.objects.bulk_update(
+        properties, ['pending_bookings_count', 'confirmed_bookings_count', 'active_occupants'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_property_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='active_occupants',
+            field=models.PositiveIntegerField(default=0, help_text='Occupants of all pending and confirmed bookings.'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='confirmed_bookings_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of confirmed bookings.'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='is_listed',
+            field=models.BooleanField(default=True, help_text='Untick to take the property off the market, whatever its bookings.'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='pending_bookings_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of pending bookings.'),
+        ),
+        migrations.RunPython(compute_booking_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_property_booking_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Client-generated key identifying one booking submission.', max_length=64, null=True, unique=True),
+        ),
+    ]
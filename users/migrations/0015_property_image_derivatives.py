@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_booking_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Resized versions of main_image.'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:34
+
+import users.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_property_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Storage name of the file (its SHA-256 plus extension).', max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Number of rows that use this file.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Media Blobs',
+            },
+        ),
+        migrations.AlterField(
+            model_name='property',
+            name='main_image',
+            field=models.ImageField(blank=True, null=True, storage=users.storage.property_image_storage, upload_to='property_images/'),
+        ),
+    ]
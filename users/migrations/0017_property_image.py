@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:37
+
+import django.db.models.deletion
+import users.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(storage=users.storage.property_image_storage, upload_to='property_images/')),
+                ('image_derivatives', models.JSONField(blank=True, default=dict, editable=False)),
+                ('caption', models.CharField(blank=True, max_length=200)),
+                ('position', models.PositiveIntegerField(default=0, help_text='Order of the image in the gallery (lowest first).')),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='users.property')),
+            ],
+            options={
+                'verbose_name_plural': 'Property Images',
+                'ordering': ['position', 'pk'],
+                'indexes': [models.Index(fields=['property', 'position'], name='property_image_gallery_idx')],
+            },
+        ),
+    ]
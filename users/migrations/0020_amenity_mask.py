@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:47
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def assign_amenity_bits(apps, schema_editor):
+    # Historical models have no custom save(): give the first 63 amenities (by pk) a bit, then build the masks
+    Amenity = apps.get_model('users', 'Amenity')
+    Property = apps.get_model('users', 'Property')
+    for bit, amenity in enumerate(Amenity.objects.order_by('pk')[:63]):
+        amenity.bit = bit
+        amenity.save(update_fields=['bit'])
+
+    masks = defaultdict(int)
+    rows = Property.amenities.through.objects.filter(amenity__bit__isnull=False).values_list('property_id', 'amenity__bit')
+    for property_id, bit in rows.iterator():
+        masks[property_id] |= 1 << bit
+    properties = [Property(pk=pk, amenity_mask=mask) for pk, mask in masks.items()]
+    Property.objects.bulk_update(properties, ['amenity_mask'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_property_location_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='amenity',
+            name='bit',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='amenity_mask',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Bitset of the amenities (Amenity.bit).'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['is_available', 'amenity_mask'], name='property_amenity_mask_idx'),
+        ),
+        migrations.RunPython(assign_amenity_bits, migrations.RunPython.noop),
+    ]
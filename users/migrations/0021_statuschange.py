@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_amenity_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('booking', 'Booking'), ('maintenance', 'Maintenance Request')], max_length=20)),
+                ('object_id', models.PositiveIntegerField(help_text='ID of the booking or maintenance request.')),
+                ('from_status', models.CharField(max_length=20)),
+                ('to_status', models.CharField(max_length=20)),
+                ('source', models.CharField(choices=[('dashboard', 'Owner Dashboard'), ('admin', 'Admin')], default='dashboard', max_length=20)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='status_changes', to=settings.AUTH_USER_MODEL)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='users.property')),
+            ],
+            options={
+                'verbose_name_plural': 'Status Changes',
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='statuschange_object_idx')],
+            },
+        ),
+    ]
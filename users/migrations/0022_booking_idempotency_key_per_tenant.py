@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_statuschange'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Client-generated key identifying one booking submission.', max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.UniqueConstraint(fields=('tenant', 'idempotency_key'), name='unique_booking_idempotency_key'),
+        ),
+    ]
@@ -1,10 +1,16 @@
 # users/models.py
 
+from functools import partial
+
 from django import forms
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.utils import timezone
 
+from . import metrics
+from .storage import delete_blob, is_tracked, property_image_storage
+
 # --- Custom User Manager (Keep as is) ---
 class CustomUserManager(BaseUserManager):
     def create_user(self, username, email, password=None, **extra_fields):
@@ -111,15 +117,232 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     # *************************************************************************
 
 
-# --- Amenity Model (Keep as is) ---
+# --- Amenity Model (MODIFIED: each amenity owns a bit of Property.amenity_mask) ---
 class Amenity(models.Model):
+    MAX_BITS = 63 # Property.amenity_mask is a signed 64-bit integer
+
     name = models.CharField(max_length=100, unique=True)
+    # NEW FIELD: position of the amenity in Property.amenity_mask; amenities past MAX_BITS have none
+    # and are filtered through the ManyToMany table instead (see users/amenities.py)
+    bit = models.PositiveSmallIntegerField(unique=True, blank=True, null=True, editable=False)
+
     class Meta:
         verbose_name_plural = "Amenities"
         ordering = ['name']
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            # Lowest free bit (bits of deleted amenities are reused)
+            used = set(Amenity.objects.exclude(bit__isnull=True).values_list('bit', flat=True))
+            self.bit = next((bit for bit in range(self.MAX_BITS) if bit not in used), None)
+        super().save(*args, **kwargs)
+
+# --- Property Manager: maintains the denormalized booking counters on Property ---
+class PropertyManager(models.Manager):
+    # Bookings that hold the property (it is whole-unit: one holding booking makes it unavailable)
+    ACTIVE_BOOKING_STATUSES = ('pending', 'confirmed')
+    # Denormalized on Property; written by this manager only
+    BOOKING_COUNTER_FIELDS = ('pending_bookings_count', 'confirmed_bookings_count', 'active_occupants')
+
+    def available(self):
+        """
+        Properties open for booking. On SQLite filter(is_available=True) becomes a bare
+        WHERE "is_available", which cannot use an index; comparing to a value keeps it = 1
+        on every backend, so property_available_recent_idx serves the home listing.
+        """
+        return self.filter(is_available=models.Value(True))
+
+    def adjust_booking_counters(self, property_id, removed=None, added=None):
+        """
+        Applies a booking change to a property's counters: `removed`/`added` are
+        (status, number_of_occupants) of the booking before/after the change (None if it did not exist).
+        Must run inside the transaction that changes the booking; the property row is locked.
+        """
+        from .caching import bump_listing_version
+
+        property_obj = self.select_for_update().filter(pk=property_id).first()
+        if property_obj is None: # Property is being deleted
+            return
+        for change, sign in ((removed, -1), (added, 1)):
+            if change is None:
+                continue
+            status, occupants = change
+            if status == 'pending':
+                property_obj.pending_bookings_count += sign
+            elif status == 'confirmed':
+                property_obj.confirmed_bookings_count += sign
+            if status in self.ACTIVE_BOOKING_STATUSES:
+                property_obj.active_occupants += sign * occupants
+        self._save_booking_counters(property_obj)
+        transaction.on_commit(bump_listing_version)
+
+    def refresh_amenity_masks(self, property_ids=None):
+        """
+        Recomputes amenity_mask from the amenities of the given properties (default: all) and
+        saves the ones that changed. Returns the number of properties updated.
+        """
+        from collections import defaultdict
+
+        through = self.model.amenities.through
+        rows = through.objects.filter(amenity__bit__isnull=False)
+        queryset = self.all()
+        if property_ids is not None:
+            rows = rows.filter(property_id__in=property_ids)
+            queryset = queryset.filter(pk__in=property_ids)
+
+        expected = defaultdict(int)
+        for property_id, bit in rows.values_list('property_id', 'amenity__bit').iterator():
+            expected[property_id] |= 1 << bit
+
+        # One UPDATE per distinct mask, not per property
+        changed = defaultdict(list)
+        for pk, mask in queryset.values_list('pk', 'amenity_mask').iterator():
+            if mask != expected[pk]:
+                changed[expected[pk]].append(pk)
+        updated = 0
+        for mask, pks in changed.items():
+            for start in range(0, len(pks), 1000):
+                updated += self.filter(pk__in=pks[start:start + 1000]).update(
+                    amenity_mask=mask, updated_at=timezone.now(), # New version of the cached listing card
+                )
+        return updated
+
+    def recompute_booking_counters(self, queryset=None, dry_run=False):
+        """
+        Recomputes the counters of the given properties (default: all) from their bookings
+        and repairs the ones that drifted. Returns the list of repaired properties.
+        """
+        from django.db.models import Count, Sum
+        from django.db.models.functions import Coalesce
+
+        from .caching import bump_listing_version
+
+        queryset = self.all() if queryset is None else queryset
+        with transaction.atomic():
+            if not dry_run:
+                # Lock the properties before counting: a booking saved meanwhile waits for its
+                # property row (adjust_booking_counters), so it cannot commit between the count and the repair
+                list(queryset.select_for_update().order_by('pk').values_list('pk', flat=True))
+            actual = queryset.annotate(
+                actual_pending=Count('bookings', filter=Q(bookings__status='pending')),
+                actual_confirmed=Count('bookings', filter=Q(bookings__status='confirmed')),
+                actual_occupants=Coalesce(
+                    Sum('bookings__number_of_occupants', filter=Q(bookings__status__in=self.ACTIVE_BOOKING_STATUSES)), 0
+                ),
+            ).order_by('pk')
+
+            repaired = []
+            for property_obj in actual:
+                expected = (property_obj.actual_pending, property_obj.actual_confirmed, property_obj.actual_occupants)
+                stored = (property_obj.pending_bookings_count, property_obj.confirmed_bookings_count, property_obj.active_occupants)
+                expected_available = property_obj.is_listed and property_obj.actual_pending + property_obj.actual_confirmed == 0
+                if expected != stored or property_obj.is_available != expected_available:
+                    (property_obj.pending_bookings_count, property_obj.confirmed_bookings_count,
+                     property_obj.active_occupants) = expected
+                    property_obj.is_available = expected_available
+                    repaired.append(property_obj)
+
+            if repaired and not dry_run:
+                for property_obj in repaired:
+                    self._save_booking_counters(property_obj)
+                transaction.on_commit(bump_listing_version)
+        return repaired
+
+    def _save_booking_counters(self, property_obj):
+        property_obj.is_available = property_obj.derive_is_available()
+        self.filter(pk=property_obj.pk).update(
+            pending_bookings_count=max(property_obj.pending_bookings_count, 0),
+            confirmed_bookings_count=max(property_obj.confirmed_bookings_count, 0),
+            active_occupants=max(property_obj.active_occupants, 0),
+            is_available=property_obj.is_available,
+            updated_at=timezone.now(), # New version of the cached listing card
+        )
+
+
+# --- NEW: Reference counts of content-addressed files (users/storage.py) ---
+class MediaBlobManager(models.Manager):
+
+    def retain(self, name):
+        """
+        Records one more reference to a stored file.
+        """
+        if not is_tracked(name):
+            return
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    blob, created = self.get_or_create(name=name, defaults={'ref_count': 1})
+            except IntegrityError: # A concurrent upload of the same bytes created the row first
+                blob, created = self.get(name=name), False
+            if not created:
+                self.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+    def release(self, name, storage):
+        """
+        Drops one reference to a stored file; the file is deleted (after commit) with its last reference.
+        Files without a MediaBlob row are never deleted.
+        """
+        if not is_tracked(name):
+            return
+        with transaction.atomic():
+            blob = self.select_for_update().filter(name=name).first()
+            if blob is None:
+                return
+            if blob.ref_count > 1:
+                self.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return
+            blob.delete()
+
+        def delete_file():
+            # The same bytes may have been uploaded again in the meantime
+            if not self.filter(name=name).exists():
+                delete_blob(storage, name)
+
+        transaction.on_commit(delete_file)
+
+
+class MediaBlob(models.Model):
+    name = models.CharField(max_length=255, unique=True, help_text="Storage name of the file (its SHA-256 plus extension).")
+    ref_count = models.PositiveIntegerField(default=0, help_text="Number of rows that use this file.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MediaBlobManager()
+
+    class Meta:
+        verbose_name_plural = "Media Blobs"
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+
+# --- NEW MODEL: GeocodeCache (results of address lookups, see users/geocoding.py) ---
+class GeocodeCache(models.Model):
+    # SHA-256 of the normalized address: addresses are too long for a unique index on MySQL
+    address_key = models.CharField(max_length=64, unique=True)
+    address = models.TextField(help_text="Normalized address.")
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    provider = models.CharField(max_length=50, help_text="Geocoding provider that answered.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Geocode Cache"
+
+    def __str__(self):
+        return f"{self.address} ({self.latitude}, {self.longitude})"
+
+    @property
+    def coordinates(self):
+        """
+        (latitude, longitude), or None if the provider could not find the address.
+        """
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self.latitude, self.longitude
+
+
 # --- Property Model (Keep as is) ---
 # --- Property Model (MODIFIED: Add 'max_tenants' field) ---
 # --- Property Model (MODIFIED: Removed total_spots, available_spots. KEPT max_tenants) ---
@@ -148,13 +371,27 @@ class Property(models.Model):
     total_toilets = models.IntegerField(default=2, help_text="Total number of toilets/bathrooms in the property.") # NEW FIELD
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, help_text="Last time the listing changed; used to version cached listing cards.")
     square_footage = models.IntegerField(blank=True, null=True)
-    main_image = models.ImageField(upload_to='property_images/', blank=True, null=True)
+    main_image = models.ImageField(upload_to='property_images/', storage=property_image_storage, blank=True, null=True)
+    # NEW FIELD: resized JPEG/WebP versions of main_image, filled in by a background job (users/images.py)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False, help_text="Resized versions of main_image.")
     max_tenants = models.IntegerField(default=1, help_text="Maximum number of occupants allowed in this property.")
+    # NEW FIELD: coordinates of the address, geocoded on the server when the address changes (users/geocoding.py)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
 
     is_available = models.BooleanField(default=True, help_text="Is the property currently available for booking as a whole unit?")
+    # NEW FIELD: the owner's/admin's own say; is_available is derived from it and the booking counters
+    is_listed = models.BooleanField(default=True, help_text="Untick to take the property off the market, whatever its bookings.")
     owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='owned_properties')
 
+    # Denormalized booking counters, kept in step by Booking.save()/delete and repaired by
+    # the reconcile_booking_counters command. is_available is derived from them and is_listed.
+    pending_bookings_count = models.PositiveIntegerField(default=0, help_text="Number of pending bookings.")
+    confirmed_bookings_count = models.PositiveIntegerField(default=0, help_text="Number of confirmed bookings.")
+    active_occupants = models.PositiveIntegerField(default=0, help_text="Occupants of all pending and confirmed bookings.")
+
     gender_preferred = models.CharField(
         max_length=20,
         choices=GENDER_PREFERENCE_CHOICES,
@@ -163,14 +400,117 @@ class Property(models.Model):
     )
     # NEW FIELD: ManyToMany relationship with Amenity
     amenities = models.ManyToManyField('Amenity', blank=True, related_name='properties')
+    # NEW FIELD: the amenities again, as a bitset of Amenity.bit, so that filtering on several
+    # amenities is one bitwise test instead of a join per amenity. Kept in step by users/signals.py.
+    amenity_mask = models.BigIntegerField(default=0, editable=False, help_text="Bitset of the amenities (Amenity.bit).")
+
+    objects = PropertyManager()
 
 
     class Meta:
         verbose_name_plural = "Properties"
+        indexes = [
+            # Home listing: available properties, newest first
+            # (ends with the primary key, the tiebreak of the listing order, so no sort is needed)
+            models.Index(fields=['is_available', '-created_at', '-id'], name='property_available_recent_idx'),
+            # Owner dashboard: my properties, newest first
+            models.Index(fields=['owner', '-created_at'], name='property_owner_recent_idx'),
+            # Proximity search: bounding-box range scans (users/geo.py)
+            models.Index(fields=['latitude', 'longitude'], name='property_location_idx'),
+            # Amenity filters: the bitwise test is answered from this narrow index, not the table
+            models.Index(fields=['is_available', 'amenity_mask'], name='property_amenity_mask_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def derive_is_available(self):
+        """
+        Listed and not held by a pending or confirmed booking.
+        """
+        return self.is_listed and self.pending_bookings_count + self.confirmed_bookings_count == 0
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'is_listed', 'is_available'} & set(update_fields):
+            super().save(*args, **kwargs) # Writes neither the counters nor is_available
+            return
+
+        with transaction.atomic():
+            if not self._state.adding:
+                # Only the manager (adjust_booking_counters/recompute_booking_counters) changes the
+                # counters: re-read them under lock, so that an instance loaded before a booking
+                # changed (an edit form, the admin) cannot write stale values back
+                current = Property.objects.select_for_update().filter(pk=self.pk).values(
+                    *PropertyManager.BOOKING_COUNTER_FIELDS
+                ).first()
+                for field_name, value in (current or {}).items():
+                    setattr(self, field_name, value)
+            # Unticking is_listed (admin) takes the property off the market at once; ticking it
+            # again only lists it if no booking holds it
+            self.is_available = self.derive_is_available()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'is_available'}
+            super().save(*args, **kwargs)
+
+# --- NEW MODEL: PropertyImage (gallery of a property, shown after main_image) ---
+class PropertyImageManager(models.Manager):
+
+    def add_images(self, property_obj, files):
+        """
+        Appends uploaded image files to the end of a property's gallery.
+        """
+        with transaction.atomic():
+            # Lock the property so that concurrent uploads get distinct positions
+            Property.objects.select_for_update().filter(pk=property_obj.pk).first()
+            last_position = self.filter(property=property_obj).aggregate(last=models.Max('position'))['last']
+            start = 0 if last_position is None else last_position + 1
+            # One save() per file: storing the upload and counting its references happen on save
+            return [
+                self.create(property=property_obj, image=image_file, position=start + offset)
+                for offset, image_file in enumerate(files)
+            ]
+
+
+class PropertyImage(models.Model):
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='images')
+    image = models.ImageField(upload_to='property_images/', storage=property_image_storage)
+    # Resized JPEG/WebP versions of image, filled in by a background job (users/images.py)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    caption = models.CharField(max_length=200, blank=True)
+    position = models.PositiveIntegerField(default=0, help_text="Order of the image in the gallery (lowest first).")
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+
+    objects = PropertyImageManager()
+
+    class Meta:
+        verbose_name_plural = "Property Images"
+        ordering = ['position', 'pk']
+        indexes = [
+            # Detail page: one property's gallery, in order
+            models.Index(fields=['property', 'position'], name='property_image_gallery_idx'),
+        ]
+
+    def __str__(self):
+        return f"Image {self.position} of {self.property_id}"
+
+
+# --- NEW MODEL: PropertySearchTerm (inverted index used by users/search.py) ---
+class PropertySearchTerm(models.Model):
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64, help_text="Normalized token taken from the property's searchable text.")
+    weight = models.PositiveIntegerField(default=1, help_text="Relevance weight of this term for the property.")
+
+    class Meta:
+        verbose_name_plural = "Property Search Terms"
+        unique_together = ('property', 'term')
+        indexes = [
+            models.Index(fields=['term', 'property'], name='search_term_property_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> Property {self.property_id} ({self.weight})"
+
 # --- Booking Model (MODIFIED: Added default='' to certain fields) ---
 class Booking(models.Model):
     STATUS_CHOICES = [
@@ -204,13 +544,53 @@ class Booking(models.Model):
     current_address_on_form = models.TextField(default='', help_text="Current address as entered on the booking form.")
     university_name_on_form = models.CharField(max_length=200, blank=True, null=True, default='', help_text="University/College name from the form.")
     expected_duration_of_stay = models.CharField(max_length=100, default='', help_text="Expected duration of stay from the form.")
+    # NEW FIELD: sent with the booking form so that double submits create only one booking
+    idempotency_key = models.CharField(max_length=64, blank=True, null=True, help_text="Client-generated key identifying one booking submission.")
 
     class Meta:
         verbose_name_plural = "Bookings"
+        constraints = [
+            # Keys are looked up per tenant (users/bookings.py), so they only have to be unique per tenant
+            models.UniqueConstraint(fields=['tenant', 'idempotency_key'], name='unique_booking_idempotency_key'),
+        ]
+        indexes = [
+            # Tenant dashboard / booking checks: a tenant's bookings by status and date
+            models.Index(fields=['tenant', 'status', 'start_date'], name='booking_tenant_status_idx'),
+            # Owner dashboard: bookings of the owner's properties by status and date
+            models.Index(fields=['property', 'status', 'start_date'], name='booking_property_status_idx'),
+        ]
 
     def __str__(self):
         return f"Booking for {self.property.title} by {self.full_name_on_form} (ID: {self.pk})"
 
+    def save(self, *args, **kwargs):
+        # Every status transition updates the property's booking counters in the same transaction.
+        # The stored row is re-read under lock so concurrent transitions cannot double count.
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = Booking.objects.select_for_update().filter(pk=self.pk).values(
+                    'property_id', 'status', 'number_of_occupants'
+                ).first()
+            super().save(*args, **kwargs)
+
+            if previous is None:
+                Property.objects.adjust_booking_counters(
+                    self.property_id, added=(self.status, self.number_of_occupants)
+                )
+                transaction.on_commit(partial(metrics.bookings.inc, event='created'))
+            elif (previous['property_id'], previous['status'], previous['number_of_occupants']) != (
+                    self.property_id, self.status, self.number_of_occupants):
+                removed = (previous['status'], previous['number_of_occupants'])
+                added = (self.status, self.number_of_occupants)
+                if previous['property_id'] == self.property_id:
+                    Property.objects.adjust_booking_counters(self.property_id, removed=removed, added=added)
+                else:
+                    Property.objects.adjust_booking_counters(previous['property_id'], removed=removed)
+                    Property.objects.adjust_booking_counters(self.property_id, added=added)
+                if previous['status'] != self.status:
+                    transaction.on_commit(partial(metrics.bookings.inc, event=self.status))
+
 
 # --- NEW: ChatMessage Model ---
 class ChatMessage(models.Model):
@@ -228,10 +608,117 @@ class ChatMessage(models.Model):
     class Meta:
         verbose_name_plural = "Chat Messages"
         ordering = ['timestamp'] # Order messages chronologically
+        indexes = [
+            # Chat history between two users about one property, in time order
+            models.Index(fields=['sender', 'property', 'timestamp'], name='chat_sender_property_idx'),
+            models.Index(fields=['receiver', 'property', 'timestamp'], name='chat_receiver_property_idx'),
+        ]
 
     def __str__(self):
         return f"From {self.sender.username} to {self.receiver.username} on {self.property.title} at {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
 
+    def save(self, *args, **kwargs):
+        # New messages update their Conversation summary row in the same transaction
+        if self._state.adding:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                Conversation.objects.record_message(self)
+        else:
+            super().save(*args, **kwargs)
+
+
+# --- NEW: Conversation summary (one row per property + participant pair) ---
+class ConversationManager(models.Manager):
+    def for_user(self, user):
+        """
+        All conversations the user takes part in, most recent first, with everything
+        the recent-chat lists display already joined in.
+        """
+        return self.filter(
+            Q(participant_a=user) | Q(participant_b=user)
+        ).select_related(
+            'property', 'participant_a', 'participant_b', 'last_message'
+        ).order_by('-last_message_at')
+
+    def record_message(self, message):
+        """
+        Points the conversation of a newly created ChatMessage at that message and
+        bumps the receiver's unread counter. Self-chats are not tracked.
+        """
+        if message.sender_id == message.receiver_id:
+            return None
+        participant_a_id, participant_b_id = sorted([message.sender_id, message.receiver_id])
+        lookup = {
+            'property_id': message.property_id,
+            'participant_a_id': participant_a_id,
+            'participant_b_id': participant_b_id,
+        }
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    conversation, _ = self.get_or_create(**lookup, defaults={'last_message_at': message.timestamp})
+            except IntegrityError: # Another request created the row first
+                conversation = self.get(**lookup)
+            unread_field = 'unread_a' if message.receiver_id == participant_a_id else 'unread_b'
+            self.filter(pk=conversation.pk).update(
+                last_message=message,
+                last_message_at=message.timestamp,
+                **{unread_field: F(unread_field) + 1},
+            )
+        return conversation
+
+    def mark_read(self, property_obj, reader, other_user):
+        """
+        Clears the reader's unread counter for a conversation and flags the messages as read.
+        """
+        participant_a_id, participant_b_id = sorted([reader.pk, other_user.pk])
+        unread_field = 'unread_a' if reader.pk == participant_a_id else 'unread_b'
+        with transaction.atomic():
+            updated = self.filter(
+                property=property_obj,
+                participant_a_id=participant_a_id,
+                participant_b_id=participant_b_id,
+                **{f'{unread_field}__gt': 0},
+            ).update(**{unread_field: 0})
+            if updated:
+                ChatMessage.objects.filter(
+                    property=property_obj, sender=other_user, receiver=reader, is_read=False
+                ).update(is_read=True)
+
+
+class Conversation(models.Model):
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='conversations')
+    # The two participants, stored with participant_a always having the lower user id
+    participant_a = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='conversations_as_a')
+    participant_b = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='conversations_as_b')
+
+    last_message = models.ForeignKey(ChatMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField()
+    unread_a = models.PositiveIntegerField(default=0, help_text="Messages participant A has not read yet.")
+    unread_b = models.PositiveIntegerField(default=0, help_text="Messages participant B has not read yet.")
+
+    objects = ConversationManager()
+
+    class Meta:
+        verbose_name_plural = "Conversations"
+        ordering = ['-last_message_at']
+        constraints = [
+            models.UniqueConstraint(fields=['property', 'participant_a', 'participant_b'], name='unique_conversation'),
+        ]
+        indexes = [
+            models.Index(fields=['participant_a', '-last_message_at'], name='conversation_a_recent_idx'),
+            models.Index(fields=['participant_b', '-last_message_at'], name='conversation_b_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Conversation on {self.property.title} between {self.participant_a.username} and {self.participant_b.username}"
+
+    def other_participant(self, user):
+        return self.participant_b if self.participant_a_id == user.pk else self.participant_a
+
+    def unread_count_for(self, user):
+        return self.unread_a if self.participant_a_id == user.pk else self.unread_b
+
 class MaintenanceRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -260,6 +747,12 @@ class MaintenanceRequest(models.Model):
     class Meta:
         verbose_name_plural = "Maintenance Requests"
         ordering = ['-submitted_date']
+        indexes = [
+            # Tenant dashboard: my requests, newest first
+            models.Index(fields=['submitted_by', '-submitted_date'], name='maintenance_submitter_idx'),
+            # Owner dashboard: requests on the owner's properties, newest first
+            models.Index(fields=['property', '-submitted_date'], name='maintenance_property_idx'),
+        ]
 
     def __str__(self):
         return f"Maintenance for {self.property.title}: {self.issue_title}"
@@ -287,8 +780,61 @@ class AdditionalOccupant(models.Model):
         return f"Occupant: {self.full_name} for Booking {self.booking.pk}"
 
 
+# --- NEW MODEL: StatusChange (audit trail of booking and maintenance request status changes) ---
+class StatusChange(models.Model):
+    KIND_CHOICES = [
+        ('booking', 'Booking'),
+        ('maintenance', 'Maintenance Request'),
+    ]
+    SOURCE_CHOICES = [
+        ('dashboard', 'Owner Dashboard'),
+        ('admin', 'Admin'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField(help_text="ID of the booking or maintenance request.")
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='status_changes')
+    from_status = models.CharField(max_length=20)
+    to_status = models.CharField(max_length=20)
+    changed_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='status_changes')
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='dashboard')
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "Status Changes"
+        indexes = [
+            # History of one booking / maintenance request
+            models.Index(fields=['kind', 'object_id'], name='statuschange_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.object_id}: {self.from_status} -> {self.to_status}"
+
+
+# --- NEW: file input that accepts several files at once (gallery uploads) ---
+class MultipleImageInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleImageField(forms.ImageField):
+    """
+    ImageField for an <input type="file" multiple>; cleans to a list of uploaded images.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleImageInput(attrs={'accept': 'image/*'}))
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(item, initial) for item in data if item]
+        return [single_file_clean(data, initial)] if data else []
+
+
 # --- NEW FORM: PropertyForm ---
 class PropertyForm(forms.ModelForm):
+    GALLERY_MAX_IMAGES = 20 # Per upload
     # Use Model's choices directly
     HOUSE_TYPE_CHOICES = Property.HOUSE_TYPE_CHOICES
     GENDER_PREFERENCE_CHOICES = Property.GENDER_PREFERENCE_CHOICES
@@ -357,6 +903,12 @@ class PropertyForm(forms.ModelForm):
         widget=forms.Select(attrs={'class': 'form-select'}),
         label="Tenant Gender Preference"
     )
+    # NEW FIELD: extra photos, appended to the property's gallery (PropertyImage) on save
+    gallery_images = MultipleImageField(
+        required=False,
+        label="Gallery Images",
+        help_text="You can select several photos at once."
+    )
     # Amenities will be handled by ManyToManyField, which Django's ModelForm renders as a MultipleSelect widget
     amenities = forms.ModelMultipleChoiceField(
         queryset=Amenity.objects.all(),
@@ -375,6 +927,12 @@ class PropertyForm(forms.ModelForm):
         ]
         # owner and is_available will be set in the view
 
+    def clean_gallery_images(self):
+        gallery_images = self.cleaned_data.get('gallery_images') or []
+        if len(gallery_images) > self.GALLERY_MAX_IMAGES:
+            raise forms.ValidationError(f"You can upload at most {self.GALLERY_MAX_IMAGES} gallery images at a time.")
+        return gallery_images
+
 # --- NEW MODEL: PaymentRecord ---
 class PaymentRecord(models.Model):
     id = models.AutoField(primary_key=True)
@@ -396,6 +954,12 @@ class PaymentRecord(models.Model):
     class Meta:
         verbose_name_plural = "Payment Records"
         ordering = ['-payment_date'] # Order by most recent payment
+        indexes = [
+            # Owner dashboard: received payments, newest first
+            models.Index(fields=['receiver_of_payment', '-payment_date'], name='payment_receiver_recent_idx'),
+            # Tenant dashboard: my payments, newest first
+            models.Index(fields=['user', '-payment_date'], name='payment_user_recent_idx'),
+        ]
 
     def __str__(self):
         return f"Payment of RM{self.amount} by {self.full_name} on {self.payment_date.strftime('%Y-%m-%d')}"
@@ -0,0 +1,195 @@
+# users/pagination.py
+#
+# Pagination of the home listing that stays cheap on deep pages.
+# - Keyset ("cursor") pagination: instead of OFFSET n, the next page is "the rows after the
+#   last one shown" in the listing's order, e.g. (created_at, id) < (last created_at, last id).
+#   The database seeks straight to that position through the ordering index, so page 500 costs
+#   the same as page 1. The position is handed to the client as an opaque cursor string.
+# - Approximate counts: an exact COUNT(*) of a filtered search has to visit every matching row;
+#   approximate_count() asks MySQL's optimizer for its estimate, and elsewhere counts at most
+#   LISTING_COUNT_CAP rows ("1000+ listings").
+# - ApproximateCountPaginator: Django's Paginator on top of approximate_count(), for places
+#   that still need page numbers.
+# - EstimatedCountPaginator: for the admin changelists of large tables (users/admin.py), exact
+#   counts of small results and the MySQL estimate of large ones, with every page reachable.
+
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def get_ordering(queryset):
+    """
+    The queryset's ordering as [(field or annotation name, descending)], ending with the primary
+    key so that every row has a distinct position.
+    """
+    ordering = []
+    for field in queryset.query.order_by or queryset.model._meta.ordering:
+        if not isinstance(field, str):
+            raise ValueError("Keyset pagination needs an ordering by field or annotation names.")
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        ordering.append(('pk' if name in ('pk', 'id') else name, descending))
+        if name in ('pk', 'id'):
+            return ordering
+    descending = ordering[-1][1] if ordering else False
+    return ordering + [('pk', descending)]
+
+
+def encode_cursor(values):
+    # isoformat() keeps the microseconds that DjangoJSONEncoder would round off: positions must be exact
+    values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, queryset, ordering):
+    """
+    Position values of a cursor, converted back to the types of their fields.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor.") from e
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor("The cursor does not match this listing.")
+
+    opts = queryset.model._meta
+    decoded = []
+    for (name, descending), value in zip(ordering, values):
+        field = opts.pk if name == 'pk' else next((f for f in opts.concrete_fields if f.name == name), None)
+        if isinstance(field, models.DateTimeField):
+            value = parse_datetime(value) if isinstance(value, str) else None
+            if value is None:
+                raise InvalidCursor("Malformed cursor.")
+        elif field is not None:
+            try:
+                value = field.to_python(value)
+            except Exception as e:
+                raise InvalidCursor("Malformed cursor.") from e
+        elif not isinstance(value, (int, float)): # Annotations (search rank, distance) are numbers
+            raise InvalidCursor("Malformed cursor.")
+        decoded.append(value)
+    return decoded
+
+
+def after_position(ordering, values):
+    """
+    Q of the rows that come after the given position:
+    (a > x) OR (a = x AND b > y) OR ..., with < for descending fields.
+    """
+    condition = Q()
+    for index, (name, descending) in enumerate(ordering):
+        step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[index]})
+        for (previous_name, _), previous_value in zip(ordering[:index], values[:index]):
+            step &= Q(**{previous_name: previous_value})
+        condition |= step
+    return condition
+
+
+class KeysetPage:
+    """
+    One page of keyset pagination: `object_list`, `has_next` and the `next_cursor` to ask for the following page.
+    """
+
+    def __init__(self, object_list, has_next, next_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(queryset, per_page, cursor=None):
+    """
+    The page of `queryset` (in its current ordering) following `cursor`, or the first page.
+    Raises InvalidCursor for cursors that were not issued for this ordering.
+    """
+    ordering = get_ordering(queryset)
+    queryset = queryset.order_by(*[f'{"-" if descending else ""}{name}' for name, descending in ordering])
+    if cursor:
+        queryset = queryset.filter(after_position(ordering, decode_cursor(cursor, queryset, ordering)))
+
+    rows = list(queryset[:per_page + 1]) # One more row tells whether there is a next page
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, name) for name, descending in ordering])
+    return KeysetPage(rows, has_next, next_cursor)
+
+
+def estimated_row_count(queryset):
+    """
+    MySQL's optimizer estimate of the number of rows of a queryset (from EXPLAIN, no rows are
+    read), or None on other databases.
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    if connection.vendor != 'mysql':
+        return None
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        columns = [column[0] for column in cursor.description]
+        plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    if not plan or plan[0].get('rows') is None:
+        return None
+    return int(plan[0]['rows'] * float(plan[0].get('filtered') or 100) / 100)
+
+
+def approximate_count(queryset, cap=None):
+    """
+    (count, exact) of a queryset without counting every row: on MySQL the optimizer's row
+    estimate (exact=False); elsewhere an exact count of at most `cap` rows
+    (settings.LISTING_COUNT_CAP), with exact=False when there are more.
+    """
+    cap = cap if cap is not None else getattr(settings, 'LISTING_COUNT_CAP', 1000)
+    queryset = queryset.order_by()
+    estimate = estimated_row_count(queryset)
+    if estimate is not None and estimate > cap: # Small results are cheap to count exactly
+        return estimate, False
+    count = queryset.values('pk')[:cap + 1].count()
+    return min(count, cap), count <= cap
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator whose total is approximate_count(): past the cap the last page number is a lower bound.
+    """
+
+    @cached_property
+    def count(self):
+        count, self.count_is_exact = approximate_count(self.object_list)
+        return count
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator whose total is the MySQL estimate when that is above settings.ADMIN_EXACT_COUNT_LIMIT,
+    an exact COUNT(*) otherwise. Pages past the end of an overestimate are empty.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimated_row_count(self.object_list)
+        if estimate is not None and estimate > getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000):
+            return estimate
+        return super().count
@@ -0,0 +1,127 @@
+# users/pdf.py
+#
+# Minimal pure-Python PDF writer for text documents (receipts).
+# It only knows the standard Helvetica fonts and left-aligned lines of text, which is all a
+# receipt needs, and it writes the document as a stream of chunks: pages are emitted as soon
+# as they are produced, so a document of any length is built in bounded memory.
+
+import textwrap
+
+PAGE_WIDTH = 595 # A4, in points
+PAGE_HEIGHT = 842
+MARGIN = 56
+LINE_SPACING = 1.5
+
+# Object numbers reserved at the start of every document
+_CATALOG, _PAGES, _FONT_REGULAR, _FONT_BOLD = 1, 2, 3, 4
+
+
+def _escape(text):
+    text = str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    # Standard fonts use WinAnsiEncoding (close to latin-1); anything else is replaced
+    return text.encode('cp1252', errors='replace')
+
+
+def _wrap(text, size):
+    # Helvetica averages about half an em per character
+    width = max(int((PAGE_WIDTH - 2 * MARGIN) / (size * 0.5)), 1)
+    return textwrap.wrap(str(text), width) or ['']
+
+
+class PDFStreamWriter:
+    """
+    Writes a PDF one page at a time. Every method returns the bytes to append to the output:
+
+        writer = PDFStreamWriter()
+        yield writer.begin()
+        for lines in pages:
+            yield writer.page(lines)
+        yield writer.end()
+
+    A page is a list of (text, font_size, bold) tuples laid out top to bottom; text that does not
+    fit on the page is cut off. Only the byte offset of each object is kept in memory.
+    """
+
+    def __init__(self):
+        self._offsets = {}
+        self._position = 0
+        self._next_id = _FONT_BOLD + 1
+        self._page_ids = []
+
+    def _emit(self, chunks):
+        data = b''.join(chunks)
+        self._position += len(data)
+        return data
+
+    def _object(self, object_id, body):
+        self._offsets[object_id] = self._position
+        return self._emit([f'{object_id} 0 obj\n'.encode(), body, b'\nendobj\n'])
+
+    def _reserve(self):
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    def begin(self):
+        header = self._emit([b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'])
+        return b''.join([
+            header,
+            self._object(_CATALOG, f'<< /Type /Catalog /Pages {_PAGES} 0 R >>'.encode()),
+            self._object(_FONT_REGULAR, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'),
+            self._object(_FONT_BOLD, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>'),
+        ])
+
+    def page(self, lines):
+        commands = [b'BT']
+        y = PAGE_HEIGHT - MARGIN
+        for text, size, bold in lines:
+            for wrapped in _wrap(text, size):
+                y -= size * LINE_SPACING
+                if y < MARGIN:
+                    break
+                font = 'F2' if bold else 'F1'
+                commands.append(f'/{font} {size} Tf 1 0 0 1 {MARGIN} {y:.2f} Tm'.encode())
+                commands.append(b'(' + _escape(wrapped) + b') Tj')
+        commands.append(b'ET')
+        content = b'\n'.join(commands)
+
+        content_id = self._reserve()
+        page_id = self._reserve()
+        self._page_ids.append(page_id)
+        return b''.join([
+            self._object(content_id, b''.join([
+                f'<< /Length {len(content)} >>\nstream\n'.encode(), content, b'\nendstream',
+            ])),
+            self._object(page_id, (
+                f'<< /Type /Page /Parent {_PAGES} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                f'/Resources << /Font << /F1 {_FONT_REGULAR} 0 R /F2 {_FONT_BOLD} 0 R >> >> '
+                f'/Contents {content_id} 0 R >>'
+            ).encode()),
+        ])
+
+    def end(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self._page_ids)
+        pages = self._object(_PAGES, f'<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>'.encode())
+
+        xref_position = self._position
+        size = self._next_id
+        xref = [f'xref\n0 {size}\n'.encode(), b'0000000000 65535 f \n']
+        for object_id in range(1, size):
+            xref.append(f'{self._offsets[object_id]:010d} 00000 n \n'.encode())
+        xref.append(f'trailer\n<< /Size {size} /Root {_CATALOG} 0 R >>\nstartxref\n{xref_position}\n%%EOF\n'.encode())
+        return pages + self._emit(xref)
+
+
+def iter_pdf(pages):
+    """
+    Yields the bytes of a PDF with one page per item of `pages` (see PDFStreamWriter.page).
+    """
+    writer = PDFStreamWriter()
+    yield writer.begin()
+    for lines in pages:
+        yield writer.page(lines)
+    yield writer.end()
+
+
+def build_pdf(pages):
+    return b''.join(iter_pdf(pages))
@@ -0,0 +1,260 @@
+# users/realtime.py
+#
+# Real-time chat delivery over ASGI websockets.
+# Clients connect to /ws/chat/<property_pk>/<other_user_pk>/ and receive every new ChatMessage
+# of that conversation as it is committed. Messages can also be sent over the socket.
+# Fan-out goes through a broadcast layer (settings.CHAT_BROADCAST_BACKEND), an in-process
+# one by default; tests or multi-server deployments can plug in their own implementation.
+
+import asyncio
+import json
+import re
+import threading
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.http.request import validate_host
+from django.utils.module_loading import import_string
+
+CHAT_SOCKET_PATH_RE = re.compile(r'^/ws/chat/(?P<property_pk>\d+)/(?P<other_user_pk>\d+)/$')
+
+# Websocket close codes (4000-4999 are free for application use)
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+
+
+def chat_group_name(property_id, user_id, other_user_id):
+    """
+    Name of the broadcast group shared by both participants of a conversation.
+    """
+    participant_a_id, participant_b_id = sorted([user_id, other_user_id])
+    return f"chat.{property_id}.{participant_a_id}.{participant_b_id}"
+
+
+class InMemoryBroadcast:
+    """
+    Broadcast layer for a single process: every subscriber gets an asyncio.Queue.
+    publish() may be called from any thread (e.g. a sync view); delivery is handed
+    over to the event loop that owns each subscriber queue.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, group):
+        queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._groups.setdefault(group, set()).add((loop, queue))
+        return queue
+
+    def unsubscribe(self, group, queue):
+        with self._lock:
+            subscribers = self._groups.get(group, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._groups.pop(group, None)
+
+    def publish(self, group, payload):
+        with self._lock:
+            subscribers = list(self._groups.get(group, ()))
+        for loop, queue in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(queue.put_nowait, payload)
+
+    def subscriber_count(self, group):
+        with self._lock:
+            return len(self._groups.get(group, ()))
+
+
+_broadcast = None
+_broadcast_lock = threading.Lock()
+
+
+def get_broadcast():
+    """
+    Returns the configured broadcast layer (settings.CHAT_BROADCAST_BACKEND), created once per process.
+    """
+    global _broadcast
+    with _broadcast_lock:
+        if _broadcast is None:
+            backend_path = getattr(settings, 'CHAT_BROADCAST_BACKEND', 'users.realtime.InMemoryBroadcast')
+            _broadcast = import_string(backend_path)()
+        return _broadcast
+
+
+@receiver(setting_changed)
+def _reset_broadcast(setting, **kwargs):
+    # Lets tests swap the backend with override_settings(CHAT_BROADCAST_BACKEND=...)
+    global _broadcast
+    if setting == 'CHAT_BROADCAST_BACKEND':
+        with _broadcast_lock:
+            _broadcast = None
+
+
+def serialize_message(message):
+    return {
+        'id': message.pk,
+        'message': message.message,
+        'timestamp': message.timestamp.isoformat(),
+        'sender_id': message.sender_id,
+        'property_id': message.property_id,
+    }
+
+
+def publish_chat_message(message):
+    """
+    Pushes a newly created ChatMessage to everyone connected to its conversation.
+    """
+    group = chat_group_name(message.property_id, message.sender_id, message.receiver_id)
+    get_broadcast().publish(group, serialize_message(message))
+
+
+# --- Websocket connection handling ---
+
+def database_sync_to_async(func):
+    """
+    sync_to_async for ORM work done by a websocket. A connection lives much longer than a request,
+    so its executor thread closes unusable or expired database connections before and after each
+    call, as Django does around every request (close_old_connections).
+    """
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call)
+
+
+def _allowed_hosts():
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    return allowed_hosts
+
+
+def _origin_allowed(headers):
+    # Browsers always send Origin on websocket handshakes; reject cross-site pages
+    origin = headers.get(b'origin')
+    if origin is None:
+        return True
+    host = urlsplit(origin.decode('latin1')).netloc
+    return validate_host(host, _allowed_hosts())
+
+
+def _get_user(headers):
+    from django.contrib.auth import get_user
+
+    cookie = SimpleCookie()
+    cookie.load(headers.get(b'cookie', b'').decode('latin1'))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    session_store = import_module(settings.SESSION_ENGINE).SessionStore
+    session = session_store(morsel.value if morsel else None)
+    return get_user(SimpleNamespace(session=session))
+
+
+def _authorize(headers, property_pk, other_user_pk):
+    """
+    Returns (user, property, other_user) for an authorized connection, or a close code.
+    """
+    from users.models import CustomUser, Property
+    from users.views import _can_access_chat
+
+    user = _get_user(headers)
+    if not user.is_authenticated:
+        return CLOSE_FORBIDDEN
+    property_obj = Property.objects.select_related('owner').filter(pk=property_pk).first()
+    other_user = CustomUser.objects.filter(pk=other_user_pk).first()
+    if property_obj is None or other_user is None:
+        return CLOSE_NOT_FOUND
+    if not _can_access_chat(user, property_obj, other_user):
+        return CLOSE_FORBIDDEN
+    return user, property_obj, other_user
+
+
+def _create_message(user, property_obj, other_user, text):
+    from users.forms import MessageForm
+    from users.models import ChatMessage
+
+    form = MessageForm({'message': text})
+    if not form.is_valid():
+        return False
+    # Same rule as chat_view: the owner writes to the tenant, anyone else writes to the owner
+    receiver_user = other_user if user == property_obj.owner else property_obj.owner
+    ChatMessage.objects.create(
+        sender=user,
+        receiver=receiver_user,
+        property=property_obj,
+        message=form.cleaned_data['message'],
+    )
+    return True
+
+
+async def chat_websocket(scope, receive, send):
+    """
+    ASGI application for the chat websocket (see RentHouse/asgi.py).
+    """
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = CHAT_SOCKET_PATH_RE.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    headers = dict(scope.get('headers', []))
+    if not _origin_allowed(headers):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    authorized = await database_sync_to_async(_authorize)(
+        headers, int(match['property_pk']), int(match['other_user_pk'])
+    )
+    if isinstance(authorized, int):
+        await send({'type': 'websocket.close', 'code': authorized})
+        return
+    user, property_obj, other_user = authorized
+
+    await send({'type': 'websocket.accept'})
+
+    broadcast = get_broadcast()
+    group = chat_group_name(property_obj.pk, user.pk, other_user.pk)
+    queue = broadcast.subscribe(group)
+
+    async def deliver():
+        while True:
+            payload = await queue.get()
+            await send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+    async def listen():
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                return
+            if event['type'] != 'websocket.receive' or not event.get('text'):
+                continue
+            try:
+                text = json.loads(event['text']).get('message', '')
+            except (ValueError, AttributeError):
+                continue
+            # The new message reaches this socket (and the other side) through the broadcast layer
+            created = await database_sync_to_async(_create_message)(user, property_obj, other_user, text)
+            if not created:
+                await send({'type': 'websocket.send', 'text': json.dumps({'error': 'Please correct the message error.'})})
+
+    delivery = asyncio.ensure_future(deliver())
+    try:
+        await listen()
+    finally:
+        delivery.cancel()
+        broadcast.unsubscribe(group, queue)
@@ -0,0 +1,353 @@
+# users/receipts.py
+#
+# PDF receipts for PaymentRecords.
+# - Rendering happens on the background worker pool (users/tasks.py), never inside a request.
+# - Finished PDFs are stored content-addressed under settings.RECEIPT_CACHE_DIR, keyed by the
+#   payment id and settings.RECEIPT_TEMPLATE_VERSION, so later downloads are a plain file send.
+#   Bump RECEIPT_TEMPLATE_VERSION whenever the receipt layout (or the renderer) changes.
+# - Two renderers: wkhtmltopdf through pdfkit (the receipt.html page), and a pure-Python one
+#   (users/pdf.py) used when wkhtmltopdf is not installed or fails, or when configured with
+#   RECEIPT_PDF_RENDERER = 'python'.
+# - Bulk exports stream many receipts as one ZIP (of the stored PDFs; missing ones are rendered on
+#   the pool while the archive streams, within a bounded wait) or one merged PDF, without ever
+#   holding more than one receipt in memory.
+
+import collections
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+from django.conf import settings
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import metrics, tasks
+from .pdf import build_pdf, iter_pdf
+
+try:
+    import pdfkit
+except ImportError: # Optional: only the pure-Python renderer is available
+    pdfkit = None
+
+PDFKIT_OPTIONS = {
+    'enable-local-file-access': None,
+    'encoding': "UTF-8",
+}
+
+# Receipt jobs of this process, by receipt key
+_jobs = {}
+_jobs_lock = threading.RLock() # Re-entered by done callbacks of jobs that finish immediately
+
+
+def get_renderer():
+    """
+    Name of the renderer in use: 'wkhtmltopdf' or 'python' (settings.RECEIPT_PDF_RENDERER, 'auto' by default).
+    """
+    renderer = getattr(settings, 'RECEIPT_PDF_RENDERER', 'auto')
+    if renderer == 'auto':
+        return 'wkhtmltopdf' if pdfkit is not None and shutil.which('wkhtmltopdf') else 'python'
+    return renderer
+
+
+def receipt_key(payment_pk):
+    version = getattr(settings, 'RECEIPT_TEMPLATE_VERSION', '1')
+    return hashlib.sha256(f'receipt:{payment_pk}:{version}'.encode()).hexdigest()
+
+
+def receipt_path(payment_pk):
+    key = receipt_key(payment_pk)
+    return os.path.join(settings.RECEIPT_CACHE_DIR, key[:2], f'{key}.pdf')
+
+
+def cached_receipt_path(payment_pk):
+    """
+    Path of the rendered receipt of a payment, or None if it has not been rendered yet.
+    """
+    path = receipt_path(payment_pk)
+    return path if os.path.exists(path) else None
+
+
+def receipt_lines(payment_record):
+    """
+    (label, value) pairs shown on a receipt; the same details as receipt.html.
+    """
+    lines = [
+        ('Payment ID', payment_record.pk),
+        ('Transaction ID', payment_record.transaction_id or ''),
+        ('Name', payment_record.full_name),
+        ('Email', payment_record.email),
+    ]
+    if payment_record.phone_number:
+        lines.append(('Phone', payment_record.phone_number))
+    lines += [
+        ('Amount Paid', f'RM {payment_record.amount}'),
+        ('Payment Method', payment_record.payment_method or ''),
+        ('Date', timezone.localtime(payment_record.payment_date).strftime('%B %d, %Y')),
+    ]
+    if payment_record.user:
+        lines.append(('Paid By User', payment_record.user.username))
+    if payment_record.booking:
+        lines.append(('For Booking', f'#{payment_record.booking.pk} ({payment_record.booking.property.title})'))
+    if payment_record.receiver_of_payment:
+        receiver = payment_record.receiver_of_payment
+        lines.append(('Received By', receiver.full_name or receiver.username))
+    return lines
+
+
+def receipt_page(payment_record):
+    """
+    The receipt as one page of users/pdf.py lines.
+    """
+    page = [
+        ('RentUrHouse', 12, True),
+        ('Payment Receipt', 20, True),
+        ('Thank you for your payment!', 12, False),
+        ('', 12, False),
+    ]
+    page += [(f'{label}: {value}', 12, False) for label, value in receipt_lines(payment_record)]
+    return page
+
+
+def render_receipt(source):
+    """
+    Renders a receipt snapshot (see _snapshot) to PDF bytes, falling back to the pure-Python
+    renderer when wkhtmltopdf is unavailable or fails.
+    """
+    if source.get('html') is not None:
+        try:
+            return pdfkit.from_string(source['html'], False, options=PDFKIT_OPTIONS)
+        except Exception:
+            pass
+    return build_pdf([source['page']])
+
+
+def _snapshot(payment_record):
+    # Everything a worker needs, taken in the request thread so that workers never query the database
+    source = {'page': receipt_page(payment_record), 'html': None}
+    if get_renderer() == 'wkhtmltopdf':
+        source['html'] = render_to_string('receipt.html', {'payment_record': payment_record})
+    return source
+
+
+def _store(payment_pk, pdf):
+    path = receipt_path(payment_pk)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so a half-written file is never served
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(pdf)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def _render_and_store(payment_pk, source):
+    start = time.perf_counter()
+    try:
+        path = _store(payment_pk, render_receipt(source))
+    except Exception:
+        metrics.receipt_pdfs.inc(result='error')
+        raise
+    metrics.receipt_pdfs.inc(result='ok')
+    metrics.receipt_pdf_duration.observe(time.perf_counter() - start)
+    return path
+
+
+def request_receipt(payment_record):
+    """
+    Makes sure the receipt of a payment is rendered: returns None when it is already on disk,
+    otherwise the Future of the (new, running or failed) render job, which resolves to its path.
+    """
+    if cached_receipt_path(payment_record.pk):
+        metrics.count_cache_lookup('receipt', True)
+        return None
+    key = receipt_key(payment_record.pk)
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is None:
+            metrics.count_cache_lookup('receipt', False)
+            job = tasks.submit(_render_and_store, payment_record.pk, _snapshot(payment_record))
+            _jobs[key] = job
+            job.add_done_callback(lambda done, key=key: _forget_job(key, done))
+        return job
+
+
+def _forget_job(key, job):
+    # Finished jobs are found on disk from now on; failed ones stay so their error can be reported
+    if job.exception() is None:
+        with _jobs_lock:
+            if _jobs.get(key) is job:
+                del _jobs[key]
+
+
+def receipt_status(payment_record):
+    """
+    'ready', 'pending' or 'failed'; starts rendering the receipt if needed.
+    """
+    job = request_receipt(payment_record)
+    if job is None:
+        return 'ready'
+    if not job.done():
+        return 'pending'
+    if job.exception() is not None:
+        _discard_job(payment_record.pk, job)
+        return 'failed'
+    return 'ready'
+
+
+def _discard_job(payment_pk, job):
+    # A failed job is reported once; the next request starts a new attempt
+    with _jobs_lock:
+        if _jobs.get(receipt_key(payment_pk)) is job:
+            del _jobs[receipt_key(payment_pk)]
+
+
+def wait_for_receipt(payment_record, timeout):
+    """
+    Returns the path of the rendered receipt, waiting up to `timeout` seconds for it to be rendered.
+    Raises concurrent.futures.TimeoutError if it is still being rendered, or the rendering error.
+    """
+    job = request_receipt(payment_record)
+    if job is None:
+        return receipt_path(payment_record.pk)
+    try:
+        return job.result(timeout=timeout)
+    except Exception as e:
+        if job.done() and job.exception() is e:
+            _discard_job(payment_record.pk, job)
+        raise
+
+
+# --- Bulk export ---
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+# Receipts an export queues on the worker pool ahead of the one it is writing
+EXPORT_RENDER_AHEAD = 16
+
+# Last entry of an export ZIP when some of its receipts were not rendered in time
+PENDING_RECEIPTS_NAME = 'pending_receipts.txt'
+
+
+def _exported_receipt_path(payment_record, job, deadline):
+    # Path of a receipt queued by request_receipt() (job is None: already on disk), or None if it
+    # is not rendered by the deadline or its rendering failed (the next export retries it)
+    if job is None:
+        return receipt_path(payment_record.pk)
+    try:
+        return job.result(timeout=max(deadline - time.monotonic(), 0))
+    except concurrent.futures.TimeoutError:
+        return None
+    except Exception:
+        _discard_job(payment_record.pk, job)
+        return None
+
+
+def iter_payments(queryset, batch_size=200):
+    """
+    Iterates over PaymentRecords ordered by (payment_date, pk), fetching `batch_size` rows per
+    query with a keyset condition, so memory stays bounded on every database backend.
+    """
+    queryset = queryset.order_by('payment_date', 'pk')
+    last = None
+    while True:
+        batch = queryset
+        if last is not None:
+            batch = batch.filter(
+                Q(payment_date__gt=last.payment_date) | Q(payment_date=last.payment_date, pk__gt=last.pk)
+            )
+        batch = list(batch[:batch_size])
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        last = batch[-1]
+
+
+class _StreamBuffer:
+    """
+    Non-seekable file object that collects what zipfile writes until it is handed out.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_receipts_zip(payments, wait=None):
+    """
+    Yields a ZIP archive of the stored PDF receipts of `payments`. Receipts that are not rendered
+    yet are rendered on the worker pool, EXPORT_RENDER_AHEAD of them ahead of the one being
+    written, and the export waits for them up to `wait` seconds in all
+    (settings.RECEIPT_EXPORT_WAIT_SECONDS). The ones still missing after that are listed in a
+    last PENDING_RECEIPTS_NAME entry; they keep rendering, so exporting again includes them.
+    """
+    if wait is None:
+        wait = getattr(settings, 'RECEIPT_EXPORT_WAIT_SECONDS', 30)
+    deadline = time.monotonic() + wait
+    payments = iter(payments)
+    queued = collections.deque() # (payment, render job or None)
+    buffer = _StreamBuffer()
+    pending = []
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        while True:
+            for payment_record in payments:
+                queued.append((payment_record, request_receipt(payment_record)))
+                if len(queued) >= EXPORT_RENDER_AHEAD:
+                    break
+            if not queued:
+                break
+            payment_record, job = queued.popleft()
+            path = _exported_receipt_path(payment_record, job, deadline)
+            if path is None:
+                pending.append(payment_record.pk)
+                continue
+            info = zipfile.ZipInfo(
+                f'receipt_{payment_record.pk}.pdf',
+                date_time=timezone.localtime(payment_record.payment_date).timetuple()[:6],
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as pdf, archive.open(info, mode='w') as entry:
+                for chunk in iter(lambda: pdf.read(EXPORT_CHUNK_SIZE), b''):
+                    entry.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            yield buffer.pop() # End of the entry (data descriptor)
+        if pending:
+            archive.writestr(PENDING_RECEIPTS_NAME, (
+                "These receipts are still being prepared; export again in a moment to include them:\n"
+                + "".join(f"receipt_{pk}.pdf\n" for pk in pending)
+            ))
+    yield buffer.pop() # Central directory
+
+
+def iter_receipts_pdf(payments):
+    """
+    Yields one PDF with a page per receipt of `payments`.
+    The pages are laid out again by users/pdf.py rather than copied from the stored receipts:
+    joining existing PDF files takes a PDF parser, which the project does not depend on. They
+    therefore use the pure-Python layout even where single receipts come from wkhtmltopdf. This
+    layout is only a few lines of text per page, so it costs about as much as reading the files.
+    """
+    return iter_pdf(receipt_page(payment_record) for payment_record in payments)
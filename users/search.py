@@ -0,0 +1,159 @@
+# users/search.py
+
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, FloatField, IntegerField, Max, OuterRef, Q, Subquery, Sum, When
+from django.db.models.expressions import RawSQL
+
+from .models import Property, PropertySearchTerm
+
+# Fields that are searchable, with the weight a match in each field contributes to the rank.
+# A hit in the title matters more than a hit somewhere in the description.
+SEARCH_FIELD_WEIGHTS = {
+    'title': 5,
+    'university_nearby': 3,
+    'address': 2,
+    'description': 1,
+}
+
+# Name of the MySQL FULLTEXT index created in migration 0009
+FULLTEXT_INDEX_NAME = 'property_search_ft'
+
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'at', 'by', 'for', 'in', 'is', 'near', 'of', 'on', 'or', 'the', 'to', 'with',
+])
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """
+    Splits text into normalized search terms (lowercase, alphanumeric, no stop words).
+    """
+    if not text:
+        return []
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+def get_backend():
+    """
+    Returns the active search backend: 'fulltext' (MySQL MATCH ... AGAINST) or 'terms'
+    (the PropertySearchTerm inverted index). Controlled by settings.PROPERTY_SEARCH_BACKEND.
+    """
+    backend = getattr(settings, 'PROPERTY_SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        return 'fulltext' if connection.vendor == 'mysql' else 'terms'
+    return backend
+
+
+def build_terms(property_obj):
+    """
+    Returns a {term: weight} dict for a property, summing field weights for every occurrence.
+    """
+    weights = Counter()
+    for field_name, field_weight in SEARCH_FIELD_WEIGHTS.items():
+        for token in tokenize(getattr(property_obj, field_name, '')):
+            weights[token] += field_weight
+    return weights
+
+
+def index_property(property_obj):
+    """
+    Replaces the indexed terms of a single property. Called whenever a Property is saved.
+    """
+    terms = build_terms(property_obj)
+    with transaction.atomic():
+        PropertySearchTerm.objects.filter(property_id=property_obj.pk).delete()
+        PropertySearchTerm.objects.bulk_create([
+            PropertySearchTerm(property_id=property_obj.pk, term=term, weight=weight)
+            for term, weight in terms.items()
+        ])
+
+
+def rebuild_index(batch_size=500, queryset=None):
+    """
+    Rebuilds the term index of the given properties (default: the whole index).
+    Returns the number of properties indexed.
+    """
+    fields = ['pk'] + list(SEARCH_FIELD_WEIGHTS)
+    indexed = 0
+    with transaction.atomic():
+        if queryset is None:
+            queryset = Property.objects.all()
+            PropertySearchTerm.objects.all().delete()
+        else:
+            PropertySearchTerm.objects.filter(property__in=queryset.values('pk')).delete()
+        batch = []
+        for property_obj in queryset.only(*fields).iterator(chunk_size=batch_size):
+            batch.extend(
+                PropertySearchTerm(property_id=property_obj.pk, term=term, weight=weight)
+                for term, weight in build_terms(property_obj).items()
+            )
+            indexed += 1
+            if len(batch) >= batch_size:
+                PropertySearchTerm.objects.bulk_create(batch)
+                batch = []
+        PropertySearchTerm.objects.bulk_create(batch)
+    return indexed
+
+
+def _search_terms(queryset, tokens):
+    # Every token has to match; the last one is matched as a prefix so results
+    # still show up while the user is typing.
+    *whole_tokens, last_token = tokens
+    conditions = [Q(term=token) for token in whole_tokens] + [Q(term__startswith=last_token)]
+
+    term_filter = Q()
+    for condition in conditions:
+        term_filter |= condition
+
+    # One flag per token: a single term may satisfy several tokens ("university uni"), so
+    # counting which condition each term hit first would miss some of them
+    matched_tokens = {
+        f'matched_{position}': Max(Case(When(condition, then=1), default=0, output_field=IntegerField()))
+        for position, condition in enumerate(conditions)
+    }
+    ranked = (
+        PropertySearchTerm.objects.filter(term_filter)
+        .values('property')
+        .annotate(**matched_tokens, score=Sum('weight'))
+        .filter(**{name: 1 for name in matched_tokens})
+    )
+
+    return queryset.filter(pk__in=ranked.values('property')).annotate(
+        search_rank=Subquery(ranked.filter(property=OuterRef('pk')).values('score')[:1])
+    )
+
+
+def _search_fulltext(queryset, tokens):
+    table = Property._meta.db_table
+    columns = ', '.join(f'`{table}`.`{field_name}`' for field_name in SEARCH_FIELD_WEIGHTS)
+    boolean_query = ' '.join(f'+{token}*' for token in tokens)
+    match = RawSQL(f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)', (boolean_query,), output_field=FloatField())
+    return queryset.annotate(search_rank=match).filter(search_rank__gt=0)
+
+
+def search_properties(queryset, query):
+    """
+    Narrows a Property queryset to the listings matching the search query,
+    annotated with `search_rank` and ordered by relevance (newest first on ties).
+    """
+    tokens = tokenize(query)[:MAX_QUERY_TERMS]
+    if not tokens:
+        return queryset
+
+    if get_backend() == 'fulltext':
+        queryset = _search_fulltext(queryset, tokens)
+    else:
+        queryset = _search_terms(queryset, tokens)
+    return queryset.order_by('-search_rank', '-created_at')
@@ -0,0 +1,392 @@
+# users/seeding.py
+#
+# Synthetic data for load testing (`manage.py seed_bench`, `manage.py benchmark_site`).
+# Rows are written with bulk_create in batches, so none of the model save() methods or signals
+# run; everything they would have maintained is rebuilt afterwards in bulk:
+# conversations, booking counters / is_available, amenity masks, the search index and the
+# listing cache version. Coordinates are generated directly, so nothing is geocoded.
+#
+# The volumes are skewed the way the real site is: a few owners list most properties, popular
+# listings collect most bookings and chat messages, and most conversations are short while a
+# few run long (Zipf-like weights, see zipf_weights()).
+#
+# Generated users are named "<tag>-<role>-<n>" (tag "bench" by default), so a dataset can be
+# removed again with clear_dataset(tag).
+
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+
+from . import search
+from .caching import bump_listing_version
+from .models import (
+    AdditionalOccupant, Amenity, Booking, ChatMessage, Conversation, CustomUser, MaintenanceRequest,
+    PaymentRecord, Property,
+)
+
+DEFAULT_VOLUMES = {
+    'students': 2000,
+    'owners': 200,
+    'properties': 2000,
+    'amenities': 15,
+    'bookings': 3000,
+    'messages': 20000,
+    'maintenance': 1000,
+    'payments': 2000,
+}
+
+BENCH_PASSWORD = 'bench-password'
+
+# Areas listings cluster around: (name, latitude, longitude, share of the listings)
+AREAS = [
+    ('Gombak', 3.2514, 101.7357, 0.4),
+    ('Setapak', 3.2013, 101.7176, 0.3),
+    ('Shah Alam', 3.0738, 101.5183, 0.2),
+    ('Bangi', 2.9270, 101.7788, 0.1),
+]
+STREETS = ['Jalan Mawar', 'Jalan Melati', 'Jalan Kenanga', 'Jalan Cempaka', 'Jalan Teratai', 'Lorong Seroja']
+TITLE_WORDS = ['Cozy', 'Spacious', 'Modern', 'Quiet', 'Furnished', 'Bright', 'Affordable', 'Renovated']
+UNIVERSITIES = ['UniKL MIIT', 'UIAM Gombak', 'TARUMT', 'UiTM Shah Alam', 'UKM Bangi']
+AMENITY_NAMES = [
+    'WiFi', 'Air Conditioning', 'Parking', 'Washing Machine', 'Water Heater', 'Refrigerator',
+    'Study Desk', 'Wardrobe', 'Kitchen', 'Security Guard', 'Swimming Pool', 'Gym', 'Balcony',
+    'Near Bus Stop', 'Near LRT', 'Cleaning Service', 'Surau', 'Laundry Room', 'Bed Frame', 'Microwave',
+]
+ISSUES = [
+    ('Leaking pipe', 'Water is leaking under the kitchen sink.'),
+    ('Broken aircon', 'The air conditioner in the bedroom does not turn on.'),
+    ('No hot water', 'The water heater stopped working.'),
+    ('WiFi down', 'The internet connection keeps dropping.'),
+    ('Door lock', 'The main door lock is stuck.'),
+    ('Ceiling light', 'The ceiling light in the living room flickers.'),
+]
+CHAT_LINES = [
+    'Hi, is this room still available?', 'Yes, it is available.', 'Can I view the house this weekend?',
+    'Sure, Saturday 10am works.', 'Is WiFi included in the rent?', 'Yes, WiFi and water are included.',
+    'How much is the deposit?', 'Two months rent plus utilities deposit.', 'Thank you!', 'Noted, see you then.',
+]
+
+
+def zipf_weights(count, exponent=1.1):
+    """
+    Weights 1/rank^exponent: the first items are picked far more often than the last ones.
+    """
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def _created_pks(model, objects):
+    # bulk_create sets the primary keys where the database returns them (PostgreSQL, SQLite,
+    # MariaDB); on MySQL a batch gets consecutive ids, the latest ones of the table.
+    if connection.features.can_return_rows_from_bulk_insert:
+        return [obj.pk for obj in objects]
+    pks = list(model.objects.order_by('-pk').values_list('pk', flat=True)[:len(objects)])[::-1]
+    for obj, pk in zip(objects, pks):
+        obj.pk = pk
+    return pks
+
+
+def _bulk_create(model, objects, batch_size):
+    created = []
+    for start in range(0, len(objects), batch_size):
+        batch = model.objects.bulk_create(objects[start:start + batch_size])
+        _created_pks(model, batch)
+        created += batch
+    return created
+
+
+class DatasetBuilder:
+    """
+    Generates one dataset; build() writes it and returns the number of rows per model.
+    """
+
+    def __init__(self, tag='bench', volumes=None, seed=42, batch_size=1000, stdout=None):
+        self.tag = tag
+        self.volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.stdout = stdout
+        self.now = timezone.now()
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    def build(self):
+        with transaction.atomic():
+            self.create_users()
+            self.create_amenities()
+            self.create_properties()
+            self.create_bookings()
+            self.create_messages()
+            self.create_maintenance_requests()
+            self.create_payments()
+            self.rebuild_derived_data()
+        return self.counts
+
+    # --- Rows ---
+
+    def create_users(self):
+        password = make_password(BENCH_PASSWORD) # Hashed once: hashing is deliberately slow
+        users = []
+        for role, count in (('student', self.volumes['students']), ('owner', self.volumes['owners'])):
+            for i in range(count):
+                username = f'{self.tag}-{role}-{i}'
+                users.append(CustomUser(
+                    username=username, email=f'{username}@bench.example.com', password=password, role=role,
+                    full_name=f'{role.title()} {i}', gender=self.random.choice(['male', 'female']),
+                    phone_number=f'01{self.random.randint(10000000, 99999999)}',
+                    course=self.random.choice(['BSE', 'BIOT', 'BCSS', 'BIS', 'BNS']) if role == 'student' else '',
+                    created_at=self.now - timedelta(days=self.random.randint(0, 720)),
+                ))
+        users = _bulk_create(CustomUser, users, self.batch_size)
+        self.students = [user for user in users if user.role == 'student']
+        self.owners = [user for user in users if user.role == 'owner']
+        self.log(f"{len(self.students)} students, {len(self.owners)} owners")
+
+    def create_amenities(self):
+        # Amenity.save() hands out the mask bits, so these few rows are saved one by one
+        self.amenities = []
+        for i in range(self.volumes['amenities']):
+            name = AMENITY_NAMES[i] if i < len(AMENITY_NAMES) else f'{self.tag} amenity {i}'
+            self.amenities.append(Amenity.objects.get_or_create(name=name)[0])
+        self.log(f"{len(self.amenities)} amenities")
+
+    def create_properties(self):
+        if not self.owners:
+            self.properties = []
+            return
+        owner_weights = zipf_weights(len(self.owners))
+        # Common amenities (WiFi, aircon) are on most listings, rare ones on few
+        amenity_weights = zipf_weights(len(self.amenities), exponent=0.8)
+        properties, chosen_amenities = [], []
+        for i in range(self.volumes['properties']):
+            area, latitude, longitude, _ = self.random.choices(AREAS, weights=[a[3] for a in AREAS])[0]
+            house_type = self.random.choices(['House', 'Apartment', 'Condominium', 'Studio'], weights=[5, 4, 2, 1])[0]
+            bedrooms = self.random.choices([1, 2, 3, 4, 5], weights=[2, 4, 5, 3, 1])[0]
+            properties.append(Property(
+                owner=self.random.choices(self.owners, weights=owner_weights)[0],
+                house_type=house_type,
+                title=f'{self.random.choice(TITLE_WORDS)} {house_type.lower()} in {area}',
+                rent=Decimal(self.random.randint(25, 300) * 10),
+                university_nearby=self.random.choice(UNIVERSITIES),
+                address=f'{self.random.randint(1, 200)}, {self.random.choice(STREETS)} {self.random.randint(1, 30)}, {area}',
+                bedrooms=bedrooms,
+                total_room=bedrooms + self.random.randint(1, 3),
+                total_toilets=self.random.randint(1, 3),
+                description=f'{bedrooms} bedroom {house_type.lower()} near {self.random.choice(UNIVERSITIES)}.',
+                max_tenants=self.random.randint(1, bedrooms * 2),
+                gender_preferred=self.random.choice([choice[0] for choice in Property.GENDER_PREFERENCE_CHOICES]),
+                latitude=Decimal(str(round(latitude + self.random.gauss(0, 0.02), 6))),
+                longitude=Decimal(str(round(longitude + self.random.gauss(0, 0.02), 6))),
+                created_at=self.now - timedelta(minutes=self.random.randint(0, 60 * 24 * 365)),
+            ))
+            chosen_amenities.append({
+                amenity for amenity in self.random.choices(
+                    self.amenities, weights=amenity_weights, k=self.random.randint(0, len(self.amenities))
+                )
+            } if self.amenities else set())
+        self.properties = _bulk_create(Property, properties, self.batch_size)
+
+        through = Property.amenities.through
+        through.objects.bulk_create([
+            through(property_id=property_obj.pk, amenity_id=amenity.pk)
+            for property_obj, amenities in zip(self.properties, chosen_amenities)
+            for amenity in amenities
+        ], batch_size=self.batch_size * 4)
+        # Popularity of each listing, reused for bookings and chats
+        self.property_weights = zipf_weights(len(self.properties), exponent=0.9)
+        self.random.shuffle(self.property_weights)
+        self.log(f"{len(self.properties)} properties")
+
+    def create_bookings(self):
+        self.bookings, occupants = [], []
+        if not self.properties or not self.students:
+            return
+        statuses, status_weights = ['pending', 'confirmed', 'rejected', 'cancelled', 'completed'], [2, 3, 2, 1, 3]
+        active_tenants = set() # A student holds at most one pending or confirmed booking
+        bookings = []
+        for i in range(self.volumes['bookings']):
+            tenant = self.random.choice(self.students)
+            status = self.random.choices(statuses, weights=status_weights)[0]
+            if status in Property.objects.ACTIVE_BOOKING_STATUSES:
+                if tenant.pk in active_tenants:
+                    status = self.random.choice(['rejected', 'cancelled', 'completed'])
+                else:
+                    active_tenants.add(tenant.pk)
+            property_obj = self.random.choices(self.properties, weights=self.property_weights)[0]
+            bookings.append(Booking(
+                property=property_obj, tenant=tenant, status=status,
+                start_date=(self.now + timedelta(days=self.random.randint(-365, 90))).date(),
+                number_of_occupants=self.random.randint(1, max(1, property_obj.max_tenants)),
+                full_name_on_form=tenant.full_name, gender_on_form=tenant.gender,
+                student_id_number=f'S{tenant.pk:07d}', email_on_form=tenant.email,
+                current_address_on_form='Kolej Kediaman', university_name_on_form=self.random.choice(UNIVERSITIES),
+                expected_duration_of_stay=self.random.choice(['6 months', '1 year', '2 years']),
+            ))
+        self.bookings = _bulk_create(Booking, bookings, self.batch_size)
+
+        for booking in self.bookings:
+            for n in range(booking.number_of_occupants - 1):
+                occupants.append(AdditionalOccupant(
+                    booking=booking, full_name=f'Occupant {n} of booking {booking.pk}',
+                    email=f'occupant{n}.{booking.pk}@bench.example.com', phone_number='0123456789',
+                    gender=self.random.choice(['male', 'female']),
+                ))
+        AdditionalOccupant.objects.bulk_create(occupants, batch_size=self.batch_size)
+        self.log(f"{len(self.bookings)} bookings, {len(occupants)} additional occupants")
+
+    def create_messages(self):
+        self.message_count = 0
+        total = self.volumes['messages']
+        if not total or not self.properties or not self.students:
+            return
+        # Conversations between a student and the owner of a listing; a few of them run long
+        conversation_count = max(1, total // 8)
+        pairs = [
+            (self.random.choice(self.students), self.random.choices(self.properties, weights=self.property_weights)[0])
+            for _ in range(conversation_count)
+        ]
+        lengths = self.random.choices(range(1, conversation_count + 1), weights=zipf_weights(conversation_count, 0.7), k=total)
+
+        messages, timestamps = [], []
+        for conversation_index in lengths:
+            student, property_obj = pairs[conversation_index - 1]
+            from_student = self.random.random() < 0.55
+            sent_at = self.now - timedelta(minutes=self.random.randint(0, 60 * 24 * 180))
+            messages.append(ChatMessage(
+                sender_id=student.pk if from_student else property_obj.owner_id,
+                receiver_id=property_obj.owner_id if from_student else student.pk,
+                property=property_obj,
+                message=self.random.choice(CHAT_LINES),
+                is_read=sent_at < self.now - timedelta(days=2) or self.random.random() < 0.5,
+            ))
+            timestamps.append(sent_at)
+
+        for start in range(0, len(messages), self.batch_size):
+            batch = ChatMessage.objects.bulk_create(messages[start:start + self.batch_size])
+            pks = _created_pks(ChatMessage, batch)
+            # timestamp is auto_now_add, so bulk_create stamps every row with "now": spread them out
+            ChatMessage.objects.filter(pk__in=pks).update(timestamp=Case(
+                *[When(pk=pk, then=Value(sent_at)) for pk, sent_at in zip(pks, timestamps[start:start + self.batch_size])]
+            ))
+        self.message_count = len(messages)
+        self.log(f"{self.message_count} chat messages in {len(set(lengths))} conversations")
+
+    def create_maintenance_requests(self):
+        self.maintenance_count = 0
+        # Raised by tenants of confirmed or completed bookings about the property they rent
+        tenancies = [booking for booking in self.bookings if booking.status in ('confirmed', 'completed')]
+        if not tenancies:
+            return
+        requests = []
+        for _ in range(self.volumes['maintenance']):
+            booking = self.random.choice(tenancies)
+            title, description = self.random.choice(ISSUES)
+            submitted = self.now - timedelta(hours=self.random.randint(0, 24 * 365))
+            status = self.random.choices(['pending', 'in_progress', 'done', 'rejected'], weights=[3, 2, 4, 1])[0]
+            requests.append(MaintenanceRequest(
+                property_id=booking.property_id, submitted_by_id=booking.tenant_id,
+                issue_title=title, issue_description=description, submitted_date=submitted, status=status,
+                priority=self.random.choices(['low', 'medium', 'high', 'urgent'], weights=[3, 4, 2, 1])[0],
+                resolved_date=submitted + timedelta(days=self.random.randint(1, 14)) if status == 'done' else None,
+                resolution_notes='Fixed by contractor.' if status == 'done' else None,
+            ))
+        MaintenanceRequest.objects.bulk_create(requests, batch_size=self.batch_size)
+        self.maintenance_count = len(requests)
+        self.log(f"{self.maintenance_count} maintenance requests")
+
+    def create_payments(self):
+        self.payment_count = 0
+        paid = [booking for booking in self.bookings if booking.status in ('confirmed', 'completed')]
+        if not paid:
+            return
+        properties = {property_obj.pk: property_obj for property_obj in self.properties}
+        students = {student.pk: student for student in self.students}
+        payments = []
+        for i in range(self.volumes['payments']):
+            booking = self.random.choice(paid)
+            tenant = students[booking.tenant_id]
+            property_obj = properties[booking.property_id]
+            payments.append(PaymentRecord(
+                user=tenant, booking=booking, receiver_of_payment_id=property_obj.owner_id,
+                full_name=tenant.full_name, email=tenant.email, phone_number=tenant.phone_number,
+                amount=property_obj.rent,
+                payment_date=self.now - timedelta(minutes=self.random.randint(0, 60 * 24 * 365)),
+                transaction_id=f'{self.tag.upper()}-{i:08d}',
+                payment_method=self.random.choice(['Online Banking', 'Credit Card', 'E-Wallet']),
+            ))
+        PaymentRecord.objects.bulk_create(payments, batch_size=self.batch_size)
+        self.payment_count = len(payments)
+        self.log(f"{self.payment_count} payments")
+
+    # --- Data the skipped save() methods and signals would have maintained ---
+
+    def rebuild_derived_data(self):
+        property_ids = [property_obj.pk for property_obj in self.properties]
+        if property_ids:
+            Property.objects.recompute_booking_counters(Property.objects.filter(pk__in=property_ids))
+            Property.objects.refresh_amenity_masks(property_ids)
+            build_conversations(ChatMessage.objects.filter(property_id__in=property_ids))
+            search.rebuild_index(batch_size=self.batch_size, queryset=Property.objects.filter(pk__in=property_ids))
+        transaction.on_commit(bump_listing_version)
+
+    @property
+    def counts(self):
+        return {
+            'students': len(self.students),
+            'owners': len(self.owners),
+            'amenities': len(self.amenities),
+            'properties': len(self.properties),
+            'bookings': len(self.bookings),
+            'messages': self.message_count,
+            'maintenance': self.maintenance_count,
+            'payments': self.payment_count,
+        }
+
+
+def build_conversations(messages):
+    """
+    Creates the Conversation summary rows of the given messages (which must not have any yet),
+    the same way the 0010 migration built them from the existing chat history.
+    """
+    conversations = {}
+    for msg in messages.order_by('-timestamp', '-id').iterator():
+        if msg.sender_id == msg.receiver_id:
+            continue
+        participant_a_id, participant_b_id = sorted([msg.sender_id, msg.receiver_id])
+        key = (msg.property_id, participant_a_id, participant_b_id)
+        conversation = conversations.get(key)
+        if conversation is None:
+            conversation = conversations[key] = Conversation(
+                property_id=msg.property_id,
+                participant_a_id=participant_a_id,
+                participant_b_id=participant_b_id,
+                last_message_id=msg.pk,
+                last_message_at=msg.timestamp,
+            )
+        if not msg.is_read:
+            if msg.receiver_id == participant_a_id:
+                conversation.unread_a += 1
+            else:
+                conversation.unread_b += 1
+    Conversation.objects.bulk_create(conversations.values(), batch_size=500)
+    return len(conversations)
+
+
+def clear_dataset(tag='bench'):
+    """
+    Deletes a generated dataset: its users, and with them their properties, bookings, chats
+    and maintenance requests. Returns the number of users deleted.
+    """
+    users = CustomUser.objects.filter(username__startswith=f'{tag}-', email__endswith='@bench.example.com')
+    with transaction.atomic():
+        # Payments only lose their user (SET_NULL), so they are removed explicitly
+        PaymentRecord.objects.filter(Q(user__in=users) | Q(receiver_of_payment__in=users)).delete()
+        count = users.count()
+        users.delete()
+    return count
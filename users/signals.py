@@ -0,0 +1,186 @@
+# users/signals.py
+
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import caching, geocoding, images, metrics, realtime, search, tasks
+from .models import Amenity, Booking, ChatMessage, MediaBlob, PaymentRecord, Property, PropertyImage
+from .storage import model_content_addressed_fields
+
+
+@receiver(post_save, sender=Property)
+def update_property_search_index(sender, instance, raw=False, **kwargs):
+    """
+    Keeps the PropertySearchTerm index in sync whenever a Property is saved.
+    (MySQL maintains its FULLTEXT index itself, so nothing to do there.)
+    """
+    if raw or search.get_backend() != 'terms':
+        return
+    search.index_property(instance)
+
+
+@receiver(post_save, sender=Property)
+def schedule_image_derivatives(sender, instance, raw=False, **kwargs):
+    """
+    Resizes a newly uploaded main_image in the background once the upload is committed.
+    """
+    if raw or not images.needs_derivatives(instance.main_image, instance.image_derivatives):
+        return
+    transaction.on_commit(partial(tasks.submit, images.generate_property_derivatives, instance.pk))
+
+
+@receiver(pre_save, sender=Property)
+def update_coordinates_on_address_change(sender, instance, raw=False, **kwargs):
+    """
+    A new or changed address takes its coordinates from the geocoding cache, or is geocoded
+    in the background after the save (see schedule_geocoding). Coordinates set explicitly
+    together with the address (e.g. in the admin) are kept.
+    """
+    instance._needs_geocoding = False
+    if raw:
+        return
+    if instance._state.adding:
+        if instance.latitude is not None and instance.longitude is not None:
+            return
+    else:
+        previous = sender.objects.filter(pk=instance.pk).values('address', 'latitude', 'longitude').first()
+        if previous is not None and (
+            previous['address'] == instance.address
+            or (previous['latitude'], previous['longitude']) != (instance.latitude, instance.longitude)
+        ):
+            return
+
+    entry = geocoding.cached_lookup(instance.address) if instance.address.strip() else None
+    instance.latitude, instance.longitude = entry.coordinates if entry and entry.coordinates else (None, None)
+    instance._needs_geocoding = entry is None and bool(instance.address.strip())
+
+
+@receiver(post_save, sender=Property)
+def schedule_geocoding(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, '_needs_geocoding', False):
+        return
+    transaction.on_commit(partial(tasks.submit, geocoding.geocode_property, instance.pk))
+
+
+@receiver(post_save, sender=PropertyImage)
+def schedule_gallery_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or not images.needs_derivatives(instance.image, instance.image_derivatives):
+        return
+    transaction.on_commit(partial(tasks.submit, images.generate_gallery_derivatives, instance.pk))
+
+
+@receiver(post_save, sender=ChatMessage)
+def push_new_chat_message(sender, instance, created, raw=False, **kwargs):
+    """
+    Sends new messages to the websocket clients of the conversation once the row is committed.
+    """
+    if created and not raw:
+        transaction.on_commit(partial(realtime.publish_chat_message, instance))
+
+
+@receiver(post_save, sender=ChatMessage)
+@receiver(post_save, sender=PaymentRecord)
+def count_created_rows(sender, instance, created, raw=False, **kwargs):
+    # Throughput counters of users/metrics.py, for committed rows only
+    if created and not raw:
+        counter = metrics.chat_messages if sender is ChatMessage else metrics.payments
+        transaction.on_commit(counter.inc)
+
+
+@receiver(post_save, sender=Property)
+@receiver(post_delete, sender=Property)
+@receiver(post_save, sender=Amenity)
+@receiver(post_delete, sender=Amenity)
+def invalidate_listing_pages(sender, **kwargs):
+    """
+    Any listing change makes every cached home page stale.
+    (Property cards are versioned by updated_at, which save() already moves forward.)
+    """
+    transaction.on_commit(caching.bump_listing_version)
+
+
+@receiver(m2m_changed, sender=Property.amenities.through)
+def invalidate_listing_on_amenities_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Changing amenities does not save the Property, so bump its updated_at (new card version)
+    and the listing version by hand.
+    """
+    if action == 'pre_clear' and reverse:
+        # amenity.properties.clear() does not say which properties lose it; remember them now
+        instance._cleared_property_ids = list(instance.properties.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        property_ids = [instance.pk]
+    elif action == 'post_clear':
+        property_ids = getattr(instance, '_cleared_property_ids', [])
+    else:
+        property_ids = list(pk_set)
+    if property_ids:
+        Property.objects.filter(pk__in=property_ids).update(updated_at=timezone.now())
+        Property.objects.refresh_amenity_masks(property_ids)
+    transaction.on_commit(caching.bump_listing_version)
+
+
+@receiver(pre_delete, sender=Amenity)
+def remember_amenity_properties(sender, instance, **kwargs):
+    # Deleting an amenity removes its ManyToMany rows without any m2m_changed signal
+    instance._property_ids = list(instance.properties.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Amenity)
+def clear_deleted_amenity_bit(sender, instance, **kwargs):
+    if getattr(instance, '_property_ids', None):
+        Property.objects.refresh_amenity_masks(instance._property_ids)
+
+
+@receiver(post_delete, sender=Booking)
+def release_booking_counters(sender, instance, **kwargs):
+    """
+    A deleted booking no longer holds its property (Booking.save() handles every other change).
+    """
+    Property.objects.adjust_booking_counters(
+        instance.property_id, removed=(instance.status, instance.number_of_occupants)
+    )
+
+
+@receiver(pre_save, sender=Property)
+@receiver(pre_save, sender=PropertyImage)
+def remember_stored_files(sender, instance, raw=False, **kwargs):
+    """
+    Remembers which stored files the row pointed at before this save.
+    """
+    fields = model_content_addressed_fields(sender)
+    if raw or instance._state.adding or not fields:
+        instance._previous_files = {}
+        return
+    instance._previous_files = sender.objects.filter(pk=instance.pk).values(*[field.attname for field in fields]).first() or {}
+
+
+@receiver(post_save, sender=Property)
+@receiver(post_save, sender=PropertyImage)
+def count_stored_file_references(sender, instance, raw=False, **kwargs):
+    """
+    Keeps MediaBlob reference counts in step when a row starts or stops using a stored file.
+    """
+    if raw:
+        return
+    previous_files = getattr(instance, '_previous_files', {})
+    for field in model_content_addressed_fields(sender):
+        old_name = previous_files.get(field.attname) or ''
+        new_name = getattr(instance, field.attname).name or ''
+        if old_name != new_name:
+            MediaBlob.objects.retain(new_name)
+            MediaBlob.objects.release(old_name, field.storage)
+
+
+@receiver(post_delete, sender=Property)
+@receiver(post_delete, sender=PropertyImage)
+def release_stored_files(sender, instance, **kwargs):
+    for field in model_content_addressed_fields(sender):
+        MediaBlob.objects.release(getattr(instance, field.attname).name or '', field.storage)
@@ -0,0 +1,15 @@
+// Admin changelist filters backed by the admin autocomplete (AutocompleteFilter in users/admin.py):
+// picking a value reloads the changelist with the filter applied, keeping the other filters.
+'use strict';
+{
+    const $ = django.jQuery;
+
+    $(document).on('change', '.autocomplete-filter select', function() {
+        const container = this.closest('.autocomplete-filter');
+        const params = new URLSearchParams(container.dataset.queryString);
+        if (this.value) {
+            params.set(this.name, this.value);
+        }
+        window.location.search = params.toString();
+    });
+}
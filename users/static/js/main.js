@@ -180,3 +180,105 @@ function showResolveNoteForm(reqId) {
     document.getElementById('resolve-note-form-' + reqId).style.display = 'block';
 }
 
+
+// --- NEW: Chat history paging (loads older messages when scrolling to the top) ---
+document.addEventListener('DOMContentLoaded', function() {
+    const chatMessages = document.querySelector('.chat-messages[data-history-url]');
+    if (!chatMessages) return;
+
+    let cursor = chatMessages.dataset.cursor;
+    let hasMore = chatMessages.dataset.hasMore === 'true';
+    let loading = false;
+
+    // Start at the newest message
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+
+    function buildBubble(message) {
+        const bubble = document.createElement('div');
+        bubble.classList.add('message-bubble', message.sender_is_me ? 'sent' : 'received');
+        bubble.appendChild(document.createTextNode(message.message));
+        const time = document.createElement('small');
+        time.textContent = new Date(message.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+        bubble.appendChild(time);
+        return bubble;
+    }
+
+    function loadOlderMessages() {
+        if (loading || !hasMore || !cursor) return;
+        loading = true;
+
+        const url = chatMessages.dataset.historyUrl + '?before=' + encodeURIComponent(cursor);
+        fetch(url)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                // Keep the current view in place while older messages are inserted above it
+                const previousHeight = chatMessages.scrollHeight;
+                const fragment = document.createDocumentFragment();
+                data.messages.forEach(message => fragment.appendChild(buildBubble(message)));
+                chatMessages.insertBefore(fragment, chatMessages.firstChild);
+                chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+
+                hasMore = data.has_more;
+                cursor = data.next_cursor;
+            })
+            .catch(error => {
+                console.error('Error loading older messages:', error);
+            })
+            .finally(() => {
+                loading = false;
+            });
+    }
+
+    chatMessages.addEventListener('scroll', function() {
+        if (chatMessages.scrollTop < 50) {
+            loadOlderMessages();
+        }
+    });
+});
+
+// --- NEW: Real-time chat over a websocket (falls back to the normal form POST when unavailable) ---
+document.addEventListener('DOMContentLoaded', function() {
+    const chatMessages = document.querySelector('.chat-messages[data-socket-path]');
+    const chatForm = document.querySelector('.chat-input-area');
+    const chatInput = chatForm ? chatForm.querySelector('.chat-message-input') : null;
+    if (!chatMessages || !chatForm || !chatInput || !window.WebSocket) return;
+
+    const currentUserId = parseInt(chatMessages.dataset.userId, 10);
+    const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const socket = new WebSocket(scheme + window.location.host + chatMessages.dataset.socketPath);
+
+    socket.addEventListener('message', function(event) {
+        const data = JSON.parse(event.data);
+        if (data.error) {
+            console.warn('Chat error:', data.error);
+            return;
+        }
+
+        // Drop the "Start the conversation!" placeholder on the first message
+        const placeholder = chatMessages.querySelector('p');
+        if (placeholder && !chatMessages.querySelector('.message-bubble')) placeholder.remove();
+
+        const bubble = document.createElement('div');
+        bubble.classList.add('message-bubble', data.sender_id === currentUserId ? 'sent' : 'received');
+        bubble.appendChild(document.createTextNode(data.message));
+        const time = document.createElement('small');
+        time.textContent = new Date(data.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+        bubble.appendChild(time);
+        chatMessages.appendChild(bubble);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    });
+
+    chatForm.addEventListener('submit', function(event) {
+        if (socket.readyState !== WebSocket.OPEN) return; // Let the form POST as before
+        event.preventDefault();
+        const text = chatInput.value.trim();
+        if (!text) return;
+        socket.send(JSON.stringify({ message: text }));
+        chatInput.value = '';
+    });
+});
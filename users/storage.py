@@ -0,0 +1,111 @@
+# users/storage.py
+#
+# Content-addressed storage for uploaded images.
+# A file is saved under the SHA-256 of its bytes (property_images/<sha256>.<ext>), so uploading
+# the same picture twice stores it once. How many rows point at each file is tracked by
+# MediaBlob.ref_count (kept up to date by users/signals.py); a file is deleted when its last
+# reference goes away. `manage.py dedupe_media` moves existing uploads to this layout.
+
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+
+
+def file_digest(content):
+    """
+    SHA-256 hex digest of a django File (read in chunks).
+    """
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names every file after its content: saving bytes that are
+    already stored returns the existing name instead of writing a copy.
+    """
+
+    def content_name(self, name, digest):
+        directory = posixpath.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(directory, f'{digest}{extension}')
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save(), so no random suffixes
+        return name
+
+    def _save(self, name, content):
+        name = self.content_name(name, file_digest(content))
+        if self.exists(name):
+            return name
+
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+            if self.directory_permissions_mode is not None:
+                os.chmod(directory, self.directory_permissions_mode)
+        # Write then rename: concurrent uploads of the same bytes all end with the same complete file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks():
+                    tmp.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return name
+
+
+_property_image_storage = ContentAddressedStorage()
+
+
+def property_image_storage():
+    # Callable, so that migrations reference it instead of serializing the storage
+    return _property_image_storage
+
+
+def model_content_addressed_fields(model):
+    """
+    File fields of a model that are stored with a ContentAddressedStorage.
+    """
+    return [
+        field for field in model._meta.fields
+        if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+def content_addressed_fields():
+    """
+    (model, field) pairs of every file field stored with a ContentAddressedStorage.
+    """
+    return [(model, field) for model in apps.get_models() for field in model_content_addressed_fields(model)]
+
+
+def is_tracked(name):
+    # External image URLs stored in image fields are not files of ours
+    return bool(name) and not name.startswith(('http://', 'https://'))
+
+
+def delete_blob(storage, name):
+    """
+    Deletes a stored file and the resized derivatives made from it.
+    """
+    from .images import derivatives_directory
+
+    storage.delete(name)
+    directory = derivatives_directory(name)
+    if storage.exists(directory):
+        for filename in storage.listdir(directory)[1]:
+            storage.delete(posixpath.join(directory, filename))
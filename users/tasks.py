@@ -0,0 +1,48 @@
+# users/tasks.py
+#
+# Background worker pool for slow work that should not hold up a request (PDF rendering, ...).
+# Jobs run on a thread pool inside the web process, sized by settings.BACKGROUND_TASK_WORKERS.
+# A job that touches the database gets its own connection, which is closed when it finishes.
+# With settings.BACKGROUND_TASKS_EAGER (used by tests) jobs run inline in the calling thread.
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+                thread_name_prefix='renthouse-task',
+            )
+        return _executor
+
+
+def _run(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+def submit(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) on the worker pool and returns its concurrent.futures.Future.
+    """
+    if getattr(settings, 'BACKGROUND_TASKS_EAGER', False):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return get_executor().submit(_run, func, args, kwargs)
@@ -0,0 +1,41 @@
+from django import template
+
+from users.images import responsive_image
+
+register = template.Library()
+
+# Default `sizes` attribute per derivative size: how wide the image is displayed
+DEFAULT_SIZES = {
+    'thumb': '160px',
+    'card': '(max-width: 600px) 100vw, 480px',
+    'detail': '(max-width: 1200px) 100vw, 1200px',
+}
+
+
+def _image_context(field_file, derivatives, alt, size, css_class, sizes, lazy):
+    return {
+        'image': responsive_image(field_file, derivatives, size),
+        'alt': alt,
+        'css_class': css_class,
+        'sizes': sizes or DEFAULT_SIZES[size],
+        'loading': 'lazy' if lazy else 'eager',
+    }
+
+
+@register.inclusion_tag('partials/property_image.html')
+def property_image(property_obj, size, css_class='', sizes=None, lazy=True):
+    """
+    Renders the main image of a property as a <picture> with WebP/JPEG srcsets,
+    e.g. {% property_image property 'card' 'property-image' %}.
+    `size` is one of users.images.DERIVATIVE_WIDTHS and picks the fallback <img> src.
+    """
+    return _image_context(property_obj.main_image, property_obj.image_derivatives, property_obj.title, size, css_class, sizes, lazy)
+
+
+@register.inclusion_tag('partials/property_image.html')
+def gallery_image(image, size, css_class='', sizes=None, lazy=True, alt=''):
+    """
+    Same as property_image, for a PropertyImage of the gallery. Pass `alt` (e.g. the property
+    title) when the image has no caption, rather than reading image.property per image.
+    """
+    return _image_context(image.image, image.image_derivatives, image.caption or alt, size, css_class, sizes, lazy)
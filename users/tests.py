@@ -1,3 +1,1846 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.db.models import Count, Q
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from unittest import skipUnless
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    amenities, benchmark, caching, facets, geo, geocoding, images, instrumentation, metrics, pagination, realtime,
+    receipts, search, seeding, views,
+)
+from .bookings import BookingError, create_booking
+from .forms import BookingForm
+from .management.commands import check_query_plans
+from .models import (
+    AdditionalOccupant, Amenity, Booking, ChatMessage, Conversation, CustomUser, GeocodeCache, MediaBlob, PaymentRecord,
+    Property, PropertyImage, PropertySearchTerm,
+)
+from .pdf import build_pdf
+from .storage import property_image_storage
+
+# Geocodes from settings.GEOCODING_STATIC_RESULTS: tests never call a real geocoding service
+OFFLINE_GEOCODER = 'users.geocoding.StaticProvider'
+
+
+def booking_form_data(tenant, **extra):
+    data = {
+        'full_name_on_form': tenant.username,
+        'gender_on_form': 'male',
+        'student_id_number': 'S123',
+        'email_on_form': tenant.email,
+        'current_address_on_form': '1 Jalan Test',
+        'university_name_on_form': 'UiTM',
+        'expected_duration_of_stay': '1 year',
+        'start_date': (date.today() + timedelta(days=7)).isoformat(),
+    }
+    data.update(extra)
+    return data
+
+
+def valid_booking_form(tenant, **extra):
+    form = BookingForm(booking_form_data(tenant, **extra))
+    assert form.is_valid(), form.errors
+    return form
+
+
+class BookPropertyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        cls.property = Property.objects.create(
+            house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=cls.owner, max_tenants=3,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.tenant)
+
+    def post_booking(self, **extra):
+        data = booking_form_data(self.tenant, **extra)
+        data.update({
+            'occupants-TOTAL_FORMS': '2',
+            'occupants-INITIAL_FORMS': '0',
+            'occupants-MIN_NUM_FORMS': '0',
+            'occupants-MAX_NUM_FORMS': '1000',
+            'occupants-0-full_name': 'Ali',
+            'occupants-0-email': 'ali@example.com',
+            'occupants-0-phone_number': '0123',
+            'occupants-0-gender': 'male',
+            'occupants-1-full_name': 'Abu',
+            'occupants-1-email': 'abu@example.com',
+            'occupants-1-phone_number': '0456',
+            'occupants-1-gender': 'female',
+        })
+        return self.client.post(reverse('users:book_property', args=[self.property.pk]), data)
+
+    def test_form_carries_an_idempotency_key(self):
+        response = self.client.get(reverse('users:book_property', args=[self.property.pk]))
+        self.assertEqual(len(response.context['form'].initial['idempotency_key']), 32)
+        self.assertContains(response, 'name="idempotency_key"')
+
+    def test_booking_with_occupants(self):
+        response = self.post_booking(idempotency_key='abc')
+        booking = Booking.objects.get()
+        self.assertRedirects(response, reverse('users:move_in_notice', args=[booking.pk]))
+        self.assertEqual(booking.number_of_occupants, 3)
+        self.assertEqual(booking.additional_occupants.count(), 2)
+        self.property.refresh_from_db()
+        self.assertFalse(self.property.is_available)
+
+    def test_resubmitting_the_same_form_returns_the_same_booking(self):
+        first = self.post_booking(idempotency_key='abc')
+        second = self.post_booking(idempotency_key='abc')
+        booking = Booking.objects.get()
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(AdditionalOccupant.objects.filter(booking=booking).count(), 2)
+
+    def test_second_booking_with_another_key_is_refused(self):
+        self.post_booking(idempotency_key='abc')
+        response = self.post_booking(idempotency_key='def')
+        self.assertRedirects(response, reverse('tenant:tenant_home'), fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.count(), 1)
+
+
+class CreateBookingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.property = Property.objects.create(
+            house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=cls.owner,
+        )
+
+    def test_unavailable_property_is_refused(self):
+        first = CustomUser.objects.create_user('first', 'first@example.com', 'pw', role='student')
+        second = CustomUser.objects.create_user('second', 'second@example.com', 'pw', role='student')
+        create_booking(self.property.pk, first, valid_booking_form(first))
+        with self.assertRaises(BookingError):
+            create_booking(self.property.pk, second, valid_booking_form(second))
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_idempotency_keys_are_per_tenant(self):
+        first = CustomUser.objects.create_user('first', 'first@example.com', 'pw', role='student')
+        second = CustomUser.objects.create_user('second', 'second@example.com', 'pw', role='student')
+        other_property = Property.objects.create(
+            house_type='House', title='Other House', rent=500, address='2 Jalan Test', owner=self.owner,
+        )
+        create_booking(self.property.pk, first, valid_booking_form(first), idempotency_key='same-key')
+        booking, created = create_booking(other_property.pk, second, valid_booking_form(second), idempotency_key='same-key')
+        self.assertTrue(created)
+        self.assertEqual((booking.tenant, booking.property), (second, other_property))
+
+    def test_capacity_is_checked(self):
+        tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        occupant_form = object() # Never reached: the booking is refused first
+        with self.assertRaises(BookingError):
+            create_booking(self.property.pk, tenant, valid_booking_form(tenant), [occupant_form])
+        self.assertFalse(Booking.objects.exists())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER)
+class ConcurrentBookingTests(TransactionTestCase):
+    """
+    Many students book the same property at the same moment: exactly one of them may get it.
+    Needs a database with row locks (MySQL/PostgreSQL); SQLite skips it.
+    """
+
+    TENANTS = 20
+
+    def test_no_overbooking_under_concurrent_load(self):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        property_obj = Property.objects.create(
+            house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=owner,
+        )
+        tenants = [
+            CustomUser.objects.create_user(f'tenant{i}', f'tenant{i}@example.com', 'pw', role='student')
+            for i in range(self.TENANTS)
+        ]
+
+        barrier = threading.Barrier(self.TENANTS)
+        outcomes = []
+        outcomes_lock = threading.Lock()
+
+        def book(tenant):
+            try:
+                form = valid_booking_form(tenant)
+                barrier.wait()
+                try:
+                    create_booking(property_obj.pk, tenant, form)
+                    outcome = 'booked'
+                except BookingError:
+                    outcome = 'refused'
+                with outcomes_lock:
+                    outcomes.append(outcome)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(tenant,)) for tenant in tenants]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count('booked'), 1)
+        self.assertEqual(outcomes.count('refused'), self.TENANTS - 1)
+        self.assertEqual(Booking.objects.filter(property=property_obj).count(), 1)
+        property_obj.refresh_from_db()
+        self.assertEqual(property_obj.pending_bookings_count, 1)
+        self.assertFalse(property_obj.is_available)
+
+    def test_double_submit_under_concurrent_load(self):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        property_obj = Property.objects.create(
+            house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=owner,
+        )
+
+        submits = 5
+        barrier = threading.Barrier(submits)
+        booking_ids = []
+        booking_ids_lock = threading.Lock()
+
+        def submit():
+            try:
+                form = valid_booking_form(tenant)
+                barrier.wait()
+                booking, created = create_booking(property_obj.pk, tenant, form, idempotency_key='same-form')
+                with booking_ids_lock:
+                    booking_ids.append(booking.pk)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit) for _ in range(submits)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(booking_ids), submits)
+        self.assertEqual(len(set(booking_ids)), 1)
+        self.assertEqual(Booking.objects.count(), 1)
+
+
+class ReceiptPDFTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner', full_name='Owner')
+        cls.payment = PaymentRecord.objects.create(
+            full_name='Tenant (Ali)', email='tenant@example.com', amount=500,
+            receiver_of_payment=cls.owner, transaction_id='TX1', payment_method='Online Banking',
+        )
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_override = override_settings(RECEIPT_CACHE_DIR=self.cache_dir, RECEIPT_PDF_RENDERER='python')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.owner) # The receiver of the payment
+
+    def test_pure_python_pdf(self):
+        pdf = build_pdf([[('Receipt (copy)', 12, False)], [('Page two', 12, True)]])
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertTrue(pdf.endswith(b'%%EOF\n'))
+        self.assertIn(b'/Count 2', pdf)
+        self.assertIn(b'(Receipt \\(copy\\)) Tj', pdf)
+        # The xref table points at the start of every object
+        xref_position = int(pdf.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+        offsets = pdf[xref_position:].split(b'\n')[3:-1]
+        for object_id, line in enumerate(offsets, start=1):
+            if not line.endswith(b' n '):
+                break
+            offset = int(line.split()[0])
+            self.assertTrue(pdf[offset:].startswith(f'{object_id} 0 obj'.encode()))
+
+    def test_download_renders_once_then_sends_the_stored_file(self):
+        url = reverse('users:receipt_pdf', args=[self.payment.pk])
+        with mock.patch.object(receipts, 'render_receipt', wraps=receipts.render_receipt) as render:
+            first = self.client.get(url)
+            second = self.client.get(url)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertIn('receipt_%d.pdf' % self.payment.pk, first['Content-Disposition'])
+        self.assertEqual(b''.join(first.streaming_content), b''.join(second.streaming_content))
+        self.assertTrue(receipts.cached_receipt_path(self.payment.pk).startswith(self.cache_dir))
+
+    def test_template_version_is_part_of_the_key(self):
+        old_path = receipts.receipt_path(self.payment.pk)
+        with override_settings(RECEIPT_TEMPLATE_VERSION='2'):
+            self.assertNotEqual(receipts.receipt_path(self.payment.pk), old_path)
+
+    def test_status_endpoint(self):
+        url = reverse('users:receipt_pdf_status', args=[self.payment.pk])
+        response = self.client.get(url)
+        self.assertIn(response.json()['status'], ('pending', 'ready'))
+        receipts.wait_for_receipt(self.payment, timeout=10)
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {
+            'status': 'ready',
+            'download_url': reverse('users:receipt_pdf', args=[self.payment.pk]),
+        })
+
+    def test_only_the_parties_see_a_receipt(self):
+        urls = [reverse(name, args=[self.payment.pk]) for name in ('users:receipt', 'users:receipt_pdf', 'users:receipt_pdf_status')]
+        stranger = CustomUser.objects.create_user('stranger', 'stranger@example.com', 'pw', role='student')
+        self.client.force_login(stranger)
+        self.assertEqual([self.client.get(url).status_code for url in urls], [404, 404, 403])
+        self.client.logout()
+        self.assertEqual([self.client.get(url).status_code for url in urls], [404, 404, 403])
+        self.assertIsNone(receipts.cached_receipt_path(self.payment.pk))
+
+        # A guest payer, in the session they paid in
+        session = self.client.session
+        session[views.GUEST_RECEIPTS_SESSION_KEY] = [self.payment.pk]
+        session.save()
+        self.assertEqual([self.client.get(url).status_code for url in urls], [200, 200, 200])
+
+        # The owner of the booked property
+        tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        landlord = CustomUser.objects.create_user('landlord', 'landlord@example.com', 'pw', role='owner')
+        property_obj = Property.objects.create(house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=landlord)
+        self.payment.booking = Booking.objects.create(property=property_obj, tenant=tenant, start_date=date.today())
+        self.payment.save()
+        self.client.force_login(landlord)
+        self.assertEqual(self.client.get(urls[2]).status_code, 200)
+
+    def test_download_does_not_hold_the_request_while_rendering(self):
+        with mock.patch.object(views, 'wait_for_receipt', side_effect=views.FuturesTimeoutError) as wait:
+            response = self.client.get(reverse('users:receipt_pdf', args=[self.payment.pk]))
+        self.assertEqual(wait.call_args.kwargs['timeout'], settings.RECEIPT_PDF_WAIT_SECONDS)
+        self.assertLessEqual(settings.RECEIPT_PDF_WAIT_SECONDS, 1)
+        self.assertRedirects(response, reverse('users:receipt', args=[self.payment.pk]), fetch_redirect_response=False)
+
+    def test_failed_render_is_reported_and_retried(self):
+        with mock.patch.object(receipts, 'render_receipt', side_effect=OSError('disk full')):
+            response = self.client.get(reverse('users:receipt_pdf', args=[self.payment.pk]))
+        self.assertRedirects(response, reverse('users:receipt', args=[self.payment.pk]), fetch_redirect_response=False)
+        self.assertIsNone(receipts.cached_receipt_path(self.payment.pk))
+
+        response = self.client.get(reverse('users:receipt_pdf', args=[self.payment.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(os.path.exists(receipts.receipt_path(self.payment.pk)))
+
+
+def make_jpeg(width, height, color=(200, 120, 40)):
+    buffer = io.BytesIO()
+    image = Image.new('RGB', (width, height), color)
+    # Noise so that the file size is realistic for a photo
+    image.putdata([((x * 7) % 256, (y * 13) % 256, (x * y) % 256) for y in range(height) for x in range(width)])
+    image.save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER)
+class PropertyImageDerivativeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, BACKGROUND_TASKS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_property(self, main_image):
+        with self.captureOnCommitCallbacks(execute=True):
+            property_obj = Property.objects.create(
+                house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=self.owner,
+                main_image=main_image,
+            )
+        property_obj.refresh_from_db()
+        return property_obj
+
+    def test_upload_gets_resized_jpeg_and_webp_derivatives(self):
+        original = make_jpeg(1600, 1000)
+        property_obj = self.create_property(SimpleUploadedFile('house.jpg', original, content_type='image/jpeg'))
+
+        derivatives = property_obj.image_derivatives
+        self.assertEqual(derivatives['source'], property_obj.main_image.name)
+        self.assertEqual(
+            {size: (v['width'], v['height']) for size, v in derivatives['sizes'].items()},
+            {'thumb': (160, 100), 'card': (480, 300), 'detail': (1200, 750)},
+        )
+        for variant in derivatives['sizes'].values():
+            self.assertTrue(default_storage.exists(variant['jpeg']))
+            self.assertTrue(default_storage.exists(variant['webp']))
+        card_bytes = default_storage.size(derivatives['sizes']['card']['webp'])
+        self.assertLess(card_bytes * 10, len(original))
+
+    def test_small_images_are_not_upscaled(self):
+        property_obj = self.create_property(SimpleUploadedFile('small.jpg', make_jpeg(300, 200), content_type='image/jpeg'))
+        self.assertEqual(property_obj.image_derivatives['sizes']['detail']['width'], 300)
+        image = images.responsive_image(property_obj.main_image, property_obj.image_derivatives, 'card')
+        self.assertEqual(image['srcset'].count('w'), 2) # 160w and 300w once each
+
+    def test_identical_uploads_share_derivatives(self):
+        data = make_jpeg(800, 600)
+        first = self.create_property(SimpleUploadedFile('a.jpg', data, content_type='image/jpeg'))
+        second = self.create_property(SimpleUploadedFile('b.jpg', data, content_type='image/jpeg'))
+        self.assertEqual(first.image_derivatives['sizes'], second.image_derivatives['sizes'])
+
+    def test_listing_serves_derivatives(self):
+        property_obj = self.create_property(SimpleUploadedFile('house.jpg', make_jpeg(1600, 1000), content_type='image/jpeg'))
+        response = self.client.get(reverse('users:home'))
+        card = property_obj.image_derivatives['sizes']['card']
+        self.assertContains(response, f'src="{default_storage.url(card["jpeg"])}"')
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_external_images_are_left_alone(self):
+        property_obj = self.create_property('https://example.com/house.jpg')
+        self.assertEqual(property_obj.image_derivatives, {})
+        image = images.responsive_image(property_obj.main_image, property_obj.image_derivatives, 'card')
+        self.assertEqual(image, {'src': 'https://example.com/house.jpg', 'external': True})
+
+
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER)
+class ContentAddressedStorageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = property_image_storage()
+
+    def create_property(self, main_image, title='Test House'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Property.objects.create(
+                house_type='House', title=title, rent=500, address='1 Jalan Test', owner=self.owner, main_image=main_image,
+            )
+
+    def test_identical_uploads_are_stored_once(self):
+        data = make_jpeg(64, 48)
+        first = self.create_property(SimpleUploadedFile('house.jpg', data))
+        second = self.create_property(SimpleUploadedFile('house.JPG', data))
+        self.assertEqual(first.main_image.name, second.main_image.name)
+        self.assertRegex(first.main_image.name, r'^property_images/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(self.storage.listdir('property_images')[1], [os.path.basename(first.main_image.name)])
+        self.assertEqual(MediaBlob.objects.get(name=first.main_image.name).ref_count, 2)
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        data = make_jpeg(64, 48)
+        first = self.create_property(SimpleUploadedFile('house.jpg', data))
+        second = self.create_property(SimpleUploadedFile('house.jpg', data))
+        name = first.main_image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+
+        # Replacing the image releases the old file
+        with self.captureOnCommitCallbacks(execute=True):
+            second.main_image = SimpleUploadedFile('other.jpg', make_jpeg(32, 32, (0, 0, 0)))
+            second.save()
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertEqual(MediaBlob.objects.get(name=second.main_image.name).ref_count, 1)
+
+    def test_retain_counts_a_row_created_concurrently(self):
+        name = 'property_images/' + 'a' * 64 + '.jpg'
+        MediaBlob.objects.create(name=name, ref_count=1)
+        # The other upload inserted the row between our lookup and our insert
+        with mock.patch.object(type(MediaBlob.objects), 'get_or_create', side_effect=IntegrityError):
+            MediaBlob.objects.retain(name)
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 2)
+
+    def test_untracked_files_are_never_deleted(self):
+        # Rows from before reference counting (no signals ran for them)
+        legacy_name = default_storage.save('property_images/legacy.jpg', ContentFile(make_jpeg(16, 16)))
+        property_obj, = Property.objects.bulk_create([Property(
+            house_type='House', title='Legacy', rent=500, address='1 Jalan Test', owner=self.owner, main_image=legacy_name,
+        )])
+        with self.captureOnCommitCallbacks(execute=True):
+            property_obj.delete()
+        self.assertTrue(self.storage.exists(legacy_name))
+
+    def test_dedupe_media_collapses_existing_duplicates(self):
+        data = make_jpeg(64, 48)
+        legacy_names = [default_storage.save('property_images/pexels-photo.jpeg', ContentFile(data)) for _ in range(3)]
+        unique_name = default_storage.save('property_images/unique.png', ContentFile(make_jpeg(16, 16)))
+        self.assertEqual(len(set(legacy_names)), 3)
+        properties = [self.create_property(name, title=f'P{i}') for i, name in enumerate(legacy_names + [unique_name])]
+        Property.objects.filter(pk=properties[0].pk).update(image_derivatives={'source': legacy_names[0], 'sizes': {}})
+
+        call_command('dedupe_media', stdout=io.StringIO())
+
+        files = self.storage.listdir('property_images')[1]
+        self.assertEqual(len(files), 2)
+        names = list(Property.objects.order_by('title').values_list('main_image', flat=True))
+        self.assertEqual(len(set(names[:3])), 1)
+        self.assertRegex(names[0], r'^property_images/[0-9a-f]{64}\.jpeg$')
+        self.assertRegex(names[3], r'^property_images/[0-9a-f]{64}\.png$')
+        self.assertEqual(Property.objects.get(pk=properties[0].pk).image_derivatives['source'], names[0])
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'ref_count')), {names[0]: 3, names[3]: 1})
+
+
+    def test_dedupe_media_keeps_the_old_files_if_the_database_update_fails(self):
+        data = make_jpeg(64, 48)
+        legacy_names = [default_storage.save('property_images/pexels-photo.jpeg', ContentFile(data)) for _ in range(2)]
+        properties = [self.create_property(name, title=f'P{i}') for i, name in enumerate(legacy_names)]
+
+        with mock.patch.object(MediaBlob.objects, 'bulk_create', side_effect=RuntimeError('database down')):
+            with self.assertRaises(RuntimeError):
+                call_command('dedupe_media', stdout=io.StringIO())
+        for property_obj, name in zip(properties, legacy_names):
+            property_obj.refresh_from_db()
+            self.assertEqual(property_obj.main_image.name, name)
+            self.assertTrue(self.storage.exists(name))
+
+        # Running again finishes the job with the content-addressed file already in place
+        call_command('dedupe_media', stdout=io.StringIO())
+        names = set(Property.objects.values_list('main_image', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(self.storage.listdir('property_images')[1], [os.path.basename(names.pop())])
+
+
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER)
+class PropertyGalleryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, BACKGROUND_TASKS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.property = Property.objects.create(
+            house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=self.owner,
+            main_image='https://example.com/house.jpg',
+        )
+
+    def add_images(self, count):
+        start = self.property.images.count()
+        files = [SimpleUploadedFile(f'room{i}.jpg', make_jpeg(64 + start + i, 48)) for i in range(count)]
+        with self.captureOnCommitCallbacks(execute=True):
+            return PropertyImage.objects.add_images(self.property, files)
+
+    def test_images_are_appended_in_order(self):
+        self.add_images(2)
+        self.add_images(1)
+        images_ = list(self.property.images.all())
+        self.assertEqual([image.position for image in images_], [0, 1, 2])
+        self.assertEqual(MediaBlob.objects.filter(name__in=[image.image.name for image in images_]).count(), 3)
+
+    def test_gallery_images_get_derivatives(self):
+        image, = self.add_images(1)
+        image.refresh_from_db()
+        self.assertEqual(image.image_derivatives['source'], image.image.name)
+
+    def test_deleting_an_image_releases_its_file(self):
+        image, = self.add_images(1)
+        name = image.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(property_image_storage().exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def detail_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('users:property_detail', args=[self.property.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_detail_page_query_count_does_not_grow_with_the_gallery(self):
+        self.add_images(1)
+        _, baseline = self.detail_queries()
+        self.add_images(4)
+        response, queries = self.detail_queries()
+        self.assertEqual(queries, baseline)
+        self.assertContains(response, 'class="property-image gallery-slide', count=6)
+        self.assertContains(response, 'loading="lazy"', count=5)
+
+
+@override_settings(
+    GEOCODING_PROVIDER=OFFLINE_GEOCODER, BACKGROUND_TASKS_EAGER=True,
+    GEOCODING_STATIC_RESULTS={
+        '1 Jalan Test, Kuala Lumpur': ('3.139003', '101.686855'),
+        'Shah Alam, Selangor': ('3.073281', '101.518461'),
+    },
+)
+class GeocodingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+
+    def create_property(self, address, title='Test House'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Property.objects.create(house_type='House', title=title, rent=500, address=address, owner=self.owner)
+
+    def test_normalize_address(self):
+        self.assertEqual(geocoding.normalize_address('  1  Jalan Test ,Kuala   Lumpur. '), '1 jalan test, kuala lumpur')
+
+    def test_each_address_is_sent_to_the_provider_once(self):
+        with mock.patch.object(geocoding.StaticProvider, 'geocode', autospec=True,
+                               side_effect=geocoding.StaticProvider.geocode) as geocode:
+            first = self.create_property('1 Jalan Test, Kuala Lumpur')
+            second = self.create_property('1 jalan test,  KUALA LUMPUR', title='Same Address')
+        self.assertEqual(geocode.call_count, 1)
+        for property_obj in (first, second):
+            property_obj.refresh_from_db()
+            self.assertEqual((str(property_obj.latitude), str(property_obj.longitude)), ('3.139003', '101.686855'))
+        self.assertEqual(GeocodeCache.objects.count(), 1)
+
+    def test_unknown_address_falls_back_to_its_last_parts(self):
+        property_obj = self.create_property('Lot 5, Seksyen 7, Shah Alam, Selangor')
+        property_obj.refresh_from_db()
+        self.assertEqual(str(property_obj.latitude), '3.073281')
+
+    def test_addresses_not_found_are_cached(self):
+        property_obj = self.create_property('Nowhere Street')
+        property_obj.refresh_from_db()
+        self.assertIsNone(property_obj.latitude)
+        entry = GeocodeCache.objects.get()
+        self.assertIsNone(entry.coordinates)
+        with mock.patch.object(geocoding.StaticProvider, 'geocode') as geocode:
+            self.create_property('nowhere street', title='Again')
+        geocode.assert_not_called()
+
+    def test_changing_the_address_geocodes_it_again(self):
+        property_obj = self.create_property('Nowhere Street')
+        with self.captureOnCommitCallbacks(execute=True):
+            property_obj.address = '1 Jalan Test, Kuala Lumpur'
+            property_obj.save()
+        property_obj.refresh_from_db()
+        self.assertEqual(str(property_obj.longitude), '101.686855')
+
+        # Unrelated edits keep the coordinates without any lookup
+        with mock.patch.object(geocoding, 'cached_lookup') as cached_lookup:
+            property_obj.title = 'Renamed'
+            property_obj.save()
+        cached_lookup.assert_not_called()
+
+    def test_detail_page_draws_the_map_from_stored_coordinates(self):
+        property_obj = self.create_property('1 Jalan Test, Kuala Lumpur')
+        response = self.client.get(reverse('users:property_detail', args=[property_obj.pk]))
+        self.assertContains(response, '[3.139003, 101.686855]')
+        self.assertNotContains(response, 'nominatim')
+
+    def test_geocode_properties_command_backfills_coordinates(self):
+        legacy, = Property.objects.bulk_create([Property(
+            house_type='House', title='Legacy', rent=500, address='1 Jalan Test, Kuala Lumpur', owner=self.owner,
+        )])
+        call_command('geocode_properties', stdout=io.StringIO())
+        legacy.refresh_from_db()
+        self.assertEqual(str(legacy.latitude), '3.139003')
+
+
+@override_settings(
+    GEOCODING_PROVIDER=OFFLINE_GEOCODER,
+    GEOCODING_STATIC_RESULTS={'UniKL MIIT': ('3.160500', '101.700800')},
+)
+class ProximitySearchTests(TestCase):
+    CAMPUS = (3.1605, 101.7008)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        # (title, km north of the campus, km east of the campus)
+        places = [('Next door', 0.3, 0), ('Walkable', 0, 1.5), ('Box corner', 1.6, 1.6), ('Far', 8, 0), ('Very far', 30, 0)]
+        cls.properties = {}
+        for title, north, east in places:
+            cls.properties[title] = Property.objects.create(
+                house_type='House', title=title, rent=500, address=f'{title} Road', owner=cls.owner,
+                latitude=round(cls.CAMPUS[0] + north / geo.KM_PER_DEGREE_LATITUDE, 6),
+                longitude=round(cls.CAMPUS[1] + east / (geo.KM_PER_DEGREE_LATITUDE * 0.9985), 6),
+            )
+        Property.objects.create(house_type='House', title='Not geocoded', rent=500, address='Unknown', owner=cls.owner)
+
+    def test_haversine(self):
+        # Kuala Lumpur to Shah Alam, about 19 km
+        self.assertAlmostEqual(geo.haversine_km(3.139003, 101.686855, 3.073281, 101.518461), 19.99, delta=0.3)
+
+    def test_within_radius_is_sorted_by_distance_and_excludes_box_corners(self):
+        found = list(geo.within_radius(Property.objects.all(), *self.CAMPUS, radius_km=2))
+        self.assertEqual([p.title for p in found], ['Next door', 'Walkable'])
+        for property_obj in found:
+            self.assertAlmostEqual(
+                property_obj.distance_km,
+                geo.haversine_km(*self.CAMPUS, property_obj.latitude, property_obj.longitude), places=3,
+            )
+
+    def test_within_radius_prefilters_on_the_indexed_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(geo.within_radius(Property.objects.all(), *self.CAMPUS, radius_km=2))
+        sql = queries[0]['sql']
+        self.assertIn('"latitude" >=', sql)
+        self.assertIn('"longitude" <=', sql)
+
+    def test_nearest_widens_the_search_until_enough_are_found(self):
+        found = geo.nearest(Property.objects.all(), *self.CAMPUS, count=4)
+        self.assertEqual([p.title for p in found], ['Next door', 'Walkable', 'Box corner', 'Far'])
+        self.assertEqual(len(geo.nearest(Property.objects.all(), *self.CAMPUS, count=10, max_radius_km=10)), 4)
+
+    def test_api_returns_the_nearest_listings(self):
+        url = reverse('users:property_list_api')
+        response = self.client.get(url, {'near': 'UniKL MIIT', 'nearest': '3'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([result['title'] for result in data['results']], ['Next door', 'Walkable', 'Box corner'])
+        self.assertEqual(data['results'][0]['distance_km'], 0.3)
+        self.assertEqual((data['count'], data['has_next']), (3, False))
+
+        # Beyond the default radius of a plain location search, within the given radius
+        data = self.client.get(url, {'lat': self.CAMPUS[0], 'lng': self.CAMPUS[1], 'nearest': '10'}).json()
+        self.assertEqual(len(data['results']), 5)
+        data = self.client.get(url, {'lat': self.CAMPUS[0], 'lng': self.CAMPUS[1], 'nearest': '10', 'radius': '10'}).json()
+        self.assertEqual([result['title'] for result in data['results']][-1], 'Far')
+
+        response = self.client.get(url, {'nearest': '3'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bounding_box_near_the_antimeridian_drops_longitude_bounds(self):
+        self.assertEqual(geo.bounding_box(10, 179.99, 5)[2:], (None, None))
+
+    def test_home_page_near_a_place(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('users:home'), {'near': 'unikl miit', 'radius': '10'})
+        self.assertEqual([p.title for p in response.context['properties']], ['Next door', 'Walkable', 'Box corner', 'Far'])
+        self.assertContains(response, '0.3 km away')
+
+    def test_home_page_reports_unknown_places(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('users:home'), {'near': 'Atlantis'})
+        self.assertContains(response, "Could not find")
+        self.assertEqual(len(response.context['properties']), 6)
+
+    def test_non_finite_radius_falls_back_to_the_default(self):
+        self.client.force_login(self.owner)
+        for radius in ('nan', 'inf', '-inf'):
+            response = self.client.get(reverse('users:home'), {'lat': self.CAMPUS[0], 'lng': self.CAMPUS[1], 'radius': radius})
+            self.assertEqual(response.status_code, 200, radius)
+            self.assertEqual(response.context['view'].get_search_radius(), geo.DEFAULT_RADIUS_KM)
+            response = self.client.get(reverse('users:property_list_api'), {'lat': self.CAMPUS[0], 'lng': self.CAMPUS[1], 'radius': radius})
+            self.assertEqual(response.status_code, 200, radius)
+
+    def test_search_places_are_cached_normalized_and_only_when_found(self):
+        with mock.patch.object(geocoding.StaticProvider, 'geocode', autospec=True,
+                               side_effect=geocoding.StaticProvider.geocode) as geocode:
+            self.assertEqual(geocoding.geocode_search('  UniKL   MIIT '), (Decimal('3.160500'), Decimal('101.700800')))
+            self.assertEqual(geocoding.geocode_search('unikl miit'), (Decimal('3.160500'), Decimal('101.700800')))
+            self.assertIsNone(geocoding.geocode_search('Atlantis'))
+            self.assertIsNone(geocoding.geocode_search('Atlantis'))
+            self.assertIsNone(geocoding.geocode_search('x' * 300)) # Not sent to the provider
+            self.assertIsNone(geocoding.geocode_search(' ,. '))
+        self.assertEqual(geocode.call_count, 3) # unikl miit once, Atlantis twice (not cached)
+        self.assertEqual(geocode.call_args.kwargs, {'timeout': 2, 'wait': False})
+        self.assertEqual(list(GeocodeCache.objects.values_list('address', flat=True)), ['unikl miit'])
+
+    def test_busy_provider_does_not_hold_up_the_search(self):
+        self.client.force_login(self.owner)
+        with mock.patch.object(geocoding.StaticProvider, 'geocode', side_effect=geocoding.GeocodingError('busy')):
+            response = self.client.get(reverse('users:home'), {'near': 'Cyberjaya'})
+        self.assertContains(response, "Location search is temporarily unavailable.")
+
+    @override_settings(GEOCODING_MIN_INTERVAL=60)
+    def test_nominatim_refuses_to_wait_for_its_rate_limit(self):
+        geocoding.NominatimProvider._last_request = time.monotonic()
+        try:
+            with mock.patch('urllib.request.urlopen') as urlopen:
+                with self.assertRaises(geocoding.GeocodingError):
+                    geocoding.NominatimProvider().geocode('cyberjaya', wait=False)
+            urlopen.assert_not_called()
+        finally:
+            geocoding.NominatimProvider._last_request = 0.0
+
+
+class FacetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.wifi = Amenity.objects.create(name='WiFi')
+        cls.parking = Amenity.objects.create(name='Parking')
+        listings = [
+            # (house_type, bedrooms, rent, amenities)
+            ('House', 3, 900, [cls.wifi, cls.parking]),
+            ('House', 2, 450, [cls.wifi]),
+            ('Apartment', 2, 700, [cls.parking]),
+            ('Apartment', 1, 1500, []),
+        ]
+        for i, (house_type, bedrooms, rent, amenities) in enumerate(listings):
+            property_obj = Property.objects.create(
+                house_type=house_type, title=f'Listing {i}', rent=rent, address=f'{i} Jalan Test', owner=cls.owner,
+                bedrooms=bedrooms, total_room=bedrooms + 2, gender_preferred='male',
+                latitude=Decimal('3.160500') + Decimal(i) / 1000, longitude=Decimal('101.700800'),
+            )
+            property_obj.amenities.set(amenities)
+
+    def counts(self, **params):
+        query = QueryDict(mutable=True)
+        for key, value in params.items():
+            query.setlist(key, value if isinstance(value, list) else [value])
+        return {
+            facet['name']: {option['value']: option['count'] for option in facet['options']}
+            for facet in facets.facet_counts(Property.objects.all(), query)
+        }
+
+    def test_counts_without_a_selection(self):
+        counts = self.counts()
+        self.assertEqual(counts['house_type'], {'Condominium': 0, 'House': 2, 'Apartment': 2, 'Studio': 0})
+        self.assertEqual(counts['bedrooms'], {'1': 1, '2': 2, '3': 1, '4+': 0})
+        self.assertEqual(counts['rent_band'], {'0-500': 1, '500-800': 1, '800-1200': 1, '1200+': 1})
+        self.assertEqual(counts['amenities'], {str(self.parking.pk): 2, str(self.wifi.pk): 2})
+
+    def test_a_facet_is_counted_with_the_other_facets_applied(self):
+        counts = self.counts(house_type='House')
+        # Alternatives of the selected facet keep their counts...
+        self.assertEqual(counts['house_type']['Apartment'], 2)
+        # ...other facets only count houses
+        self.assertEqual(counts['bedrooms'], {'1': 0, '2': 1, '3': 1, '4+': 0})
+        # Amenities are required together: WiFi *and* Parking
+        counts = self.counts(amenities=str(self.wifi.pk))
+        self.assertEqual(counts['amenities'], {str(self.parking.pk): 1, str(self.wifi.pk): 2})
+
+    def test_all_counts_come_from_one_query(self):
+        facet_list = facets.get_facets()
+        for facet in facet_list:
+            facet.options() # Loads the amenities
+        query = QueryDict('house_type=House&bedrooms=2&bedrooms=3&amenities=%d' % self.wifi.pk)
+        with self.assertNumQueries(1):
+            facets.facet_counts(Property.objects.all(), query, facet_list)
+
+    def test_home_page_applies_facets_and_range_filters(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('users:home'), {'house_type': ['House', 'Apartment'], 'bedrooms': '2', 'max_rent': '800'})
+        self.assertEqual(sorted(p.title for p in response.context['properties']), ['Listing 1', 'Listing 2'])
+        response = self.client.get(reverse('users:home'), {'room_count': '5', 'amenities': [self.wifi.pk, self.parking.pk]})
+        self.assertEqual([p.title for p in response.context['properties']], ['Listing 0'])
+        self.assertContains(response, 'name="amenities" value="%d" checked' % self.wifi.pk)
+
+    @override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER)
+    def test_facets_combine_with_proximity_search(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('users:home'), {'lat': '3.1605', 'lng': '101.7008', 'radius': '0.25', 'house_type': 'House'})
+        self.assertEqual([p.title for p in response.context['properties']], ['Listing 0', 'Listing 1'])
+        self.assertEqual(response.context['facets']['house_type']['options'][2]['count'], 1) # Apartment within 250 m
+
+
+class AmenityMaskTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.wifi, cls.aircon, cls.parking = [Amenity.objects.create(name=name) for name in ('WiFi', 'Aircon', 'Parking')]
+
+    def create_property(self, title, amenity_list):
+        property_obj = Property.objects.create(house_type='House', title=title, rent=500, address='1 Jalan Test', owner=self.owner)
+        property_obj.amenities.set(amenity_list)
+        return property_obj
+
+    def mask(self, property_obj):
+        return Property.objects.get(pk=property_obj.pk).amenity_mask
+
+    def test_bits_are_assigned_and_reused(self):
+        self.assertEqual([self.wifi.bit, self.aircon.bit, self.parking.bit], [0, 1, 2])
+        self.aircon.delete()
+        self.assertEqual(Amenity.objects.create(name='Gym').bit, 1)
+
+    def test_mask_follows_amenity_changes(self):
+        property_obj = self.create_property('A', [self.wifi, self.parking])
+        self.assertEqual(self.mask(property_obj), 0b101)
+        property_obj.amenities.remove(self.wifi)
+        self.assertEqual(self.mask(property_obj), 0b100)
+        self.aircon.properties.add(property_obj) # Reverse side
+        self.assertEqual(self.mask(property_obj), 0b110)
+        self.parking.properties.clear()
+        self.assertEqual(self.mask(property_obj), 0b010)
+        self.aircon.delete()
+        self.assertEqual(self.mask(property_obj), 0)
+
+    def test_condition_matches_the_join(self):
+        self.create_property('All', [self.wifi, self.aircon, self.parking])
+        self.create_property('WiFi and parking', [self.wifi, self.parking])
+        self.create_property('Aircon', [self.aircon])
+        self.create_property('None', [])
+        for ids, match_all in (([self.wifi.pk, self.parking.pk], True), ([self.wifi.pk, self.aircon.pk], False)):
+            with self.assertNumQueries(2): # The bits, then the properties
+                masked = set(Property.objects.filter(amenities.amenities_condition(ids, match_all)).values_list('title', flat=True))
+            joined = Property.objects.filter(amenities__in=ids).annotate(
+                matched=Count('amenities', filter=Q(amenities__in=ids), distinct=True)
+            ).filter(matched__gte=len(ids) if match_all else 1)
+            self.assertEqual(masked, set(joined.values_list('title', flat=True)))
+
+    def test_amenities_without_a_bit_use_the_join(self):
+        Amenity.objects.filter(pk=self.parking.pk).update(bit=None)
+        self.create_property('WiFi and parking', [self.wifi, self.parking])
+        self.create_property('WiFi', [self.wifi])
+        condition = amenities.amenities_condition([self.wifi.pk, self.parking.pk])
+        self.assertEqual(list(Property.objects.filter(condition).values_list('title', flat=True)), ['WiFi and parking'])
+
+    def test_refresh_repairs_drifted_masks(self):
+        property_obj = self.create_property('A', [self.wifi])
+        Property.objects.filter(pk=property_obj.pk).update(amenity_mask=0b111)
+        self.assertEqual(Property.objects.refresh_amenity_masks(), 1)
+        self.assertEqual(self.mask(property_obj), 0b001)
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        created_at = timezone.now()
+        for i in range(30):
+            property_obj = Property.objects.create(
+                house_type='House', title=f'Room {i}', rent=500, address=f'{i} Jalan Test', owner=cls.owner,
+                latitude=Decimal('3.160500') + Decimal(i % 5) / 1000, longitude=Decimal('101.700800'),
+            )
+        # Ties on created_at are broken by the primary key
+        Property.objects.filter(pk__lte=property_obj.pk - 10).update(created_at=created_at)
+        search.rebuild_index()
+
+    def all_pages(self, queryset, per_page=7):
+        pages, cursor = [], None
+        while True:
+            page = pagination.keyset_page(queryset, per_page, cursor)
+            pages.append([p.pk for p in page])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_pages_follow_the_ordering_without_gaps_or_repeats(self):
+        for queryset in (
+            Property.objects.order_by('-created_at', '-pk'),
+            search.search_properties(Property.objects.all(), 'room'),
+            geo.within_radius(Property.objects.all(), 3.1605, 101.7008, radius_km=5),
+        ):
+            pages = self.all_pages(queryset)
+            self.assertEqual([len(page) for page in pages], [7, 7, 7, 7, 2])
+            expected = list(pagination.keyset_page(queryset, 100).object_list)
+            self.assertEqual([pk for page in pages for pk in page], [p.pk for p in expected])
+
+    def test_deep_pages_cost_one_query(self):
+        queryset = Property.objects.order_by('-created_at', '-pk')
+        cursor = pagination.keyset_page(queryset, 25).next_cursor
+        with self.assertNumQueries(1):
+            page = pagination.keyset_page(queryset, 25, cursor)
+        self.assertEqual(len(page), 5)
+        self.assertFalse(page.has_next)
+
+    def test_invalid_cursors(self):
+        queryset = Property.objects.order_by('-created_at', '-pk')
+        for cursor in ('not a cursor', pagination.encode_cursor([1]), pagination.encode_cursor(['x', 1])):
+            with self.assertRaises(pagination.InvalidCursor):
+                pagination.keyset_page(queryset, 10, cursor)
+        response = self.client.get(reverse('users:home'), {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_approximate_count_is_capped(self):
+        self.assertEqual(pagination.approximate_count(Property.objects.all(), cap=10), (10, False))
+        self.assertEqual(pagination.approximate_count(Property.objects.all(), cap=100), (30, True))
+
+    def test_home_page_links_the_next_cursor(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('users:home'), {'house_type': 'House'})
+        self.assertIsNone(response.context['page_obj'])
+        self.assertEqual(response.context['result_count'], 30)
+        next_cursor = response.context['next_cursor']
+        self.assertContains(response, f'href="?cursor={next_cursor}&house_type=House"')
+
+        response = self.client.get(reverse('users:home'), {'house_type': 'House', 'cursor': next_cursor})
+        self.assertEqual(len(response.context['properties']), 12)
+        self.assertNotIn('result_count', response.context)
+
+        # Numbered pages still work
+        response = self.client.get(reverse('users:home'), {'page': 3})
+        self.assertEqual(response.context['page_obj'].number, 3)
+        self.assertEqual(len(response.context['properties']), 6)
+
+    def test_api_pages_through_all_listings(self):
+        url = reverse('users:property_list_api')
+        data = self.client.get(url).json()
+        self.assertEqual((data['count'], data['count_exact']), (30, True))
+        ids = [result['id'] for result in data['results']]
+        while data['has_next']:
+            data = self.client.get(url, {'cursor': data['next_cursor']}).json()
+            self.assertNotIn('count', data)
+            ids += [result['id'] for result in data['results']]
+        self.assertEqual(ids, list(Property.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)))
+        self.assertEqual(self.client.get(url, {'cursor': 'bad'}).status_code, 400)
+
+
+class SeedBenchTests(TestCase):
+    VOLUMES = {
+        'students': 30, 'owners': 4, 'properties': 25, 'amenities': 5, 'bookings': 40,
+        'messages': 120, 'maintenance': 10, 'payments': 10,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.counts = seeding.DatasetBuilder(volumes=cls.VOLUMES, batch_size=16).build()
+
+    def test_volumes(self):
+        self.assertEqual(self.counts, self.VOLUMES)
+        self.assertEqual(Property.objects.count(), 25)
+        self.assertEqual(ChatMessage.objects.count(), 120)
+        # One active booking per student at most, as the booking form enforces
+        self.assertFalse(
+            Booking.objects.filter(status__in=['pending', 'confirmed']).values('tenant').annotate(n=Count('pk')).filter(n__gt=1).exists()
+        )
+
+    def test_derived_data_is_rebuilt(self):
+        self.assertEqual(Property.objects.recompute_booking_counters(dry_run=True), [])
+        self.assertEqual(Property.objects.refresh_amenity_masks(), 0)
+        pairs = {
+            (m.property_id, *sorted([m.sender_id, m.receiver_id])) for m in ChatMessage.objects.all()
+        }
+        self.assertEqual(Conversation.objects.count(), len(pairs))
+        self.assertEqual(
+            sum(c.unread_a + c.unread_b for c in Conversation.objects.all()),
+            ChatMessage.objects.filter(is_read=False).count(),
+        )
+        self.assertTrue(search.search_properties(Property.objects.all(), 'jalan').exists())
+
+    def test_clear_dataset(self):
+        self.assertEqual(seeding.clear_dataset('bench'), 34)
+        self.assertFalse(Property.objects.exists())
+        self.assertFalse(PaymentRecord.objects.exists())
+
+    def test_benchmark_report(self):
+        names = [scenario.name for scenario in benchmark.get_scenarios() if scenario.name != 'receipt pdf']
+        report = benchmark.run_benchmark(repeat=2, warmup=1, only=names)
+        self.assertEqual(set(report['results']), set(names))
+        self.assertIn('owner dashboard', report['results'])
+        for name, result in report['results'].items():
+            self.assertEqual(result['status'], 200, name)
+            self.assertLessEqual(result['p50_ms'], result['max_ms'])
+        self.assertEqual(report['dataset']['property'], 25)
+
+        rows = benchmark.compare_reports(report, report)
+        self.assertEqual(len(rows), len(names))
+        self.assertTrue(all(row[3] == 0 for row in rows))
+
+
+class RequestInstrumentationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'pw', role='admin', is_staff=True)
+        for i in range(6):
+            Property.objects.create(house_type='House', title=f'Room {i}', rent=500, address=f'{i} Jalan Test', owner=cls.owner)
+
+    def setUp(self):
+        instrumentation.stats.reset()
+
+    def test_fingerprint_groups_in_lists(self):
+        self.assertEqual(
+            instrumentation.fingerprint('SELECT * FROM "t"\n WHERE "id" IN (%s, %s, %s)'),
+            instrumentation.fingerprint('SELECT * FROM "t" WHERE "id" IN (%s)'),
+        )
+
+    def test_capture_reports_repeated_queries(self):
+        with instrumentation.capture() as record:
+            owners = [p.owner.username for p in Property.objects.all()] # One query per property
+        self.assertEqual(record.query_count, 7)
+        [(sql, count)] = record.duplicates(threshold=3)
+        self.assertEqual(count, 6)
+        self.assertIn('"users"', sql)
+
+    @override_settings(REQUEST_SAMPLE_RATE=1.0)
+    def test_sampled_requests_record_queries_and_templates(self):
+        self.client.force_login(self.owner)
+        with self.assertLogs('renthouse.requests', 'INFO') as logs:
+            self.client.get(reverse('users:home'))
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line['view'], line['status']), ('users:home', 200))
+        self.assertGreater(line['queries'], 0)
+        self.assertGreater(line['template_ms'], 0)
+
+        home = instrumentation.stats.summary()['users:home']
+        self.assertEqual((home['requests'], home['sampled']), (1, 1))
+        self.assertEqual(home['max_queries'], line['queries'])
+
+    @override_settings(REQUEST_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_only_timed(self):
+        with self.assertLogs('renthouse.requests', 'INFO') as logs:
+            self.client.get(reverse('users:property_detail', kwargs={'pk': Property.objects.first().pk}))
+        self.assertNotIn('queries', json.loads(logs.records[-1].getMessage()))
+        detail = instrumentation.stats.summary()['users:property_detail']
+        self.assertEqual((detail['requests'], detail['sampled'], detail['avg_queries']), (1, 0, None))
+
+    def test_only_slow_requests_are_logged_by_default(self):
+        self.assertEqual(settings.LOGGING['loggers']['renthouse.requests']['level'], os.environ.get('RENTHOUSE_REQUEST_LOG_LEVEL', 'WARNING'))
+        logger = instrumentation.request_logger
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.WARNING)
+        url = reverse('users:property_detail', kwargs={'pk': Property.objects.first().pk})
+        with mock.patch.object(logger, 'handle') as handle:
+            self.client.get(url)
+            handle.assert_not_called()
+            with override_settings(SLOW_REQUEST_MS=0):
+                self.client.get(url)
+        [(record,), _] = handle.call_args
+        self.assertEqual(record.levelno, logging.WARNING)
+        self.assertEqual(json.loads(record.getMessage())['view'], 'users:property_detail')
+
+    @override_settings(REQUEST_SAMPLE_RATE=1.0, SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged_without_parameters(self):
+        with self.assertLogs('renthouse.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('users:home'), {'q': 'secret-search'})
+        self.assertTrue(logs.records)
+        self.assertNotIn('secret-search', ''.join(record.getMessage() for record in logs.records))
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(reverse('users:request_stats')).status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('users:request_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('users:request_stats', response.json()['views'] | instrumentation.stats.summary())
+
+
+def metric_value(sample, **labels):
+    """
+    Value of one sample in the /metrics output (0 if absent). Labels in rendered order: sorted, "le" last.
+    """
+    wanted = sample + ('{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}' if labels else '')
+    for line in metrics.render().splitlines():
+        if line.startswith(wanted + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+
+class MetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        cls.staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'pw', role='admin', is_staff=True)
+        cls.property = Property.objects.create(house_type='House', title='Room', rent=500, address='1 Jalan Test', owner=cls.owner)
+
+    def test_booking_and_chat_counters(self):
+        created = metric_value('renthouse_bookings_total', event='created')
+        confirmed = metric_value('renthouse_bookings_total', event='confirmed')
+        sent = metric_value('renthouse_chat_messages_total')
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = Booking.objects.create(property=self.property, tenant=self.tenant, start_date=date.today())
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'confirmed'
+            booking.save()
+            booking.save() # No transition
+            ChatMessage.objects.create(sender=self.tenant, receiver=self.owner, property=self.property, message='Hi')
+        self.assertEqual(metric_value('renthouse_bookings_total', event='created'), created + 1)
+        self.assertEqual(metric_value('renthouse_bookings_total', event='confirmed'), confirmed + 1)
+        self.assertEqual(metric_value('renthouse_chat_messages_total'), sent + 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_histogram_seconds', "Test.", ['kind'], buckets=[0.1, 1])
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value, kind='a')
+        self.assertEqual(metric_value('test_histogram_seconds_bucket', kind='a', le='0.1'), 1)
+        self.assertEqual(metric_value('test_histogram_seconds_bucket', kind='a', le='1'), 3)
+        self.assertEqual(metric_value('test_histogram_seconds_bucket', kind='a', le='+Inf'), 4)
+        self.assertEqual(metric_value('test_histogram_seconds_count', kind='a'), 4)
+        self.assertAlmostEqual(metric_value('test_histogram_seconds_sum', kind='a'), 4.25)
+        with self.assertRaises(ValueError):
+            histogram.observe(1, other='b')
+
+    @skipUnless(hasattr(os, 'fork'), "Needs os.fork()")
+    def test_worker_processes_are_added_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_DIR=directory):
+            metrics.payments.inc(2)
+            pid = os.fork()
+            if pid == 0: # A forked worker counts in its own file
+                try:
+                    metrics.payments.inc(5)
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertEqual(metric_value('renthouse_payments_total'), 7)
+            for _ in range(2000): # Grows the file past its initial size
+                metrics.cache_requests.inc(cache=f'cache-{_ % 500}', result='hit')
+            self.assertEqual(metric_value('renthouse_cache_requests_total', cache='cache-7', result='hit'), 4)
+
+    def test_endpoint(self):
+        self.client.force_login(self.owner)
+        self.client.get(reverse('users:home'))
+        response = self.client.get(reverse('users:metrics'))
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertContains(response, 'renthouse_http_request_duration_seconds_bucket{view="users:home",le="+Inf"}')
+        self.assertContains(response, '# TYPE renthouse_bookings_total counter')
+
+        self.assertEqual(self.client.get(reverse('users:metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('users:metrics'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_listing_page_cache_hits(self):
+        hits = metric_value('renthouse_cache_requests_total', cache='listing_page', result='hit')
+        misses = metric_value('renthouse_cache_requests_total', cache='listing_page', result='miss')
+        self.client.get(reverse('users:home'), {'q': 'metrics'})
+        self.client.get(reverse('users:home'), {'q': 'metrics'})
+        self.assertEqual(metric_value('renthouse_cache_requests_total', cache='listing_page', result='miss'), misses + 1)
+        self.assertEqual(metric_value('renthouse_cache_requests_total', cache='listing_page', result='hit'), hits + 1)
+
+
+class AdminChangelistTests(TestCase):
+    VOLUMES = {
+        'students': 12, 'owners': 3, 'properties': 10, 'amenities': 5, 'bookings': 12,
+        'messages': 40, 'maintenance': 6, 'payments': 6,
+    }
+    CHANGELISTS = ('property', 'booking', 'chatmessage', 'maintenancerequest', 'paymentrecord', 'conversation')
+
+    @classmethod
+    def setUpTestData(cls):
+        seeding.DatasetBuilder(volumes=cls.VOLUMES, batch_size=16).build()
+        cls.admin = CustomUser.objects.create_superuser('root', 'root@example.com', 'pw')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, model_name, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:users_{model_name}_changelist'), params or {})
+        self.assertEqual(response.status_code, 200, model_name)
+        return response, len(queries)
+
+    def test_queries_do_not_grow_with_the_tables(self):
+        before = {name: self.changelist_queries(name)[1] for name in self.CHANGELISTS}
+        seeding.DatasetBuilder(tag='more', volumes=self.VOLUMES, batch_size=16).build()
+        after = {name: self.changelist_queries(name)[1] for name in self.CHANGELISTS}
+        self.assertEqual(after, before)
+
+    def test_foreign_key_filters_use_the_autocomplete(self):
+        owner = CustomUser.objects.filter(role='owner').first()
+        other_owner = CustomUser.objects.filter(role='owner').exclude(pk=owner.pk).first()
+        response, _ = self.changelist_queries('property', {'owner__id__exact': owner.pk})
+        self.assertEqual(
+            {p.owner_id for p in response.context['cl'].result_list}, {owner.pk},
+        )
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertContains(response, f'<option value="{owner.pk}" selected>{owner.username}</option>', html=True)
+        self.assertNotContains(response, f'>{other_owner.username}</option>') # Owners are not listed
+        self.assertContains(response, 'js/admin_autocomplete_filter.js')
+
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'users', 'model_name': 'property', 'field_name': 'owner', 'term': owner.username,
+        })
+        self.assertIn(str(owner.pk), [result['id'] for result in response.json()['results']])
+
+    def test_nullable_filter_offers_empty_choice(self):
+        response, _ = self.changelist_queries('paymentrecord', {'user__isnull': 'True'})
+        self.assertEqual(len(response.context['cl'].result_list), PaymentRecord.objects.filter(user__isnull=True).count())
+
+    def test_estimated_count(self):
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=100), \
+                mock.patch.object(pagination, 'estimated_row_count', return_value=5000):
+            response, _ = self.changelist_queries('chatmessage')
+            self.assertEqual(response.context['cl'].result_count, 5000)
+            # A page past the real rows of an overestimate is empty, not an error
+            response, _ = self.changelist_queries('chatmessage', {'p': 3})
+            self.assertEqual(len(response.context['cl'].result_list), 0)
+        response, _ = self.changelist_queries('chatmessage')
+        self.assertEqual(response.context['cl'].result_count, ChatMessage.objects.count())
+        self.assertIsNone(response.context['cl'].full_result_count)
+
+
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER, PROPERTY_SEARCH_BACKEND='terms')
+class PropertySearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.title_match = cls.create_property('Cozy Room', description='Quiet street.')
+        cls.description_match = cls.create_property('Family House', description='One cozy room with a desk.')
+        cls.other = cls.create_property('Studio Apartment', description='Near the campus.')
+
+    @classmethod
+    def create_property(cls, title, description='', address='1 Jalan Test'):
+        return Property.objects.create(
+            house_type='House', title=title, description=description, rent=500, address=address, owner=cls.owner,
+        )
+
+    def search(self, query):
+        return list(search.search_properties(Property.objects.all(), query))
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('The COZY room, near UiTM-Shah Alam!'), ['cozy', 'room', 'uitm', 'shah', 'alam'])
+        self.assertEqual(search.tokenize('a b 1 and of'), [])
+        self.assertEqual(search.tokenize(None), [])
+        self.assertEqual(search.tokenize('x' * 100), ['x' * search.MAX_TERM_LENGTH])
+
+    def test_saving_a_property_reindexes_it(self):
+        self.assertEqual(self.search('studio'), [self.other])
+        self.other.title = 'Penthouse'
+        self.other.save()
+        self.assertEqual(self.search('studio'), [])
+        self.assertEqual(self.search('penthouse'), [self.other])
+        self.assertEqual(dict(self.other.search_terms.values_list('term', 'weight'))['penthouse'], search.SEARCH_FIELD_WEIGHTS['title'])
+
+    def test_rebuild_index(self):
+        PropertySearchTerm.objects.all().delete()
+        self.assertEqual(self.search('cozy'), [])
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn("Indexed 3 properties.", out.getvalue())
+        self.assertEqual(len(self.search('cozy')), 2)
+        self.assertEqual(PropertySearchTerm.objects.values('property').distinct().count(), 3)
+
+    def test_ranking_follows_the_matched_weight(self):
+        # Both match every term; the title hits weigh more than the description hits
+        results = self.search('cozy room')
+        self.assertEqual(results, [self.title_match, self.description_match])
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+
+    def test_every_term_has_to_match(self):
+        self.assertEqual(self.search('cozy desk'), [self.description_match])
+        self.assertEqual(self.search('cozy campus'), [])
+        # The last term is a prefix: results show up while typing
+        self.assertEqual(self.search('family hou'), [self.description_match])
+        self.assertEqual(self.search('hou family'), [])
+
+    def test_one_term_can_match_several_tokens(self):
+        # "room" is both the whole first token and a match for the prefix "roo"
+        self.assertEqual(self.search('room roo'), [self.title_match, self.description_match])
+        self.assertEqual(self.search('cozy cozy'), [self.title_match, self.description_match])
+        self.assertEqual(self.search('studio stu'), [self.other])
+
+    def test_empty_query_keeps_the_queryset(self):
+        queryset = Property.objects.order_by('pk')
+        for query in ('', '   ', 'the of and', '!!'):
+            self.assertIs(search.search_properties(queryset, query), queryset)
+
+    def test_backend_selection(self):
+        with override_settings(PROPERTY_SEARCH_BACKEND='auto'):
+            self.assertEqual(search.get_backend(), 'fulltext' if connection.vendor == 'mysql' else 'terms')
+        with override_settings(PROPERTY_SEARCH_BACKEND='terms'):
+            self.assertEqual(search.get_backend(), 'terms')
+
+
+@skipUnless(connection.vendor == 'mysql', "MySQL FULLTEXT search")
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER, PROPERTY_SEARCH_BACKEND='fulltext')
+class FulltextSearchTests(TransactionTestCase):
+    """
+    InnoDB only adds committed rows to a FULLTEXT index, hence TransactionTestCase.
+    """
+
+    def test_fulltext_search(self):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cozy = Property.objects.create(house_type='House', title='Cozy Room', rent=500, address='1 Jalan Test', owner=owner)
+        Property.objects.create(house_type='House', title='Studio Apartment', rent=500, address='1 Jalan Test', owner=owner)
+        queryset = search.search_properties(Property.objects.all(), 'cozy roo')
+        self.assertIn('MATCH', str(queryset.query))
+        self.assertEqual(list(queryset), [cozy])
+        self.assertFalse(PropertySearchTerm.objects.exists())
+
+
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER)
+class ConversationSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        cls.other_tenant = CustomUser.objects.create_user('other', 'other@example.com', 'pw', role='student')
+        cls.property = Property.objects.create(
+            house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=cls.owner,
+        )
+
+    def send(self, sender, receiver, text='Hello', property_obj=None):
+        return ChatMessage.objects.create(sender=sender, receiver=receiver, property=property_obj or self.property, message=text)
+
+    def conversation(self, user=None):
+        return Conversation.objects.get(
+            property=self.property, participant_a=min(self.owner, user or self.tenant, key=lambda u: u.pk),
+            participant_b=max(self.owner, user or self.tenant, key=lambda u: u.pk),
+        )
+
+    def test_first_message_creates_the_summary(self):
+        message = self.send(self.tenant, self.owner)
+        conversation = self.conversation()
+        self.assertEqual(conversation.last_message, message)
+        self.assertEqual(conversation.last_message_at, message.timestamp)
+        self.assertEqual(conversation.unread_count_for(self.owner), 1)
+        self.assertEqual(conversation.unread_count_for(self.tenant), 0)
+        self.assertEqual(conversation.other_participant(self.owner), self.tenant)
+
+    def test_messages_update_one_summary_row(self):
+        self.send(self.tenant, self.owner)
+        self.send(self.tenant, self.owner)
+        reply = self.send(self.owner, self.tenant, 'Hi')
+        self.assertEqual(Conversation.objects.count(), 1)
+        conversation = self.conversation()
+        self.assertEqual(conversation.last_message, reply)
+        self.assertEqual(conversation.unread_count_for(self.owner), 2)
+        self.assertEqual(conversation.unread_count_for(self.tenant), 1)
+
+    def test_self_chat_is_not_tracked(self):
+        self.send(self.owner, self.owner)
+        self.assertFalse(Conversation.objects.exists())
+
+    def test_mark_read_only_clears_the_readers_side(self):
+        self.send(self.tenant, self.owner)
+        self.send(self.tenant, self.owner)
+        self.send(self.owner, self.tenant)
+
+        Conversation.objects.mark_read(self.property, self.owner, self.tenant)
+        conversation = self.conversation()
+        self.assertEqual(conversation.unread_count_for(self.owner), 0)
+        self.assertEqual(conversation.unread_count_for(self.tenant), 1)
+        self.assertFalse(ChatMessage.objects.filter(receiver=self.owner, is_read=False).exists())
+        self.assertTrue(ChatMessage.objects.filter(receiver=self.tenant, is_read=False).exists())
+
+    def test_opening_the_chat_marks_it_read(self):
+        self.send(self.owner, self.tenant)
+        self.client.force_login(self.tenant)
+        response = self.client.get(reverse('users:chat_with_user', args=[self.property.pk, self.owner.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.conversation().unread_count_for(self.tenant), 0)
+
+    def test_for_user_lists_the_most_recent_first(self):
+        other_property = Property.objects.create(
+            house_type='House', title='Other House', rent=500, address='1 Jalan Test', owner=self.owner,
+        )
+        self.send(self.tenant, self.owner)
+        self.send(self.other_tenant, self.owner)
+        self.send(self.tenant, self.owner, property_obj=other_property)
+        self.send(self.owner, self.tenant) # Moves the first conversation back to the top
+
+        conversations = list(Conversation.objects.for_user(self.owner))
+        self.assertEqual(
+            [(c.property_id, c.other_participant(self.owner)) for c in conversations],
+            [(self.property.pk, self.tenant), (other_property.pk, self.tenant), (self.property.pk, self.other_tenant)],
+        )
+        self.assertEqual(len(Conversation.objects.for_user(self.tenant)), 2)
+        self.assertEqual(len(Conversation.objects.for_user(self.other_tenant)), 1)
+
+
+class QueryPlanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        Property.objects.bulk_create([
+            Property(
+                house_type='House', title=f'House {i}', rent=500, address=f'{i} Jalan Test', owner=cls.owner,
+                is_available=i % 3 != 0,
+            )
+            for i in range(6)
+        ])
+
+    def test_hot_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn("All hot queries use an index.", out.getvalue())
+        self.assertNotIn("FULL SCAN", out.getvalue())
+
+    def test_queries_are_explained_with_real_rows(self):
+        property_obj = Property.objects.order_by('pk').last()
+        Booking.objects.create(property=property_obj, tenant=self.tenant, start_date=date.today())
+        out = io.StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn(
+            f"Explaining with owner {self.owner.pk}, tenant {self.tenant.pk}, property {property_obj.pk}.", out.getvalue()
+        )
+
+    def test_sqlite_scans_through_an_index_are_full_scans(self):
+        full_scans = [
+            '2 0 0 SCAN users_property',
+            '3 0 0 SCAN users_property USING INDEX property_available_recent_idx',
+            '3 0 0 SCAN users_booking USING COVERING INDEX booking_tenant_status_idx',
+        ]
+        for line in full_scans:
+            self.assertEqual(check_query_plans.SQLITE_FULL_SCAN_RE.search(line).group(1), line.split()[4])
+        for line in ['5 0 0 SEARCH users_property USING INDEX property_available_recent_idx (is_available=?)',
+                     '37 0 0 USE TEMP B-TREE FOR ORDER BY', '2 0 0 SCAN CONSTANT ROW']:
+            self.assertIsNone(check_query_plans.SQLITE_FULL_SCAN_RE.search(line))
+
+    def test_available_listings(self):
+        self.assertEqual(
+            list(Property.objects.available().order_by('pk').values_list('pk', flat=True)),
+            list(Property.objects.filter(is_available=True).order_by('pk').values_list('pk', flat=True)),
+        )
+        self.assertEqual(Property.objects.available().count(), 4)
+
+
+@override_settings(GEOCODING_PROVIDER=OFFLINE_GEOCODER)
+class ChatHistoryPagingTests(TestCase):
+    MESSAGES = 2 * views.CHAT_PAGE_SIZE + 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        cls.other_tenant = CustomUser.objects.create_user('other', 'other@example.com', 'pw', role='student')
+        cls.property = Property.objects.create(
+            house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=cls.owner,
+        )
+        start = timezone.now() - timedelta(days=1)
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(
+                sender=cls.tenant if i % 2 else cls.owner, receiver=cls.owner if i % 2 else cls.tenant,
+                property=cls.property, message=f'Message {i}',
+            )
+            for i in range(cls.MESSAGES)
+        ])
+        # Runs of 7 messages share a timestamp, so page boundaries fall inside ties
+        for i, message in enumerate(messages):
+            ChatMessage.objects.filter(pk=message.pk).update(timestamp=start + timedelta(seconds=i // 7))
+        ChatMessage.objects.create(sender=cls.other_tenant, receiver=cls.owner, property=cls.property, message='Not yours')
+
+    def history_url(self, property_pk=None, other_user_pk=None):
+        return reverse('users:chat_history_api', args=[property_pk or self.property.pk, other_user_pk or self.owner.pk])
+
+    def expected_ids(self):
+        return list(
+            ChatMessage.objects.filter(property=self.property).exclude(sender=self.other_tenant)
+            .order_by('timestamp', 'pk').values_list('pk', flat=True)
+        )
+
+    def test_paging_back_returns_every_message_once(self):
+        newest, has_more = views.get_chat_page(self.property, self.tenant, self.owner)
+        self.assertEqual(len(newest), views.CHAT_PAGE_SIZE)
+        self.assertTrue(has_more)
+
+        self.client.force_login(self.tenant)
+        pages = [[message.pk for message in newest]]
+        cursor = views._encode_chat_cursor(newest[0])
+        while cursor:
+            data = self.client.get(self.history_url(), {'before': cursor}).json()
+            pages.insert(0, [message['id'] for message in data['messages']])
+            cursor = data['next_cursor']
+            self.assertEqual(bool(cursor), data['has_more'])
+
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual(ids, self.expected_ids())
+        self.assertEqual([len(page) for page in pages], [10, views.CHAT_PAGE_SIZE, views.CHAT_PAGE_SIZE])
+
+    def test_ties_are_broken_by_id(self):
+        messages = ChatMessage.objects.filter(property=self.property).exclude(sender=self.other_tenant).order_by('timestamp', 'pk')
+        middle = messages[3] # Inside the first run of equal timestamps
+        older, has_more = views.get_chat_page(self.property, self.tenant, self.owner, before=(middle.timestamp, middle.pk))
+        self.assertFalse(has_more)
+        self.assertEqual([message.pk for message in older], [message.pk for message in messages[:3]])
+
+    def test_invalid_cursor_is_refused(self):
+        self.client.force_login(self.tenant)
+        naive = timezone.now().replace(tzinfo=None).isoformat()
+        for cursor in ('bad', '2026-01-01T00:00:00+00:00|x', f'{naive}|1', '|'):
+            self.assertEqual(self.client.get(self.history_url(), {'before': cursor}).status_code, 400, cursor)
+
+    def test_outsiders_cannot_read_the_history(self):
+        self.client.force_login(self.tenant)
+        # A student cannot open a chat with another student, nor about a missing property
+        self.assertEqual(self.client.get(self.history_url(other_user_pk=self.other_tenant.pk)).status_code, 403)
+        self.assertEqual(self.client.get(self.history_url(property_pk=self.property.pk + 100)).status_code, 404)
+
+        other_owner = CustomUser.objects.create_user('other_owner', 'other_owner@example.com', 'pw', role='owner')
+        self.client.force_login(other_owner)
+        self.assertEqual(self.client.get(self.history_url(other_user_pk=self.tenant.pk)).status_code, 403)
+
+        # Another tenant of the same owner only sees their own conversation
+        self.client.force_login(self.other_tenant)
+        data = self.client.get(self.history_url()).json()
+        self.assertEqual([message['message'] for message in data['messages']], ['Not yours'])
+
+        self.client.logout()
+        self.assertEqual(self.client.get(self.history_url()).status_code, 302)
+
+
+class RecordingBroadcast(realtime.InMemoryBroadcast):
+    """
+    Broadcast layer of the websocket tests: delivers like the in-process one and remembers what was published.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, group, payload):
+        self.published.append((group, payload))
+        super().publish(group, payload)
+
+
+# Websocket code closes old database connections (like the request cycle), which would end
+# the transaction of a TestCase
+@override_settings(CHAT_BROADCAST_BACKEND='users.tests.RecordingBroadcast')
+class ChatWebsocketTests(TransactionTestCase):
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        self.other_owner = CustomUser.objects.create_user('other', 'other@example.com', 'pw', role='owner')
+        self.student = CustomUser.objects.create_user('student', 'student@example.com', 'pw', role='student')
+        self.property, = Property.objects.bulk_create([
+            Property(house_type='House', title='Chat House', rent=500, address='1 Jalan Chat', owner=self.owner),
+        ])
+        self.path = f'/ws/chat/{self.property.pk}/{self.owner.pk}/'
+
+    def scope(self, user=None, path=None):
+        headers = []
+        if user is not None:
+            self.client.force_login(user)
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'.encode()))
+        return {'type': 'websocket', 'path': path or self.path, 'headers': headers}
+
+    def run_socket(self, scope, conversation):
+        """
+        Runs chat_websocket with fake receive/send callables; `conversation(inbox, outbox)` drives the
+        client side. Returns the events sent by the server that the conversation did not read.
+        """
+        async def run():
+            inbox, outbox = asyncio.Queue(), asyncio.Queue()
+            await inbox.put({'type': 'websocket.connect'})
+            socket = asyncio.ensure_future(realtime.chat_websocket(scope, inbox.get, outbox.put))
+            await conversation(inbox, outbox)
+            await asyncio.wait_for(socket, 5)
+            return [outbox.get_nowait() for _ in range(outbox.qsize())]
+        return async_to_sync(run)()
+
+    def test_unauthorized_connections_are_closed(self):
+        async def nothing(inbox, outbox):
+            pass
+
+        for scope in (self.scope(), self.scope(self.other_owner, f'/ws/chat/{self.property.pk}/{self.student.pk}/')):
+            self.assertEqual(self.run_socket(scope, nothing), [{'type': 'websocket.close', 'code': realtime.CLOSE_FORBIDDEN}])
+        self.assertEqual(
+            self.run_socket(self.scope(self.student, f'/ws/chat/{self.property.pk + 1}/{self.owner.pk}/'), nothing),
+            [{'type': 'websocket.close', 'code': realtime.CLOSE_NOT_FOUND}],
+        )
+
+    def test_message_is_saved_and_fanned_out(self):
+        broadcast = realtime.get_broadcast()
+        group = realtime.chat_group_name(self.property.pk, self.student.pk, self.owner.pk)
+
+        async def conversation(inbox, outbox):
+            self.assertEqual(await asyncio.wait_for(outbox.get(), 5), {'type': 'websocket.accept'})
+            await inbox.put({'type': 'websocket.receive', 'text': json.dumps({'message': 'Is it still available?'})})
+            delivered = await asyncio.wait_for(outbox.get(), 5)
+            self.assertEqual(json.loads(delivered['text'])['message'], 'Is it still available?')
+            await inbox.put({'type': 'websocket.disconnect'})
+
+        self.run_socket(self.scope(self.student), conversation)
+        message = ChatMessage.objects.get()
+        self.assertEqual((message.sender, message.receiver, message.property_id), (self.student, self.owner, self.property.pk))
+        self.assertEqual(broadcast.published, [(group, realtime.serialize_message(message))])
+
+    def test_disconnect_unsubscribes(self):
+        broadcast = realtime.get_broadcast()
+        group = realtime.chat_group_name(self.property.pk, self.student.pk, self.owner.pk)
+
+        async def conversation(inbox, outbox):
+            await asyncio.wait_for(outbox.get(), 5) # Accepted
+            self.assertEqual(broadcast.subscriber_count(group), 1)
+            await inbox.put({'type': 'websocket.disconnect'})
+
+        self.run_socket(self.scope(self.student), conversation)
+        self.assertEqual(broadcast.subscriber_count(group), 0)
+
+    def test_database_calls_close_old_connections(self):
+        with mock.patch.object(realtime, 'close_old_connections') as close_old_connections:
+            async_to_sync(realtime.database_sync_to_async(lambda: None))()
+        self.assertEqual(close_old_connections.call_count, 2)
+
+
+class ListingPageCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.property, = Property.objects.bulk_create([
+            Property(house_type='House', title='Cached House', rent=500, address='1 Jalan Cache', owner=cls.owner),
+        ])
+
+    def setUp(self):
+        caching.get_listing_cache().clear()
+
+    def cached_page(self, **params):
+        return caching.get_listing_cache().get(caching.listing_page_key(RequestFactory().get('/', params)))
+
+    def test_key_keeps_values_apart(self):
+        factory = RequestFactory()
+        keys = {
+            caching.listing_page_key(factory.get('/', {'q': 'a&b=c'})),
+            caching.listing_page_key(factory.get('/', {'q': 'a', 'b': 'c'})),
+            caching.listing_page_key(factory.get('/', {'q': 'a=b&c'})),
+        }
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(
+            caching.listing_page_key(factory.get('/?b=2&a=1')), caching.listing_page_key(factory.get('/?a=1&b=2')),
+        )
+
+    def test_anonymous_pages_are_cached_and_authenticated_ones_are_not(self):
+        render = mock.patch.object(views.HomePropertyListView, 'get_context_data', autospec=True,
+                                   side_effect=views.HomePropertyListView.get_context_data)
+        with render as get_context_data:
+            self.client.get(reverse('users:home'))
+            self.client.get(reverse('users:home'))
+        self.assertEqual(get_context_data.call_count, 1)
+        self.assertIsNotNone(self.cached_page())
+
+        caching.get_listing_cache().clear()
+        self.client.force_login(self.owner)
+        self.client.get(reverse('users:home'))
+        self.assertIsNone(self.cached_page())
+
+    def test_saving_or_deleting_a_property_invalidates_pages(self):
+        self.assertContains(self.client.get(reverse('users:home')), 'Cached House')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.property.title = 'Renamed House'
+            self.property.save()
+        response = self.client.get(reverse('users:home'))
+        self.assertContains(response, 'Renamed House')
+        self.assertNotContains(response, 'Cached House')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.property.delete()
+        self.assertNotContains(self.client.get(reverse('users:home')), 'Renamed House')
+
+    def test_page_rendered_during_a_bump_is_not_stored_under_the_new_version(self):
+        original = views.HomePropertyListView.get_context_data
+
+        def render_while_bumped(view, **kwargs):
+            caching.bump_listing_version() # e.g. a property saved by another request meanwhile
+            return original(view, **kwargs)
+
+        with mock.patch.object(views.HomePropertyListView, 'get_context_data', autospec=True, side_effect=render_while_bumped):
+            self.client.get(reverse('users:home'))
+        self.assertIsNone(self.cached_page())
+        self.client.get(reverse('users:home'))
+        self.assertIsNotNone(self.cached_page())
+
+    def test_evicted_version_does_not_restart_at_an_old_value(self):
+        cache = caching.get_listing_cache()
+        for _ in range(3):
+            caching.bump_listing_version()
+        used = caching.get_listing_version()
+        cache.delete(caching.LISTING_VERSION_KEY)
+        caching.bump_listing_version()
+        self.assertGreater(caching.get_listing_version(), used)
+        cache.delete(caching.LISTING_VERSION_KEY)
+        self.assertGreater(caching.get_listing_version(), used)
+
+
+class BookingCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'pw', role='student')
+        cls.property = Property.objects.create(
+            house_type='House', title='Test House', rent=500, address='1 Jalan Test', owner=cls.owner,
+        )
+
+    def counters(self):
+        self.property.refresh_from_db()
+        return (
+            self.property.pending_bookings_count, self.property.confirmed_bookings_count,
+            self.property.active_occupants, self.property.is_available,
+        )
+
+    def book(self, status='pending'):
+        return Booking.objects.create(property=self.property, tenant=self.tenant, start_date=date.today(), status=status)
+
+    def test_booking_lifecycle(self):
+        booking = self.book()
+        self.assertEqual(self.counters(), (1, 0, 1, False))
+
+        booking.status = 'confirmed'
+        booking.save()
+        self.assertEqual(self.counters(), (0, 1, 1, False))
+
+        booking.status = 'completed'
+        booking.save()
+        self.assertEqual(self.counters(), (0, 0, 0, True))
+
+    def test_rejected_booking_releases_the_property(self):
+        booking = self.book()
+        booking.status = 'rejected'
+        booking.save()
+        self.assertEqual(self.counters(), (0, 0, 0, True))
+
+    def test_deleted_booking_releases_the_property(self):
+        self.book().delete()
+        self.assertEqual(self.counters(), (0, 0, 0, True))
+
+    def test_unlisted_property_stays_unavailable(self):
+        self.property.is_listed = False
+        self.property.save()
+        self.assertFalse(self.counters()[3])
+
+        self.book().delete()
+        self.assertFalse(self.counters()[3])
+        self.assertEqual(Property.objects.recompute_booking_counters(), [])
+        self.assertFalse(self.counters()[3])
+
+        self.property.is_listed = True
+        self.property.save(update_fields=['is_listed'])
+        self.assertTrue(self.counters()[3])
+
+    def test_saving_a_stale_instance_keeps_the_counters(self):
+        # An edit form or the admin loaded the property before the booking came in
+        stale = Property.objects.get(pk=self.property.pk)
+        self.book()
+        stale.title = 'Renamed House'
+        stale.save()
+        self.assertEqual(self.counters(), (1, 0, 1, False))
+        self.assertEqual(self.property.title, 'Renamed House')
+
+        stale.is_listed = True
+        stale.save(update_fields=['is_listed'])
+        self.assertEqual(self.counters(), (1, 0, 1, False))
+
+    def test_reconcile_command_repairs_drift(self):
+        self.book()
+        Property.objects.filter(pk=self.property.pk).update(pending_bookings_count=0, active_occupants=5, is_available=True)
+
+        out = io.StringIO()
+        call_command('reconcile_booking_counters', '--dry-run', stdout=out)
+        self.assertIn("1 properties drifted.", out.getvalue())
+        self.assertEqual(self.counters(), (0, 0, 5, True))
+
+        out = io.StringIO()
+        call_command('reconcile_booking_counters', stdout=out)
+        self.assertIn(f"Property {self.property.pk} (Test House): pending=1 confirmed=0 occupants=1 available=False", out.getvalue())
+        self.assertEqual(self.counters(), (1, 0, 1, False))
+
+        out = io.StringIO()
+        call_command('reconcile_booking_counters', stdout=out)
+        self.assertIn("0 properties repaired.", out.getvalue())
@@ -1,19 +1,24 @@
 
 from django import views
 from django.urls import path
-from .views import HomePropertyListView, HomePropertyListView, PropertyDetailView, book_property, move_in_notice, chat_view, payment_view, receipt_pdf_view, receipt_view, recent_chats_api_view 
+from .views import HomePropertyListView, HomePropertyListView, PropertyDetailView, PropertyListAPIView, book_property, move_in_notice, chat_view, chat_history_api_view, payment_view, receipt_pdf_status_view, receipt_pdf_view, receipt_view, recent_chats_api_view, request_stats_view, metrics_view 
 
 app_name = 'users'
 
 urlpatterns = [
 
     path('', HomePropertyListView.as_view(), name='home'),
+    path('api/properties/', PropertyListAPIView.as_view(), name='property_list_api'), # NEW Listing API (cursor pagination)
     path('property/<int:pk>/', PropertyDetailView.as_view(), name='property_detail'),
     path('property/<int:pk>/book/', book_property, name='book_property'), # NEW Booking URL
     path('booking/<int:booking_pk>/notice/', move_in_notice, name='move_in_notice'), # NEW Move-in Notice URL
     path('property/<int:property_pk>/chat/<int:other_user_pk>/', chat_view, name='chat_with_user'), # NEW Chat URL
     path('api/recent-chats/', recent_chats_api_view, name='recent_chats_api'), # NEW API URL
+    path('api/property/<int:property_pk>/chat/<int:other_user_pk>/history/', chat_history_api_view, name='chat_history_api'),
     path('payment/', payment_view, name='payment'),
     path('receipt/<int:pk>/', receipt_view, name='receipt'),
     path('receipt/<int:pk>/pdf/', receipt_pdf_view, name='receipt_pdf'),
+    path('api/receipt/<int:pk>/pdf/status/', receipt_pdf_status_view, name='receipt_pdf_status'),
+    path('api/stats/requests/', request_stats_view, name='request_stats'), # NEW Request statistics (staff only)
+    path('metrics', metrics_view, name='metrics'), # NEW Prometheus metrics
 ]
\ No newline at end of file
@@ -1,84 +1,251 @@
 from decimal import Decimal
 import json
+import math
+import uuid
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView
-from django.db.models import Q # Used for complex queries
+from django.db import transaction
+from django.db.models import Prefetch, Q # Used for complex queries
 # IMPORTANT: Import AdditionalOccupant model
-from .models import PaymentRecord, Property, CustomUser, Booking, ChatMessage, AdditionalOccupant 
+from .models import PaymentRecord, Property, PropertyImage, CustomUser, Booking, ChatMessage, AdditionalOccupant, Conversation
 # IMPORTANT: Ensure AdditionalOccupantFormSet is imported (from forms.py)
 from .forms import AdditionalOccupantFormSet, BookingForm, MessageForm, PaymentForm 
+from .bookings import BookingError, create_booking
+from .caching import cache_listing_page, get_cached_listing_page, listing_page_key
+from .facets import apply_facets, facet_counts, get_facets
+from .geo import DEFAULT_RADIUS_KM, MAX_RADIUS_KM, nearest, within_radius
+from .geocoding import GeocodingError, geocode_search, to_coordinates
+from . import metrics
+from .images import responsive_image
+from .instrumentation import stats as request_stats
+from .pagination import ApproximateCountPaginator, InvalidCursor, approximate_count, keyset_page
+from .receipts import receipt_status, request_receipt, wait_for_receipt
+from .search import search_properties
 from django.contrib import messages # For Django messages framework
 from django.contrib.auth.mixins import LoginRequiredMixin # For class-based view login requirement
 from django.contrib.auth.decorators import login_required # For function-based view login requirement
 from django.urls import reverse # To dynamically get URL patterns
-from django.http import HttpResponse, JsonResponse # For API responses
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse # For API responses
 from datetime import date, datetime # Import date and datetime for validation
 from django.utils import timezone  # Correct import for timezone.now()
-import pdfkit
-from django.template.loader import render_to_string # Import render_to_string
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from functools import partial
+import logging
+
+logger = logging.getLogger('renthouse.views')
 
 # --- HomePropertyListView ---
 class HomePropertyListView(ListView):
     """
     A view to display a list of available properties.
-    Supports searching by query and filtering by house type and gender preference.
+    Supports relevance-ranked searching by query and filtering by house type and gender preference.
+    Pages are fetched by cursor (keyset pagination, see users/pagination.py) for the infinite
+    scroll; the older ?page=N links still work, with an approximate page count.
     """
     model = Property
     template_name = 'home.html' # Assuming your home.html is in users/templates/users/
     context_object_name = 'properties'
     paginate_by = 12 # Number of properties per page
+    paginator_class = ApproximateCountPaginator # Only used by ?page=N links
+    page_cache = True # Serve anonymous visitors from the listing cache
+
+    def get(self, request, *args, **kwargs):
+        """
+        Anonymous visitors all see the same page for the same query string, so their pages
+        are served from the listing cache (see users/caching.py) without touching the database.
+        """
+        cacheable = self.page_cache and not request.user.is_authenticated and not len(messages.get_messages(request))
+        if cacheable:
+            key = listing_page_key(request) # Before rendering: see users/caching.py
+            content = get_cached_listing_page(key)
+            if content is not None:
+                return HttpResponse(content)
+
+        response = super().get(request, *args, **kwargs)
+        if cacheable and not self.location_unavailable: # Retry lookups that failed next time
+            response.render()
+            if response.status_code == 200:
+                cache_listing_page(key, response.content)
+        return response
 
     def get_queryset(self):
         """
         Retrieves the queryset of properties, applying search and filter criteria.
         """
         # Start with all available properties, ordered by creation date (newest first)
-        queryset = Property.objects.filter(is_available=True).order_by('-created_at')
+        # (the primary key breaks ties, so that every listing has a distinct cursor position)
+        queryset = Property.objects.available().order_by('-created_at', '-pk')
 
-        # Apply search query filter
+        # Apply search query filter (indexed search, results ranked by relevance - see users/search.py)
         query = self.request.GET.get('q')
         if query:
-            queryset = queryset.filter(
-                Q(title__icontains=query) | # Search in property title
-                Q(address__icontains=query) | # Search in property address
-                Q(university_nearby__icontains=query) | # Search in university nearby field
-                Q(description__icontains=query) # Search in description
-            ).distinct() # Use distinct to avoid duplicate results if a property matches multiple Q conditions
-
-        # Apply house type filter
-        house_type_filter = self.request.GET.get('house_type')
-        if house_type_filter and house_type_filter != '': # Check for empty string, not 'all'
-            queryset = queryset.filter(house_type=house_type_filter)
-
-        # Apply gender preference filter (NEW)
-        gender_preference_filter = self.request.GET.get('gender_preference')
-        if gender_preference_filter and gender_preference_filter != '': # Check for empty string ('Any Gender')
-            # Assuming 'gender_preferred' is the field on your Property model
-            # You might need to adjust 'gender_preferred' to your actual field name
-            queryset = queryset.filter(gender_preferred=gender_preference_filter)
+            queryset = search_properties(queryset, query)
+
+        # --- NEW: Range filters of the advanced filter modal ---
+        for param, lookup in (('min_rent', 'rent__gte'), ('max_rent', 'rent__lte'), ('room_count', 'total_room__gte')):
+            value = self.request.GET.get(param, '')
+            if value.isdigit():
+                queryset = queryset.filter(**{lookup: int(value)})
+
+        # --- NEW: Proximity search ("near" a place, or lat/lng), nearest first - see users/geo.py ---
+        self.location, self.location_error, self.location_unavailable = self.get_search_location()
+        self.nearest_count = self.get_nearest_count()
+        if self.location and not self.nearest_count: # Nearest-N searches widen their own radius
+            queryset = within_radius(queryset, *self.location, radius_km=self.get_search_radius())
+
+        # --- NEW: Facets (house type, gender preference, bedrooms, ...) - see users/facets.py ---
+        # Their option counts are taken over the listings matching everything but the facets
+        self.facets = get_facets()
+        self.facet_queryset = queryset
+        queryset = apply_facets(queryset, self.request.GET, self.facets)
 
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        """
+        ?page=N: numbered pages (OFFSET), as before. Otherwise the page after ?cursor= (or the
+        first page), which costs the same however deep it is.
+        """
+        self.cursor_page = None
+        if self.page_kwarg in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        try:
+            self.cursor_page = keyset_page(queryset, page_size, self.request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return (None, None, self.cursor_page.object_list, self.cursor_page.has_next)
+
+    def get_search_location(self):
+        """
+        (coordinates, error message, lookup failed) of the place to search around: explicit
+        lat/lng parameters, or the `near` place name geocoded on the server (see geocode_search).
+        """
+        if self.request.GET.get('lat') and self.request.GET.get('lng'):
+            coordinates = to_coordinates(self.request.GET['lat'], self.request.GET['lng'])
+            return coordinates, None if coordinates else "Invalid location.", False
+        near = self.request.GET.get('near', '').strip()
+        if not near:
+            return None, None, False
+        try:
+            coordinates = geocode_search(near)
+        except GeocodingError:
+            return None, "Location search is temporarily unavailable.", True
+        return coordinates, None if coordinates else f"Could not find '{near}'.", False
+
+    def get_nearest_count(self):
+        # Only the JSON listing (PropertyListAPIView) answers ?nearest=N
+        return None
+
+    def get_search_radius(self):
+        try:
+            radius = float(self.request.GET.get('radius') or DEFAULT_RADIUS_KM)
+        except ValueError:
+            return DEFAULT_RADIUS_KM
+        if not math.isfinite(radius): # float() accepts "nan" and "inf"
+            return DEFAULT_RADIUS_KM
+        return min(max(radius, 0.1), MAX_RADIUS_KM)
+
     def get_context_data(self, **kwargs):
         """
         Adds additional context variables to the template.
         """
         context = super().get_context_data(**kwargs)
         
-        # Pass house type choices for filter dropdown
-        context['property_type_choices'] = Property.HOUSE_TYPE_CHOICES 
-        context['current_house_type'] = self.request.GET.get('house_type', '') # Keep selected filter active
-
-        # Pass gender choices for filter dropdown (NEW)
-        context['property_gender_choices'] = Property.GENDER_PREFERENCE_CHOICES
-        context['current_gender_preference'] = self.request.GET.get('gender_preference', '') # Keep selected filter active
-
         context['current_room_count'] = self.request.GET.get('room_count', '') # Keep room count if set
         context['search_query'] = self.request.GET.get('q', '') # Keep search query in the input field
+        # NEW: Facets with their option counts (one query), and the other filters of the modal
+        context['facets'] = {facet['name']: facet for facet in facet_counts(self.facet_queryset, self.request.GET, self.facets)}
+        context['current_min_rent'] = self.request.GET.get('min_rent', '')
+        context['current_max_rent'] = self.request.GET.get('max_rent', '')
+        # Current filters as a query string (for pagination links), and as hidden inputs of the
+        # quick filter bar, which only has the house type and gender selects
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        params.pop('cursor', None)
+        context['filter_querystring'] = params.urlencode()
+        context['preserved_filters'] = [
+            (key, value) for key, values in params.lists() if key not in ('house_type', 'gender_preference') for value in values
+        ]
+        # NEW: Proximity search
+        context['current_near'] = self.request.GET.get('near', '')
+        context['current_radius'] = self.get_search_radius() if context['current_near'] else ''
+        context['geo_search'] = self.location is not None
+        context['location_error'] = self.location_error
+        # NEW: Cursor of the next page (infinite scroll), and the number of results on the first page
+        context['next_cursor'] = self.cursor_page.next_cursor if self.cursor_page else None
+        if self.cursor_page and not self.request.GET.get('cursor'):
+            context['result_count'], context['result_count_exact'] = approximate_count(self.object_list)
+        context['card_cache_timeout'] = settings.LISTING_CARD_CACHE_TIMEOUT # Per-card fragment cache
         context['logo_text_color'] = '#7fc29b' # Example dynamic styling
         context['header_button_color'] = '#e91e63' # Example dynamic styling
         return context
 
+# --- PropertyListAPIView ---
+class PropertyListAPIView(HomePropertyListView):
+    """
+    The home listing as JSON, with the same search and filter parameters, one page per request:
+    pass the returned `next_cursor` as ?cursor= to get the following page.
+    The first page also has an approximate `count` of the results (see users/pagination.py).
+    With a location (near, or lat and lng), ?nearest=N returns the N nearest listings instead,
+    as one page, searching up to `radius` km away (MAX_RADIUS_KM when not given).
+    """
+    page_cache = False
+    max_nearest = 50 # Largest N of ?nearest=N
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        if self.location_error:
+            return JsonResponse({'error': self.location_error}, status=503 if self.location_unavailable else 400)
+        if self.nearest_count:
+            if not self.location:
+                return JsonResponse({'error': "Nearest listings need a location (near, or lat and lng)."}, status=400)
+            max_radius_km = self.get_search_radius() if request.GET.get('radius') else MAX_RADIUS_KM
+            found = nearest(queryset, *self.location, self.nearest_count, max_radius_km=max_radius_km)
+            return JsonResponse({
+                'results': [self.serialize(property_obj) for property_obj in found],
+                'next_cursor': None,
+                'has_next': False,
+                'count': len(found),
+                'count_exact': True,
+            })
+        cursor = request.GET.get('cursor')
+        try:
+            page = keyset_page(queryset, self.get_paginate_by(queryset), cursor)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        data = {
+            'results': [self.serialize(property_obj) for property_obj in page],
+            'next_cursor': page.next_cursor,
+            'has_next': page.has_next,
+        }
+        if not cursor:
+            data['count'], data['count_exact'] = approximate_count(queryset)
+        return JsonResponse(data)
+
+    def serialize(self, property_obj):
+        image = responsive_image(property_obj.main_image, property_obj.image_derivatives, 'card') if property_obj.main_image else None
+        return {
+            'id': property_obj.pk,
+            'title': property_obj.title,
+            'url': reverse('users:property_detail', kwargs={'pk': property_obj.pk}),
+            'address': property_obj.address,
+            'house_type': property_obj.house_type,
+            'bedrooms': property_obj.bedrooms,
+            'rent': property_obj.rent,
+            'image': image['src'] if image else None,
+            'distance_km': round(property_obj.distance_km, 2) if self.location else None,
+            'created_at': property_obj.created_at,
+        }
+
+    def get_nearest_count(self):
+        value = self.request.GET.get('nearest', '')
+        if not value.isdigit() or not int(value):
+            return None
+        return min(int(value), self.max_nearest)
+
+
 def property_detail_view(request, property_pk):
     property_obj = get_object_or_404(Property, pk=property_pk)
     
@@ -100,6 +267,13 @@ class PropertyDetailView(DetailView):
     template_name = 'property_details.html'
     context_object_name = 'property'
 
+    def get_queryset(self):
+        # The gallery is fetched with one extra query however many images the property has
+        return Property.objects.select_related('owner').prefetch_related(
+            Prefetch('images', queryset=PropertyImage.objects.order_by('position', 'pk')),
+            'amenities',
+        )
+
     def get_context_data(self, **kwargs):
         """
         Adds additional context variables to the template.
@@ -107,7 +281,7 @@ class PropertyDetailView(DetailView):
         context = super().get_context_data(**kwargs)
 
         # Check if the current user has any confirmed bookings (active tenant)
-        is_active_tenant = Booking.objects.filter(
+        is_active_tenant = self.request.user.is_authenticated and Booking.objects.filter(
             tenant=self.request.user, status='confirmed'
         ).exists()
 
@@ -131,18 +305,21 @@ def book_property(request, pk):
         return redirect('login:login')
 
     # NEW VALIDATION: Restrict user from booking more than 1 house
-    # Check for existing 'pending' or 'confirmed' bookings by the current user
-    existing_bookings = Booking.objects.filter(
-        tenant=request.user,
-        status__in=['pending', 'confirmed']
-    )
-    if existing_bookings.exists():
-        messages.error(request, "You already have a pending or confirmed booking. You can only have one active booking at a time.")
-        # Redirect to their dashboard or home page
-        if request.user.role == 'student':
-            return redirect('tenant:tenant_home')
-        else: # For superusers, they might not have a specific dashboard like students
-            return redirect('users:home')
+    # Check for existing 'pending' or 'confirmed' bookings by the current user.
+    # Only done up front when showing the form: on submit, create_booking repeats this check
+    # under a row lock, and a resubmitted form must still reach it to get its booking back.
+    if request.method != 'POST':
+        existing_bookings = Booking.objects.filter(
+            tenant=request.user,
+            status__in=['pending', 'confirmed']
+        )
+        if existing_bookings.exists():
+            messages.error(request, "You already have a pending or confirmed booking. You can only have one active booking at a time.")
+            # Redirect to their dashboard or home page
+            if request.user.role == 'student':
+                return redirect('tenant:tenant_home')
+            else: # For superusers, they might not have a specific dashboard like students
+                return redirect('users:home')
         
     if request.method == 'POST':
         # Always initialize forms and formsets with POST data on submission
@@ -163,46 +340,39 @@ def book_property(request, pk):
         }
 
         if form.is_valid() and occupant_formset.is_valid():
-            total_occupants_from_formset = 0
-            for form_in_set in occupant_formset:
-                if form_in_set.cleaned_data and not form_in_set.cleaned_data.get('DELETE'):
-                    total_occupants_from_formset += 1
-
-            total_occupants = 1 + total_occupants_from_formset # Primary booker + valid additional occupants
+            occupant_forms = [
+                form_in_set for form_in_set in occupant_formset
+                if form_in_set.cleaned_data and not form_in_set.cleaned_data.get('DELETE')
+            ]
+            total_occupants = 1 + len(occupant_forms) # Primary booker + valid additional occupants
 
             if total_occupants > max_tenants_value:
                 form.add_error(None, f"This property can accommodate a maximum of {max_tenants_value} tenant(s). You have {total_occupants} total occupants in your booking.")
                 # Return render with the already populated forms/formset
                 return render(request, 'booking_form.html', context_for_errors)
             else:
-                booking = form.save(commit=False)
-                booking.property = property_instance
-                booking.tenant = request.user
-                booking.number_of_occupants = total_occupants
-                booking.save()
-
-                for form_in_set in occupant_formset:
-                    if form_in_set.cleaned_data and not form_in_set.cleaned_data.get('DELETE'):
-                        occupant_instance = form_in_set.save(commit=False)
-                        occupant_instance.booking = booking
-                        occupant_instance.save()
-
-                property_instance.is_available = False
-                property_instance.save()
-                messages.success(request, 'Your booking has been successfully submitted and the property is now marked as unavailable!') 
+                try:
+                    booking, created = create_booking(
+                        property_instance.pk,
+                        request.user,
+                        form,
+                        occupant_forms,
+                        idempotency_key=form.cleaned_data.get('idempotency_key'),
+                    )
+                except BookingError as e:
+                    messages.error(request, str(e))
+                    return redirect('tenant:tenant_home')
+
+                if created:
+                    # Saving the booking updated the property's booking counters, which marks it unavailable
+                    messages.success(request, 'Your booking has been successfully submitted and the property is now marked as unavailable!') 
                 return redirect('users:move_in_notice', booking_pk=booking.pk)
         else:
-            # If main form or formset is not valid, print errors for debugging and re-render
-            print("Form is NOT valid. Errors:")
-            print("Main Form Errors:", form.errors)
-            if form.non_field_errors:
-                print("Main Form Non-Field Errors:", form.non_field_errors)
-            
-            print("\nOccupant Formset is NOT valid. Errors:")
-            print("Formset Non-Form Errors:", occupant_formset.non_form_errors())
-            for i, form_in_set in enumerate(occupant_formset):
-                if form_in_set.errors:
-                    print(f"Form {i} Errors:", form_in_set.errors)
+            # If main form or formset is not valid, log the errors for debugging and re-render
+            logger.debug(
+                "Booking form is not valid. Form errors: %s; occupant formset errors: %s %s",
+                form.errors.as_json(), occupant_formset.non_form_errors(), occupant_formset.errors,
+            )
             
             # Return render with the already populated forms/formset
             return render(request, 'booking_form.html', context_for_errors)
@@ -212,6 +382,7 @@ def book_property(request, pk):
             'full_name_on_form': request.user.full_name,
             'gender_on_form': request.user.gender,
             'email_on_form': request.user.email,
+            'idempotency_key': uuid.uuid4().hex,
         })
         occupant_formset = AdditionalOccupantFormSet(
             prefix='occupants',
@@ -249,41 +420,82 @@ def move_in_notice(request, booking_pk):
     return render(request, 'move_in_notice.html', context)
 
 
+# --- Chat helpers ---
+CHAT_PAGE_SIZE = 30 # Number of messages rendered / returned per chat history page
+
+
+def _can_access_chat(user, property_obj, target_user):
+    """
+    Only owner-tenant pairs for a property (or superusers) may read or write a chat.
+    """
+    # Scenario 1: owner (logged-in user) is chatting with a student (target user)
+    if user == property_obj.owner and target_user.role == 'student':
+        return True
+    # Scenario 2: Student (logged-in user) is chatting with the owner (property owner)
+    if user.role == 'student' and target_user == property_obj.owner:
+        return True
+    # Scenario 3: Superuser can access any chat
+    return user.is_superuser
+
+
+def _encode_chat_cursor(message):
+    return f"{message.timestamp.isoformat()}|{message.pk}"
+
+
+def _decode_chat_cursor(cursor):
+    """
+    Parses a '<timestamp>|<id>' cursor. Raises ValueError if it is malformed.
+    """
+    timestamp_str, _, pk_str = cursor.rpartition('|')
+    timestamp = datetime.fromisoformat(timestamp_str)
+    if timezone.is_naive(timestamp):
+        raise ValueError("Cursor timestamp must be timezone-aware.")
+    return timestamp, int(pk_str)
+
+
+def get_chat_page(property_obj, user, other_user, before=None, page_size=CHAT_PAGE_SIZE):
+    """
+    Returns (messages, has_more) for one page of the chat between two users about a property,
+    using keyset pagination on (timestamp, id). Messages are in chronological order;
+    `before` is a decoded cursor and limits the page to messages older than it.
+    """
+    chat_messages = ChatMessage.objects.filter(
+        Q(sender=user, receiver=other_user) | Q(sender=other_user, receiver=user),
+        property=property_obj,
+    )
+    if before is not None:
+        before_timestamp, before_pk = before
+        chat_messages = chat_messages.filter(
+            Q(timestamp__lt=before_timestamp) | Q(timestamp=before_timestamp, pk__lt=before_pk)
+        )
+
+    # Fetch one extra row to know whether an older page exists
+    page = list(chat_messages.order_by('-timestamp', '-pk')[:page_size + 1])
+    has_more = len(page) > page_size
+    page = page[:page_size]
+    page.reverse()
+    return page, has_more
+
+
 # --- chat_view view ---
 @login_required
 def chat_view(request, property_pk, other_user_pk):
     """
     Handles the display and sending of chat messages between a tenant and a owner for a specific property.
     Ensures that only authorized users (owner-tenant pairs for a property, or superusers) can access the chat.
+    Only the newest CHAT_PAGE_SIZE messages are rendered; older ones are loaded from chat_history_api_view.
     """
-    property_obj = get_object_or_404(Property, pk=property_pk)
+    property_obj = get_object_or_404(Property.objects.select_related('owner'), pk=property_pk)
     target_user = get_object_or_404(CustomUser, pk=other_user_pk)
     is_active_tenant = Booking.objects.filter(tenant=request.user, status='confirmed').exists()
 
-    is_authorized = False
-    # Scenario 1: owner (logged-in user) is chatting with a student (target user)
-    if request.user == property_obj.owner and (target_user.role == 'student'):
-        is_authorized = True
-    # Scenario 2: Student (logged-in user) is chatting with the owner (property owner)
-    elif (request.user.role == 'student') and target_user == property_obj.owner:
-        is_authorized = True
-    # Scenario 3: Superuser can access any chat
-    elif request.user.is_superuser:
-        is_authorized = True
-
-    if not is_authorized:
+    if not _can_access_chat(request.user, property_obj, target_user):
         messages.error(request, "You are not authorized to view this chat.")
         return redirect('users:home') # Redirect to a safe page if not authorized
 
     # Determine if the current user is the owner of the property (for UI purposes)
     is_current_user_owner = (request.user == property_obj.owner)
 
-    # Retrieve chat messages between the two users for this specific property
-    chat_messages = ChatMessage.objects.filter(
-        Q(sender=request.user, receiver=target_user, property=property_obj) |
-        Q(sender=target_user, receiver=request.user, property=property_obj)
-    ).order_by('timestamp') # Order messages by timestamp
-
     if request.method == 'POST':
         form = MessageForm(request.POST)
         if form.is_valid():
@@ -306,21 +518,65 @@ def chat_view(request, property_pk, other_user_pk):
             messages.error(request, "Please correct the message error.")
     else: # GET request: Initialize an empty message form
         form = MessageForm()
+        # Opening the chat clears this user's unread counter for the conversation
+        Conversation.objects.mark_read(property_obj, request.user, target_user)
+
+    # Retrieve the newest page of chat messages between the two users for this specific property
+    chat_messages, has_older_messages = get_chat_page(property_obj, request.user, target_user)
 
     context = {
         'property': property_obj,
         'target_user': target_user,
         'chat_messages': chat_messages,
+        'has_older_messages': has_older_messages,
+        'older_messages_cursor': _encode_chat_cursor(chat_messages[0]) if chat_messages else '',
         'form': form,
         'logo_text_color': '#7fc29b',
         'header_button_color': '#e91e63',
         'is_active_tenant': is_active_tenant,
-        'is_current_user_owner': request.user == property_obj.owner,
         'is_current_user_owner': is_current_user_owner,
     }
     return render(request, 'chat_page.html', context)
 
 
+# --- chat_history_api_view ---
+@login_required
+def chat_history_api_view(request, property_pk, other_user_pk):
+    """
+    API endpoint returning the page of chat messages older than the `before` cursor,
+    used by the chat page to load history on scroll.
+    """
+    property_obj = get_object_or_404(Property.objects.select_related('owner'), pk=property_pk)
+    target_user = get_object_or_404(CustomUser, pk=other_user_pk)
+
+    if not _can_access_chat(request.user, property_obj, target_user):
+        return JsonResponse({'error': 'You are not authorized to view this chat.'}, status=403)
+
+    before = None
+    cursor = request.GET.get('before')
+    if cursor:
+        try:
+            before = _decode_chat_cursor(cursor)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+
+    chat_messages, has_more = get_chat_page(property_obj, request.user, target_user, before=before)
+
+    return JsonResponse({
+        'messages': [
+            {
+                'id': message.pk,
+                'message': message.message,
+                'timestamp': message.timestamp.isoformat(),
+                'sender_is_me': message.sender_id == request.user.pk,
+            }
+            for message in chat_messages
+        ],
+        'has_more': has_more,
+        'next_cursor': _encode_chat_cursor(chat_messages[0]) if chat_messages and has_more else None,
+    })
+
+
 # --- recent_chats_api_view ---
 @login_required
 def recent_chats_api_view(request):
@@ -328,47 +584,28 @@ def recent_chats_api_view(request):
     API endpoint to fetch recent chat conversations for the logged-in user.
     Returns a JSON response with chat details.
     """
-    user_id = request.user.id
-    # Fetch all messages involving the user, ordered by most recent first
-    all_messages = ChatMessage.objects.filter(
-        Q(sender=request.user) | Q(receiver=request.user)
-    ).order_by('-timestamp')
+    # One row per conversation, maintained when messages are created (see Conversation model)
+    conversations = Conversation.objects.for_user(request.user)
 
     chats_data = []
-    processed_conversations = set()
-
-    for msg in all_messages:
-        # Determine the 'other' participant in the conversation
-        other_user = msg.sender if msg.receiver == request.user else msg.receiver
-
-        # Skip if the 'other user' is the current user themselves (self-chat case)
-        if other_user == request.user:
-            continue
-
-        # Create a canonical key for the conversation (property_id, min_user_id, max_user_id)
-        user_ids = sorted([request.user.id, other_user.id])
-        conversation_key = (msg.property.id if msg.property else None, user_ids[0], user_ids[1])
-
-        if conversation_key in processed_conversations:
-            continue  # Already processed this conversation
-
-        processed_conversations.add(conversation_key)
+    for conversation in conversations:
+        other_user = conversation.other_participant(request.user)
+        last_message = conversation.last_message
+        property_obj = conversation.property
 
         chats_data.append({
-            'property_id': msg.property.pk if msg.property else None,
-            'property_title': msg.property.title if msg.property else 'General Chat',
-            'property_main_image': msg.property.main_image.url if msg.property and msg.property.main_image else None,
+            'property_id': property_obj.pk,
+            'property_title': property_obj.title,
+            'property_main_image': property_obj.main_image.url if property_obj.main_image else None,
             'other_user_id': other_user.pk,
             'other_user_username': other_user.username,
             'other_user_full_name': other_user.full_name or other_user.username,
-            'last_message': msg.message,
-            'last_message_timestamp': msg.timestamp.isoformat(),
-            'last_message_sender_is_me': msg.sender == request.user,
+            'last_message': last_message.message if last_message else '',
+            'last_message_timestamp': conversation.last_message_at.isoformat(),
+            'last_message_sender_is_me': bool(last_message) and last_message.sender_id == request.user.pk,
+            'unread_count': conversation.unread_count_for(request.user),
         })
 
-    # Sort the final list by the timestamp of the last message in descending order (most recent first)
-    chats_data.sort(key=lambda x: x['last_message_timestamp'], reverse=True)
-
     return JsonResponse({'chats': chats_data})
 
 # --- PAYMENT VIEWS ---
@@ -424,6 +661,13 @@ def payment_view(request):
             ]
             payment_record.transaction_id = "_".join(transaction_id_parts)
             payment_record.save(update_fields=['transaction_id']) # Save just the transaction_id
+            if not request.user.is_authenticated:
+                # Lets the guest open the receipt (and its PDF) from this browser session
+                request.session[GUEST_RECEIPTS_SESSION_KEY] = [
+                    *request.session.get(GUEST_RECEIPTS_SESSION_KEY, []), payment_record.pk,
+                ]
+            # Render the PDF receipt in the background so that its download is instant
+            transaction.on_commit(partial(request_receipt, payment_record))
 
             messages.success(request, "Payment successful! Here is your receipt.")
             return redirect('users:receipt', pk=payment_record.pk)
@@ -462,11 +706,30 @@ def payment_view(request):
     return render(request, 'payment.html', context)
 
 
+GUEST_RECEIPTS_SESSION_KEY = 'guest_receipts'
+
+
+def can_view_receipt(request, payment_record):
+    """
+    A receipt is shown to its payer, its receiver, the owner of the booked property and staff;
+    a guest payer only sees the receipts paid in their own session.
+    """
+    user = request.user
+    if user.is_authenticated:
+        if user.is_staff or user.pk in (payment_record.user_id, payment_record.receiver_of_payment_id):
+            return True
+        if payment_record.booking_id and payment_record.booking.property.owner_id == user.pk:
+            return True
+    return payment_record.pk in request.session.get(GUEST_RECEIPTS_SESSION_KEY, [])
+
+
 def receipt_view(request, pk):
     """
     Displays the payment receipt by retrieving the PaymentRecord from the database.
     """
-    payment_record = get_object_or_404(PaymentRecord, pk=pk)
+    payment_record = get_object_or_404(PaymentRecord.objects.select_related('booking__property'), pk=pk)
+    if not can_view_receipt(request, payment_record):
+        raise Http404("No receipt found.")
 
     context = {
         'payment_record': payment_record,
@@ -478,36 +741,79 @@ def receipt_view(request, pk):
 
 def receipt_pdf_view(request, pk):
     """
-    Generates a PDF receipt for a PaymentRecord using pdfkit (wkhtmltopdf).
+    Sends the PDF receipt of a PaymentRecord.
+    Receipts are rendered by the background workers (users/receipts.py) and kept on disk, so
+    this is normally a plain file send. A receipt that is not rendered yet is waited for up to
+    settings.RECEIPT_PDF_WAIT_SECONDS (briefly: the request holds a web worker meanwhile); the
+    receipt page polls receipt_pdf_status_view instead.
     """
+    payment_record = get_object_or_404(
+        PaymentRecord.objects.select_related('user', 'booking__property', 'receiver_of_payment'), pk=pk
+    )
+    if not can_view_receipt(request, payment_record):
+        raise Http404("No receipt found.")
+
     try:
-        pass
-    except ImportError:
-        messages.error(request, "PDF generation libraries not installed. Please install pdfkit (pip install pdfkit) and wkhtmltopdf.")
+        path = wait_for_receipt(payment_record, timeout=getattr(settings, 'RECEIPT_PDF_WAIT_SECONDS', 1))
+    except FuturesTimeoutError:
+        messages.info(request, "Your PDF receipt is still being prepared. Please try the download again in a moment.")
+        return redirect('users:receipt', pk=pk)
+    except Exception as e:
+        messages.error(request, f"Error generating PDF: {e}.")
         return redirect('users:receipt', pk=pk)
 
-    payment_record = get_object_or_404(PaymentRecord, pk=pk)
+    return FileResponse(
+        open(path, 'rb'),
+        as_attachment=True,
+        filename=f"receipt_{payment_record.pk}.pdf",
+        content_type='application/pdf',
+    )
 
-    template_path = 'receipt.html'
-    context = {'payment_record': payment_record}
 
-    html = render_to_string(template_path, context)
+# --- NEW API VIEW: Receipt PDF job status ---
+def receipt_pdf_status_view(request, pk):
+    """
+    Starts rendering the PDF receipt of a PaymentRecord if needed and reports its status
+    ('ready', 'pending' or 'failed') as JSON.
+    """
+    payment_record = get_object_or_404(
+        PaymentRecord.objects.select_related('user', 'booking__property', 'receiver_of_payment'), pk=pk
+    )
+    if not can_view_receipt(request, payment_record):
+        return JsonResponse({'error': 'You are not authorized to view this receipt.'}, status=403)
+    return JsonResponse({
+        'status': receipt_status(payment_record),
+        'download_url': reverse('users:receipt_pdf', kwargs={'pk': pk}),
+    })
 
-    options = {
-        'enable-local-file-access': None,
-        'encoding': "UTF-8",
-    }
+def signup(request, pk):
+    return render(request, "signup.html")
 
-    try:
-        pdf = pdfkit.from_string(html, False, options=options)
-    except Exception as e:
-        messages.error(request, f"Error generating PDF: {e}. Ensure wkhtmltopdf is installed and in your system's PATH. You might need to configure its path in options.")
-        return redirect('users:receipt', pk=pk)
 
-    response = HttpResponse(pdf, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="receipt_{payment_record.pk}.pdf"'
-    return response
 
-def signup(request, pk):
-    return render(request, "signup.html")
+# --- request_stats_view ---
+@login_required
+def request_stats_view(request):
+    """
+    API endpoint (staff only) with the per-view request statistics of this process:
+    latency percentiles, SQL query counts and times, template time and likely N+1 queries.
+    See users/instrumentation.py.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff can view request statistics.'}, status=403)
+    return JsonResponse({
+        'sample_rate': settings.REQUEST_SAMPLE_RATE,
+        'window': settings.REQUEST_STATS_WINDOW,
+        'views': request_stats.summary(),
+    })
 
+
+# --- metrics_view ---
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint: request, booking, chat, payment, receipt and cache metrics of
+    every worker process (see users/metrics.py). Open to settings.METRICS_ALLOWED_IPS and staff.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponse("Forbidden.", status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)